@@ -1,11 +1,86 @@
 import os
 import sys
-import imp
 import json
 import maya.cmds as cmds
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
 
-#define the function to import the animation sequence from the selected json file
-def mgApplyFaceMocap(filePath):
+# the shared pipeline modules live next to this script, set PIPELINE_DIR when running it from the script editor
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.environ.get('PIPELINE_DIR', ''))
+#numpy isn't part of every Maya install, only the vertex sequence export and the binary face curves need it
+import face_curves
+import take_index
+import metrics
+
+
+#define the function to read every control curve as (control name, key times, key values) from a json file or a binary face curves file
+def load_face_curves(filePath):
+    if filePath.endswith(face_curves.EXTENSION):
+        #reading the binary face curves needs numpy, the json files don't, fail here with a clear ImportError
+        import numpy
+        return face_curves.iter_keys(face_curves.read_curves(filePath))
+    anim_keys = face_curves.read_face_anim_json(filePath)
+    return ((dict_key, [key_val[1] for key_val in anim_keys[dict_key]], [key_val[0] for key_val in anim_keys[dict_key]]) for dict_key in anim_keys)
+
+
+#exported control name -> (rig control without namespace, attribute), the same for every file of a batch
+control_attribute_cache = {}
+
+#define the function to map an exported control name to the rig control and attribute to key
+def resolve_control_attribute(dict_key):
+    if dict_key in control_attribute_cache:
+        return control_attribute_cache[dict_key]
+
+    ctrl = dict_key
+    attr = 'translateY'
+    if '.' in ctrl:
+        ctrl_string_list = ctrl.split('.')
+        ctrl = ctrl_string_list[0]
+        if len(ctrl_string_list)>2:
+            attr = ctrl_string_list[1].replace('Location', 'translate').replace('Rotation', 'rotate').replace('Scale', 'scale') + ctrl_string_list[-1].upper()
+        else:
+            attr = 'translate' + ctrl_string_list[-1].upper()
+
+    # check for numbers at the end of cntrl name
+    ctrl_name = ctrl
+    if ctrl_name.split('_')[-1].isdigit():
+        ctrl_name = ctrl_name.replace('_' + ctrl_name.split('_')[-1], '')
+
+    control_attribute_cache[dict_key] = (ctrl_name, attr)
+    return ctrl_name, attr
+
+
+#define the function to key a whole curve with one API call instead of one setKeyframe per key
+def set_curve_keys(ctrl_name, attr, times, values):
+    if not times:
+        return
+    plug = om.MSelectionList().add(ctrl_name + '.' + attr).getPlug(0)
+    anim_curves = oma.MAnimUtil.findAnimation(plug)
+    if len(anim_curves) > 0:
+        curve_fn = oma.MFnAnimCurve(anim_curves[0])
+    else:
+        curve_fn = oma.MFnAnimCurve()
+        curve_fn.create(plug)
+
+    # setKeyframe takes angles and distances in UI units, the API in radians and centimeters
+    curve_type = curve_fn.animCurveType
+    if curve_type in (oma.MFnAnimCurve.kAnimCurveTA, oma.MFnAnimCurve.kAnimCurveUA):
+        to_radians = om.MAngle(1.0, om.MAngle.uiUnit()).asRadians()
+        values = [value * to_radians for value in values]
+    elif curve_type in (oma.MFnAnimCurve.kAnimCurveTL, oma.MFnAnimCurve.kAnimCurveUL):
+        to_centimeters = om.MDistance(1.0, om.MDistance.uiUnit()).asCentimeters()
+        if to_centimeters != 1.0:
+            values = [value * to_centimeters for value in values]
+
+    time_unit = om.MTime.uiUnit()
+    key_times = om.MTimeArray([om.MTime(key_time, time_unit) for key_time in times])
+    # merge with the keys already on the curve like setKeyframe, a key at the same time is replaced
+    curve_fn.addKeys(key_times, om.MDoubleArray(values), keepExistingKeys=True)
+
+
+#define the function to import the animation sequence from the selected json or binary file
+#bulk keys every control curve with one call, bulk=False keeps the original one setKeyframe per key
+def mgApplyFaceMocap(filePath, bulk=True):
     objLs = cmds.ls(sl=1)
     namespace = ''
         
@@ -14,41 +89,38 @@ def mgApplyFaceMocap(filePath):
             namespace = objLs[0].split(':')[0] + ':'
         else:
             namespace = ''
-    anim_keys_file = imp.load_source('', filePath)
-    
-    anim_keys = anim_keys_file.anim_keys_dict
     
-    for dict_key in anim_keys:
-        keyframes_list = anim_keys[dict_key]
-        ctrl = dict_key
-        attr = 'translateY'
-        if '.' in ctrl:
-            ctrl_string_list = ctrl.split('.')
-            ctrl = ctrl_string_list[0]
-            if len(ctrl_string_list)>2:
-                attr = ctrl_string_list[1].replace('Location', 'translate').replace('Rotation', 'rotate').replace('Scale', 'scale') + ctrl_string_list[-1].upper()
-            else:
-                attr = 'translate' + ctrl_string_list[-1].upper()
+    #the keys set are the items of the span
+    with metrics.span('apply_face_mocap', file=os.path.basename(filePath), bulk=bulk) as apply_span:
+        for dict_key, times, values in load_face_curves(filePath):
+            ctrl_name, attr = resolve_control_attribute(dict_key)
+            ctrl_name = namespace + ctrl_name
 
-        # check for numbers at the end of cntrl name
-        
-        ctrl_name = ctrl
-        if ctrl_name.split('_')[-1].isdigit():
-            ctrl_name = ctrl_name.replace('_' + ctrl_name.split('_')[-1], '')
-        ctrl_name = namespace + ctrl_name
-
-        if cmds.objExists(ctrl_name):
-            for key_num in range(0,len(keyframes_list)):
-                key_val = keyframes_list[key_num]
-                cmds.setKeyframe(ctrl_name, attribute=attr, v = key_val[0], t=key_val[1] )
-        else:
-            print('Skipping ' + ctrl_name + ' as no such object exists.')
+            if cmds.objExists(ctrl_name):
+                if bulk:
+                    set_curve_keys(ctrl_name, attr, times, values)
+                else:
+                    for key_time, key_value in zip(times, values):
+                        cmds.setKeyframe(ctrl_name, attribute=attr, v = key_value, t=key_time )
+                apply_span.add_items(len(times))
+            else:
+                print('Skipping ' + ctrl_name + ' as no such object exists.')
             
     print('Applied Animation to Face Rig.')
 
 
 #define a function to get the frame value of the selected video
-def get_frame_numbers(filePath):
+def get_frame_numbers(filePath, index=None):
+    # the take index has the keyed frame count of every export
+    if index is not None:
+        take = index.find_artifact(filePath)
+        if take is not None and take.key_frames:
+            return take.key_frames
+
+    # the binary format has the frame count in its header
+    if filePath.endswith(face_curves.EXTENSION):
+        return face_curves.read_header(filePath)["num_frames"]
+
     # Read the contents of the file
     with open(filePath, "r") as file:
         content = file.read()
@@ -100,7 +172,65 @@ def export_obj_sequence(export_dir, frame_start, frame_end):
         print("Exported:", filename)
 
 
-def process_multiple_animation_sequences(sequence_dir, export_dir):
+#define a function to capture the deformed vertices of the selection for every frame into one packed file
+#instead of writing one OBJ per frame, the faces and UVs are exported once as an OBJ next to it
+def export_vertex_sequence(export_dir, frame_start, frame_end):
+    import numpy as np
+    import mesh_io
+
+    selection = cmds.ls(selection=True)
+
+    if not selection:
+        #end of the export
+        print("Nothing selected, nothing to export")
+        return
+
+    if not os.path.isdir(export_dir):
+        #if no such destination file, then end
+        print("Specified directory doesn't exist:", export_dir)
+        return
+
+    #meshes in selection order, the same vertex order as the OBJ export
+    selection_list = om.MSelectionList()
+    for obj in selection:
+        selection_list.add(obj)
+    meshes = [om.MFnMesh(selection_list.getDagPath(num)) for num in range(len(selection))]
+
+    #the topology doesn't change over the sequence, export it once
+    cmds.currentTime(frame_start, edit=True)
+    topology_path = os.path.join(export_dir, mesh_io.TOPOLOGY_FILE)
+    cmds.file(topology_path, save=False, force=True, exportSelected=True, type="OBJexport")
+
+    num_vertices = sum(mesh.numVertices for mesh in meshes)
+    vertices = np.empty((frame_end - frame_start + 1, num_vertices * 3), dtype=np.float32)
+    for row, i in enumerate(range(frame_start, frame_end + 1)):
+        try:
+            cmds.currentTime(i, edit=True)
+        except:
+            print("Couldn't go to frame", i)
+            raise
+
+        #world space positions like the OBJ export, MPoint has a 4th w component
+        offset = 0
+        for mesh in meshes:
+            points = np.array(mesh.getPoints(om.MSpace.kWorld), dtype=np.float64)[:, :3]
+            vertices[row, offset:offset + points.size] = points.ravel()
+            offset += points.size
+
+    filename = os.path.join(export_dir, mesh_io.VERTEX_SEQUENCE_FILE)
+    np.save(filename, vertices)
+    print("Exported:", filename, "with", len(vertices), "frames of", num_vertices, "vertices")
+
+
+EXPORTERS = {
+    "obj": export_obj_sequence,
+    "vertices": export_vertex_sequence,
+}
+
+
+def process_multiple_animation_sequences(sequence_dir, export_dir, export_mode="obj", index_path=take_index.DEFAULT_INDEX_PATH):
+    index = take_index.TakeIndex(index_path)
+
     #get the list of animation sequence files in the selected directory
     sequence_files = os.listdir(sequence_dir)
 
@@ -117,13 +247,24 @@ def process_multiple_animation_sequences(sequence_dir, export_dir):
         sequence_path = os.path.join(sequence_dir, sequence)
 
         #start to process
-        if sequence.endswith(".json"):
+        if sequence.endswith(".json") and os.path.splitext(sequence)[0] + face_curves.EXTENSION in sequence_files:
+            print("Skip the json file with a binary export next to it: "+sequence)
+        elif sequence.endswith(".json") or sequence.endswith(face_curves.EXTENSION):
             #calling all function!!! Let's go!!!
-            mgApplyFaceMocap(sequence_path)
-            frame_number = get_frame_numbers(sequence_path)
-            export_obj_sequence(folder_name, 1, frame_number)#export the newly created folder
+            with metrics.span('maya_sequence', sequence=sequence, mode=export_mode) as sequence_span:
+                mgApplyFaceMocap(sequence_path)
+                frame_number = get_frame_numbers(sequence_path, index)
+                sequence_span.items = frame_number
+                with metrics.span('maya_export', items=frame_number, sequence=sequence, mode=export_mode):
+                    EXPORTERS[export_mode](folder_name, 1, frame_number)#export the newly created folder
             print("Successful!")
 
+            #record the export folder of the take for the next stages
+            take = index.find_artifact(sequence_path)
+            if take is not None:
+                index.set_artifact(take.subject, take.take, "maya_export", folder_name)
+                index.set_stage(take.subject, take.take, "maya_export")
+
             if folder_counter < len(sequence_files):
                 folder_counter += 1
                 folder_name = os.path.join(export_dir, "Set_{}".format(folder_counter))
@@ -132,9 +273,17 @@ def process_multiple_animation_sequences(sequence_dir, export_dir):
         else:
             print("Skip the mismatched file: "+sequence)
 
+    index.close()
+
 
 sequence_dir = "H:\\datasets\\Fretlyn\\Face\\MetaHuman"
 export_dir = "H:\\datasets\\Fretlyn\\Face\\MetaHuman\\OBJ_Exports"
+#"obj" writes one OBJ per frame, "vertices" one packed vertices.npy per sequence plus topology.obj
+export_mode = "obj"
+#JSONL file of the timing spans (see metrics.py), None for the PIPELINE_METRICS environment variable or no spans
+metrics_path = None
 
 #call the function
-process_multiple_animation_sequences(sequence_dir, export_dir)
+if __name__ == "__main__":
+    metrics.configure(metrics_path, "Maya_Auto_Multiple_Export_Version2")
+    process_multiple_animation_sequences(sequence_dir, export_dir, export_mode)
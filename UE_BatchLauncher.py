@@ -0,0 +1,237 @@
+"""
+Run UE_PerformanceToSequence.py over a take range in several editor processes at once.
+
+The takes of the range that aren't done yet (see take_index.UE_STAGES) are split into shards of
+consecutive takes, every shard runs the worker command with its own --start_anim/--end_anim range.
+The launcher watches the take index for progress, retries failed shards (a retry only redoes the
+stages that aren't done) and merges the shard logs and outputs.
+
+The command is a template, {start} / {end} are the take range of the shard, {shard} its number,
+{gpu} the GPU of the worker slot and {output} a per-shard output folder that is merged into
+--output_path when the shard is done. The editor picks its GPU from -graphicsadapter, not from the
+environment, so with --gpus the command has to pass {gpu} to it. With --metrics every shard attempt
+is a span of metrics.py and the workers append their spans to the same file, e.g.:
+
+  python UE_BatchLauncher.py --subject Fretlyn --workers 4 --gpus 0,1 --output_path H:\\out --command
+    "UnrealEditor-Cmd.exe Face.uproject -graphicsadapter={gpu} -ExecutePythonScript=\\"UE_PerformanceToSequence.py --start_anim {start} --end_anim {end} --output_path {output}\\""
+
+  python UE_BatchLauncher.py ... --command "python fake_ue_worker.py -- --raw_data_path raw --start_anim {start} --end_anim {end} --output_path {output}"
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+import take_index
+import metrics
+
+
+def pending_takes(index, subject, start=None, end=None, stages=take_index.UE_STAGES):
+    """
+    Take numbers of a subject in [start, end] with a stage that isn't done.
+    """
+    return [take.take for take in index.takes(subject, start, end)
+            if index.resume_stage(subject, take.take, stages) is not None]
+
+
+def split_shards(takes, takes_per_shard):
+    """
+    Split sorted take numbers into shards of at most takes_per_shard takes, as dicts with the
+    [start, end] take range the worker processes.
+    """
+    shards = []
+    for offset in range(0, len(takes), takes_per_shard):
+        shard_takes = takes[offset:offset + takes_per_shard]
+        shards.append({
+            "shard": len(shards),
+            "start": shard_takes[0],
+            "end": shard_takes[-1],
+            "takes": shard_takes,
+            "attempts": [],
+            "status": "pending",
+        })
+    return shards
+
+
+def shard_log_path(work_dir, shard, attempt):
+    return os.path.join(work_dir, "logs", f"shard_{shard['shard']:03d}_attempt_{attempt}.log")
+
+
+def shard_output_path(work_dir, shard):
+    return os.path.join(work_dir, "output", f"shard_{shard['shard']:03d}")
+
+
+def launch_shard(shard, command_template, work_dir, gpu):
+    """
+    Start the worker process of a shard, its output goes to a per attempt log file.
+    """
+    attempt = len(shard["attempts"]) + 1
+    output = shard_output_path(work_dir, shard)
+    os.makedirs(output, exist_ok=True)
+    command = command_template.format(start=shard["start"], end=shard["end"], shard=shard["shard"], gpu=gpu, output=output)
+    log_path = shard_log_path(work_dir, shard, attempt)
+    log_file = open(log_path, "w")
+    log_file.write(f"# {command}\n")
+    log_file.flush()
+    process = subprocess.Popen(command, shell=True, stdout=log_file, stderr=subprocess.STDOUT)
+    shard["attempts"].append({"command": command, "gpu": gpu, "log": log_path, "exit_code": None, "seconds": None})
+    shard["status"] = "running"
+    return {"shard": shard, "process": process, "log_file": log_file, "gpu": gpu, "started": time.time()}
+
+
+def shard_progress(index, subject, shard, stage=take_index.UE_STAGES[-1]):
+    return sum(index.stage_status(subject, take, stage) == "done" for take in shard["takes"])
+
+
+def run_shards(shards, command_template, work_dir, subject, index_path, workers=1, gpus=None, retries=2,
+               poll_seconds=5.0, shard_timeout=None):
+    """
+    Run the shards on workers worker slots, retrying a failed or timed out shard up to retries times.
+    Progress is read from the take index while the workers run. Returns True if every shard succeeded.
+    """
+    os.makedirs(os.path.join(work_dir, "logs"), exist_ok=True)
+    queue = list(shards)
+    running = []
+    gpus = gpus or [None]
+    free_gpus = [gpus[slot % len(gpus)] for slot in range(workers)]
+    progress = {}
+    total_takes = sum(len(shard["takes"]) for shard in shards)
+    with take_index.TakeIndex(index_path) as index:
+        while queue or running:
+            while queue and free_gpus:
+                running.append(launch_shard(queue.pop(0), command_template, work_dir, free_gpus.pop(0)))
+            time.sleep(poll_seconds)
+
+            for worker in list(running):
+                shard, process = worker["shard"], worker["process"]
+                exit_code = process.poll()
+                timed_out = exit_code is None and shard_timeout and time.time() - worker["started"] > shard_timeout
+                if timed_out:
+                    process.kill()
+                    exit_code = process.wait()
+                if exit_code is None:
+                    continue
+                worker["log_file"].close()
+                running.remove(worker)
+                free_gpus.append(worker["gpu"])
+                attempt = shard["attempts"][-1]
+                attempt["exit_code"] = exit_code
+                attempt["seconds"] = round(time.time() - worker["started"], 3)
+                metrics.record("shard", attempt["seconds"], items=len(shard["takes"]), status="ok" if exit_code == 0 and not timed_out else "failed",
+                               shard=shard["shard"], attempt=len(shard["attempts"]), exit_code=exit_code, gpu=worker["gpu"], subject=subject)
+                if exit_code == 0 and not timed_out:
+                    shard["status"] = "done"
+                    print(f"Shard {shard['shard']} (takes {shard['start']}-{shard['end']}) done in {attempt['seconds']} s")
+                elif len(shard["attempts"]) <= retries:
+                    shard["status"] = "retrying"
+                    print(f"Shard {shard['shard']} (takes {shard['start']}-{shard['end']}) "
+                          f"{'timed out' if timed_out else f'failed with exit code {exit_code}'}, retrying, see {attempt['log']}")
+                    queue.append(shard)
+                else:
+                    shard["status"] = "failed"
+                    print(f"Shard {shard['shard']} (takes {shard['start']}-{shard['end']}) failed {len(shard['attempts'])} times, see {attempt['log']}")
+
+            changed = False
+            for shard in shards:
+                done = shard_progress(index, subject, shard)
+                changed |= progress.get(shard["shard"]) != done
+                progress[shard["shard"]] = done
+            if changed:
+                running_shards = ", ".join(f"{worker['shard']['shard']}: {progress[worker['shard']['shard']]}/{len(worker['shard']['takes'])}" for worker in running)
+                print(f"{sum(progress.values())}/{total_takes} takes exported, running shards {running_shards or 'none'}")
+    return all(shard["status"] == "done" for shard in shards)
+
+
+def merge_logs(shards, log_path):
+    """
+    Concatenate the logs of every shard attempt into one file, in shard order.
+    """
+    with open(log_path, "w") as merged:
+        for shard in shards:
+            for number, attempt in enumerate(shard["attempts"], 1):
+                merged.write(f"===== shard {shard['shard']} takes {shard['start']}-{shard['end']} attempt {number} exit code {attempt['exit_code']} =====\n")
+                with open(attempt["log"], "r", errors="replace") as log_file:
+                    shutil.copyfileobj(log_file, merged)
+                merged.write("\n")
+
+
+def merge_outputs(shards, work_dir, output_path, index):
+    """
+    Move the files the successful shards wrote to their {output} folder into output_path, the
+    artifacts of the take index follow them. Returns the number of files moved.
+    """
+    moved = 0
+    os.makedirs(output_path, exist_ok=True)
+    for shard in shards:
+        shard_output = shard_output_path(work_dir, shard)
+        if shard["status"] != "done" or not os.path.isdir(shard_output):
+            continue
+        for name in sorted(os.listdir(shard_output)):
+            os.replace(os.path.join(shard_output, name), os.path.join(output_path, name))
+            index.move_artifact(os.path.join(shard_output, name), os.path.join(output_path, name))
+            moved += 1
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run UE_PerformanceToSequence.py in sharded editor processes")
+    parser.add_argument("--command", type=str, required=True, help="Worker command template with {start} {end} {shard} {gpu} {output}")
+    parser.add_argument("--subject", type=str, help="Subject of the takes in the take index", default="Fretlyn")
+    parser.add_argument("--start_anim", type=int, help="Start animation number", default=1)
+    parser.add_argument("--end_anim", type=int, help="End animation number", default=-1)
+    parser.add_argument("--take_index", type=str, help="Take index file shared by the pipeline scripts", default=take_index.DEFAULT_INDEX_PATH)
+    parser.add_argument("--raw_data_path", type=str, help="Capture folders to register in the take index first", default=None)
+    parser.add_argument("--workers", type=int, help="Number of editor processes at once", default=2)
+    parser.add_argument("--takes_per_shard", type=int, help="Takes per worker process", default=5)
+    parser.add_argument("--gpus", type=str, help="Comma separated GPUs the worker slots are spread over, passed to the command as {gpu}", default=None)
+    parser.add_argument("--retries", type=int, help="Retries of a failed shard", default=2)
+    parser.add_argument("--shard_timeout", type=float, help="Seconds before a shard is killed and retried", default=None)
+    parser.add_argument("--poll_seconds", type=float, help="Seconds between progress checks", default=5.0)
+    parser.add_argument("--work_dir", type=str, help="Folder of the shard logs, outputs and summary", default="ue_batch")
+    parser.add_argument("--output_path", type=str, help="Folder the {output} folders of the shards are merged into", default=None)
+    parser.add_argument("--metrics", type=str, help="JSONL file of the timing spans, the workers append theirs to it too", default=None)
+    args = parser.parse_args()
+    if args.gpus and "{gpu}" not in args.command:
+        parser.error("--gpus needs {gpu} in the command, e.g. -graphicsadapter={gpu} for the editor")
+    metrics.configure(args.metrics)
+
+    with take_index.TakeIndex(args.take_index) as index:
+        if args.raw_data_path:
+            take_index.index_captures(index, args.subject, args.raw_data_path)
+        end = None if args.end_anim == -1 else args.end_anim
+        # an empty range means the captures were never registered, not that they are done
+        if not index.takes(args.subject, args.start_anim, end):
+            print(f"The take index {args.take_index} has no takes of {args.subject} in the range, "
+                  f"pass --raw_data_path to register the captures")
+            sys.exit(1)
+        takes = pending_takes(index, args.subject, args.start_anim, end)
+    if not takes:
+        print(f"Every take of {args.subject} in the range is done, nothing to launch")
+        return
+    shards = split_shards(takes, args.takes_per_shard)
+    print(f"{len(takes)} takes to process in {len(shards)} shards on {args.workers} workers")
+
+    started = time.time()
+    success = run_shards(
+        shards, args.command, args.work_dir, args.subject, args.take_index, workers=args.workers,
+        gpus=args.gpus.split(",") if args.gpus else None, retries=args.retries,
+        poll_seconds=args.poll_seconds, shard_timeout=args.shard_timeout)
+
+    merge_logs(shards, os.path.join(args.work_dir, "launcher.log"))
+    if args.output_path:
+        with take_index.TakeIndex(args.take_index) as index:
+            print(f"Merged {merge_outputs(shards, args.work_dir, args.output_path, index)} output files into {args.output_path}")
+    with open(os.path.join(args.work_dir, "shards.json"), "w") as file:
+        json.dump({"seconds": round(time.time() - started, 3), "shards": shards}, file, indent=2)
+    failed = [shard for shard in shards if shard["status"] != "done"]
+    print(f"{len(shards) - len(failed)}/{len(shards)} shards done in {time.time() - started:.1f} s, "
+          f"logs in {os.path.join(args.work_dir, 'launcher.log')}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,27 @@
 import unreal
 import argparse
-# import sys
+import sys
 import os
 import json
+
+# the shared pipeline modules live next to this script
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import face_curves
+import face_channels
+import take_index
+import metrics
+import asset_resolver
 # import tkinter as tk
 
+# the skeleton, identity, control rig and MetaHuman blueprint every take uses are loaded once per run, see asset_resolver.py
+assets = asset_resolver.AssetResolver()
+
+
+def delete_asset(path):
+    unreal.EditorAssetLibrary.delete_asset(path)
+    assets.invalidate(path)
+
+
 parser = argparse.ArgumentParser(description="MetaHuman Performance to Sequence")
 parser.add_argument("--raw_data_path", type=str, help="Path to raw data", default="H:\\datasets\\Fretlyn\\Face\\Fretlyn")
 parser.add_argument("--level", type=str, help="Default level to open", default="Untitled")
@@ -17,25 +34,41 @@ parser.add_argument("--performance_path", type=str, help="Path to performance as
 parser.add_argument("--metahuman_path", type=str, help="Path to MetaHuman", default="/Game/MetaHumans/")
 parser.add_argument("--target_metahuman", type=str, help="Target MetaHuman to use", default="Bernice")
 parser.add_argument("--output_path", type=str, help="Output path for animation sequence", default="H:\\datasets\\Fretlyn\\Face\\Fretlyn")
-
-args = parser.parse_args()
-
-
-def create_performance_asset(path_to_identity : str, path_to_capture_data : str, save_performance_location : str, start_frame=-1, end_frame=-1) -> unreal.MetaHumanPerformance:
+parser.add_argument("--subject", type=str, help="Subject name in the take index, the identity by default", default=None)
+parser.add_argument("--take_index", type=str, help="Take index file shared by the pipeline scripts", default=take_index.DEFAULT_INDEX_PATH)
+parser.add_argument("--rescan", action="store_true", help="List raw_data_path even when the take index has it as unchanged")
+parser.add_argument("--force", action="store_true", help="Run every stage of the takes again, not only the ones that aren't done")
+parser.add_argument("--export_format", type=str, choices=["json", "binary", "both"], help="Face anim export format, binary writes the dense .mhfc format", default="json")
+parser.add_argument("--reduce_tolerance", type=float, help="Also store the face curve keys reduced within this error in the binary export", default=None)
+parser.add_argument("--reduced_only", action="store_true", help="Only store the reduced keys in the binary export, not the dense matrix")
+parser.add_argument("--chunk_mode", type=str, choices=["auto", "always", "never"], help="Process takes in overlapping frame windows: auto when the MH pipeline reports too many frames, always for takes longer than chunk_frames", default="auto")
+parser.add_argument("--chunk_frames", type=int, help="Frames per window of a chunked take", default=2000)
+parser.add_argument("--chunk_overlap", type=int, help="Frames shared by consecutive windows, crossfaded when they are stitched", default=16)
+parser.add_argument("--sequence_mode", type=str, choices=["per_take", "template"], help="Build a new level sequence for every take, or reuse a pool of template sequences whose animation and range are swapped per take", default="per_take")
+parser.add_argument("--metrics", type=str, help="JSONL file the timing spans of the takes and stages are appended to, PIPELINE_METRICS by default", default=None)
+
+
+def create_performance_asset(path_to_identity : str, path_to_capture_data : str, save_performance_location : str, start_frame=-1, end_frame=-1, name_suffix="", replace=False) -> tuple:
     """
     Create a performance asset from the given identity and capture data.
+    An existing asset is reused, unless replace is set, then it is deleted and processed again.
+    Returns the asset and the StartPipelineErrorType of its processing.
     """
     # Load the identity and capture data assets
     print(f"Loading identity asset from {path_to_identity}")
     print(f"Loading capture data asset from {path_to_capture_data}")
     capture_data_asset = unreal.load_asset(path_to_capture_data)
-    performance_asset_name = f"Performance_{capture_data_asset.get_name()}"
+    performance_asset_name = f"Performance_{capture_data_asset.get_name()}{name_suffix}"
     if unreal.EditorAssetLibrary.does_asset_exist(f"{save_performance_location}/{performance_asset_name}"):
-        print(f"Performance asset already exists at {save_performance_location}/{performance_asset_name}")
-        return unreal.EditorAssetLibrary.load_asset(f"{save_performance_location}/{performance_asset_name}")
+        if replace:
+            print(f"Replacing the performance asset at {save_performance_location}/{performance_asset_name}")
+            delete_asset(f"{save_performance_location}/{performance_asset_name}")
+        else:
+            print(f"Performance asset already exists at {save_performance_location}/{performance_asset_name}")
+            return unreal.EditorAssetLibrary.load_asset(f"{save_performance_location}/{performance_asset_name}"), unreal.StartPipelineErrorType.NONE
     if not capture_data_asset:
         raise ValueError(f"Capture data asset not found at {path_to_capture_data}")
-    identity_asset = unreal.load_asset(path_to_identity)
+    identity_asset = assets.load_asset(path_to_identity)
     if not identity_asset:
         raise ValueError(f"Identity asset not found at {path_to_identity}")
 
@@ -56,31 +89,38 @@ def create_performance_asset(path_to_identity : str, path_to_capture_data : str,
     process_blocking = True
     performance_asset.set_blocking_processing(process_blocking)
 
-    unreal.log(f"Starting MH pipeline for '{animation_name}'")
-    startPipelineError = performance_asset.start_pipeline()
+    unreal.log(f"Starting MH pipeline for '{performance_asset_name}'")
+    with metrics.span("start_pipeline", items=end_frame - start_frame if start_frame != -1 and end_frame != -1 else None, performance=performance_asset_name) as pipeline_span:
+        startPipelineError = performance_asset.start_pipeline()
+        pipeline_span.fields["error"] = str(startPipelineError)
     if startPipelineError is unreal.StartPipelineErrorType.NONE:
-        unreal.log(f"Finished MH pipeline for '{animation_name}'")
+        unreal.log(f"Finished MH pipeline for '{performance_asset_name}'")
     elif startPipelineError is unreal.StartPipelineErrorType.TOO_MANY_FRAMES:
-        unreal.log(f"Too many frames when starting MH pipeline for '{animation_name}'")
+        unreal.log(f"Too many frames when starting MH pipeline for '{performance_asset_name}'")
     else:
-        unreal.log(f"Unknown error starting MH pipeline for '{animation_name}'")
+        unreal.log(f"Unknown error starting MH pipeline for '{performance_asset_name}'")
 
-    return performance_asset
+    return performance_asset, startPipelineError
 
 
-def export_animation(performance_asset: unreal.MetaHumanPerformance, export_sequence_location: str) -> str:
+def export_animation(performance_asset: unreal.MetaHumanPerformance, export_sequence_location: str, replace=False) -> str:
     """
     Process the shot and export the animation sequence.
+    An existing animation sequence is kept, unless replace is set, then it is deleted and exported again.
     """
     animation_name = f"AS_{performance_asset.get_name()}"
 
     if unreal.EditorAssetLibrary.does_asset_exist(f"{export_sequence_location}/{animation_name}"):
-        print(f"Animation sequence already exists at {export_sequence_location}/{animation_name}")
-        return animation_name
+        if replace:
+            print(f"Replacing the animation sequence at {export_sequence_location}/{animation_name}")
+            delete_asset(f"{export_sequence_location}/{animation_name}")
+        else:
+            print(f"Animation sequence already exists at {export_sequence_location}/{animation_name}")
+            return animation_name
     
     unreal.log(f"Exporting animation sequence for Performance '{animation_name}'")
 
-    target_skeleton = unreal.load_asset("/Game/MetaHumans/Common/Face/Face_Archetype_Skeleton")
+    target_skeleton = assets.load_asset("/Game/MetaHumans/Common/Face/Face_Archetype_Skeleton")
     export_settings = unreal.MetaHumanPerformanceExportAnimationSettings()
     export_settings.enable_head_movement = False # Enable or disable to export the head rotation
     export_settings.target_skeleton_or_skeletal_mesh = target_skeleton
@@ -115,60 +155,86 @@ def get_sequencer_objects(level_sequence):
 	return sequence_asset, sequencer_objects_list, sequencer_names_list
 
 
+# function to write the face animation keys in the export format, None writes nothing
+# returns the written files
+def write_face_anim_exports(face_anim, folder_path, editor_asset_name, export_format="json", reduce_tolerance=None, reduced_only=False):
+	written_files = []
+	if export_format is None:
+		return written_files
+	os.makedirs(folder_path, exist_ok=True)
+	if export_format in ('json', 'both'):
+		file_path = os.path.join(folder_path, f'{editor_asset_name}_face_anim.json')
+		with metrics.span('write_face_anim', items=len(face_anim), format='json', sequence=editor_asset_name):
+			with open(file_path, 'w') as keys_file:
+				# keys_file.write('anim_keys_dict = ')
+				keys_file.write(json.dumps(face_anim))	
+		
+		print('Face Animation Keys output to: ' + str(keys_file.name))
+		written_files.append(file_path)
+	if export_format in ('binary', 'both'):
+		# frames x controls float32 matrix, see face_curves.py
+		file_path = os.path.join(folder_path, f'{editor_asset_name}_face_anim{face_curves.EXTENSION}')
+		with metrics.span('write_face_anim', items=len(face_anim), format='binary', sequence=editor_asset_name):
+			face_curves.write_face_anim(file_path, face_anim, reduce_tolerance=reduce_tolerance, dense=not reduced_only)
+		print('Face Animation Curves output to: ' + file_path)
+		written_files.append(file_path)
+	return written_files
+
+
 # function to export the face animation keys to a json file
-def mgMetaHuman_face_keys_export(level_sequence, output_path):
+# export_format None only returns the keys
+# reduce_tolerance adds the reduced keys to the binary export, reduced_only leaves its dense matrix out
+# editor_asset_name names the exported files, the name of the level sequence by default
+# face_binding is the face binding a template sequence already holds, the bound actors are only added as possessables without it
+# returns the written files, the exported keys and the controls whose keys couldn't be read
+def mgMetaHuman_face_keys_export(level_sequence, output_path, export_format="json", reduce_tolerance=None, reduced_only=False, editor_asset_name=None, face_binding=None):
 	system_lib = unreal.SystemLibrary()
 	# root = tk.Tk()
 	# root.withdraw()
 
 	face_anim = {}
+	failures = {}
+	written_files = []
 
 	world = unreal.get_editor_subsystem(unreal.UnrealEditorSubsystem).get_editor_world()
 
-	sequence_asset, sequencer_objects_list,sequencer_names_list = get_sequencer_objects(level_sequence)
+	sequence_asset = level_sequence
 	face_possessable = None
-
-	editor_asset_name = unreal.EditorAssetLibrary.get_path_name_for_loaded_asset(sequence_asset).split('.')[-1]
+	face_possessables = []
+	if face_binding is not None:
+		# the pooled template plays every take, adding its actor again per take would grow its bindings
+		face_possessables.append(face_binding)
+	else:
+		sequence_asset, sequencer_objects_list,sequencer_names_list = get_sequencer_objects(level_sequence)
+		for num in range(0, len(sequencer_names_list)):
+			actor = sequencer_objects_list[num]
+			bp_possessable = sequence_asset.add_possessable(actor)
+			child_possessable_list = bp_possessable.get_child_possessables()
+
+			for current_child in child_possessable_list:
+				if 'Face' in current_child.get_name():
+					face_possessable = current_child
+			face_possessables.append(face_possessable)
+
+	if editor_asset_name is None:
+		editor_asset_name = unreal.EditorAssetLibrary.get_path_name_for_loaded_asset(sequence_asset).split('.')[-1]
 	
-	for num in range(0, len(sequencer_names_list)):
-		actor = sequencer_objects_list[num]
-		asset_name = actor.get_actor_label()
-		bp_possessable = sequence_asset.add_possessable(actor)
-		child_possessable_list = bp_possessable.get_child_possessables()
+	for face_possessable in face_possessables:
 		character_name = ''
-
-		for current_child in child_possessable_list:
-			if 'Face' in current_child.get_name():
-				face_possessable = current_child
-		
 		if face_possessable:
 			character_name = (face_possessable.get_parent().get_display_name())
 			face_possessable_track_list = face_possessable.get_tracks()
 			face_control_rig_track = face_possessable_track_list[len(face_possessable_track_list)-1]
 			face_control_channel_list = unreal.MovieSceneSectionExtensions.get_all_channels(face_control_rig_track.get_sections()[0])
-			face_control_name_list = []
-
-			for channel in face_control_channel_list:
-				channel_name = str(channel.get_name())
-				channel_string_list = channel_name.split('_')
-				channel_name = channel_name.replace('_' + channel_string_list[-1], '')
-				face_control_name_list.append(channel_name)
-
-			for ctrl_num in range(0, len(face_control_channel_list)):
-				control_name = face_control_name_list[ctrl_num]
-
-				try:
-					numKeys = face_control_channel_list[ctrl_num].get_num_keys()
-					key_list = [None] * numKeys
-					keys = face_control_channel_list[ctrl_num].get_keys()
-					for key in range(0, numKeys):
-						key_value = keys[key].get_value()
-						key_time = keys[key].get_time(time_unit=unreal.SequenceTimeUnit.DISPLAY_RATE).frame_number.value
-						key_list[key]=([key_value, key_time])
-
-					face_anim[control_name] = key_list
-				except:
-					face_anim[control_name] = []
+
+			# channels keyed on every frame are read in one call, see face_channels.py
+			with metrics.span('extract_channels', items=len(face_control_channel_list), sequence=editor_asset_name) as extract_span:
+				channel_keys, channel_failures = face_channels.extract_channels(sequence_asset, face_control_channel_list)
+				extract_span.fields['failed_controls'] = len(channel_failures)
+			for control_name, error in channel_failures.items():
+				unreal.log_warning(f"Could not read the keys of {control_name}: {error}")
+			face_anim.update(face_channels.to_face_anim(channel_keys))
+			failures.update(channel_failures)
 			
 			character_name = str(character_name)
 			if 'BP_' in character_name:
@@ -179,100 +245,138 @@ def mgMetaHuman_face_keys_export(level_sequence, output_path):
 			character_name = character_name.lower()
 			print('character_name is ' + character_name)
             
-			
-			folder_path = output_path
-			os.makedirs(folder_path, exist_ok=True)
-			file_path = os.path.join(folder_path, f'{editor_asset_name}_face_anim.json')
-			with open(file_path, 'w') as keys_file:
-				# keys_file.write('anim_keys_dict = ')
-				keys_file.write(json.dumps(face_anim))	
-			
-			print('Face Animation Keys output to: ' + str(keys_file.name))
+			written_files += write_face_anim_exports(face_anim, output_path, editor_asset_name, export_format, reduce_tolerance, reduced_only)
 		else:
 			print(editor_asset_name)
 			print('is not a level sequence. Skipping.')
 
+	return written_files, face_anim, failures
 
-#path that contains video data, start to process performance
-path = args.raw_data_path #can be changed
-output_order = 1
-required_captures = [os.path.join(path, capture) for capture in os.listdir(path) if os.path.isdir(os.path.join(path, capture)) and int(capture.split("_")[-1]) >= args.start_anim and (args.end_anim == -1 or int(capture.split("_")[-1]) <= args.end_anim)]
 
-print("The required captures are: ")
-print(required_captures)
+# per-take stages in order, a take resumes from its first stage that isn't done in the take index
+TAKE_STAGES = take_index.UE_STAGES
+ASSET_KINDS = ("performance_asset", "animation_sequence", "level_sequence")
+
+# stage functions take (args, index, meta, session), session holds the editor objects of this run:
+# the spawned MetaHuman actor, the template level sequences and the level sequences and face bindings
+# of the current take
+# they return the detail recorded with the stage
+
+# with --sequence_mode template the windows of every take are played by a pool of level sequences
+# built once per run, slot n plays the n-th window of the take
+# the pool is named after the first take of the run, so the editors UE_BatchLauncher.py runs on the
+# shards of a project don't share templates
+SEQUENCE_TEMPLATE_PREFIX = "LS_Template_"
 
-performance_meta = {
-      "raw_data_path": None,
-      "identity": None,
-      "capture_data": None,
-      "frames": -1,
-      "performance_asset": None,
-      "animation_sequence": None,
-      "target_metahuman": None,
-      "output_path": None,
-}
 
-performances = []
-
-for capture_path in required_captures:
-    # Get the folder number from the capture path
-    meta = performance_meta.copy()
-    meta["raw_data_path"] = capture_path
-    meta["identity"] = os.path.join(args.base_path, args.identity)
-    meta["capture_data"] = os.path.join(args.base_path, args.capture_data_path, 'Fretlyn_' + capture_path.split("_")[-1])
-    json_file_path = os.path.join(capture_path, "take.json")
-    with open(json_file_path, "r") as file:
-        data = json.load(file)
-    end_frame = data["frames"]
-    meta["frames"] = end_frame
-    performance_asset = create_performance_asset(
+# a take is processed in one frame window, or in overlapping windows when it is chunked
+# the assets and artifacts of a chunked window carry its frame range in their name
+def frame_window(start, end, chunked):
+    window = {"start": start, "end": end, "suffix": f"_{start}_{end}" if chunked else ""}
+    for kind in ASSET_KINDS:
+        window[kind] = None
+    return window
+
+
+def process_performance_window(args, index, meta, window):
+    performance_asset, error = create_performance_asset(
         path_to_identity=meta["identity"],
         path_to_capture_data=meta["capture_data"],
         save_performance_location=args.performance_path,
-        start_frame=0,
-        end_frame=meta["frames"]
+        start_frame=window["start"],
+        end_frame=window["end"],
+        name_suffix=window["suffix"],
+        # --force processes the take again instead of picking up the assets of the earlier run
+        replace=args.force
     )
-    meta["performance_asset"] = os.path.join(args.performance_path, performance_asset.get_name())
-    print(f"Performance asset created: {meta['performance_asset']}")
-    animation_name = export_animation(
-        performance_asset=performance_asset,
-        export_sequence_location=args.performance_path
-    )
-    meta["animation_sequence"] = os.path.join(args.performance_path, animation_name)
-    print(f"Animation sequence created: {meta['animation_sequence']}")
-    # Set the target MetaHuman
-    meta["target_metahuman"] = os.path.join(args.metahuman_path, args.target_metahuman)
-    meta["output_path"] = args.output_path
-    performances.append(meta)
-    print(performances)
-print("The performance process is done!")
-
-# The start the second part: create the level sequence and export the sequence
-# add a new actor into the world
-actor_path = "/Game/MetaHumans/Bernice/BP_Bernice" # the path of the actor, can be changed
-actor_class = unreal.EditorAssetLibrary.load_blueprint_class(actor_path)
-coordinate = unreal.Vector(-25200.0, -25200.0, 100.0) # randomly put it on a coordinate of the world
-editor_subsystem = unreal.EditorActorSubsystem()
-new_actor = editor_subsystem.spawn_actor_from_class(actor_class, coordinate)
-
-animation_sequence = dict()
-#assume the dataset is only 50 folders !!! Important, need to be changed base on real dataset number!! And number order should be 1, 2, 3, 4, ... ...
-for i in range(1,50):
-    animation_sequence[i] = False
-
-# path = "F:\\Jerry\\Vasilisa" #folder that contain all the character folders, need to be changed based on the real path, can be changed
-
-for meta in performances:
-    frames = meta["frames"]
+    performance_path = os.path.join(args.performance_path, performance_asset.get_name())
+    if error is not unreal.StartPipelineErrorType.NONE:
+        # an unprocessed asset would be taken for a processed one by the next run
+        delete_asset(performance_path)
+        return error
+    window["performance_asset"] = performance_path
+    print(f"Performance asset created: {performance_path}")
+    # saved so a later run finds it after an editor crash
+    unreal.EditorAssetLibrary.save_loaded_asset(performance_asset)
+    index.set_artifact(meta["subject"], meta["take"], "performance_asset" + window["suffix"], performance_path)
+    return error
+
+
+def stage_performance(args, index, meta, session):
+    chunked = args.chunk_mode == "always" and meta["frames"] > args.chunk_frames
+    if not chunked:
+        meta["windows"] = [frame_window(0, meta["frames"], False)]
+        error = process_performance_window(args, index, meta, meta["windows"][0])
+        if error is unreal.StartPipelineErrorType.TOO_MANY_FRAMES and args.chunk_mode != "never":
+            unreal.log(f"Too many frames in take {meta['take']}, processing it in windows of {args.chunk_frames} frames")
+            chunked = True
+        elif error is not unreal.StartPipelineErrorType.NONE:
+            raise RuntimeError(f"MH pipeline of take {meta['take']} failed with {error}")
+    if chunked:
+        windows = face_curves.frame_windows(meta["frames"], args.chunk_frames, args.chunk_overlap)
+        meta["windows"] = [frame_window(start, end, True) for start, end in windows]
+        for window in meta["windows"]:
+            error = process_performance_window(args, index, meta, window)
+            if error is not unreal.StartPipelineErrorType.NONE:
+                raise RuntimeError(f"MH pipeline of frames {window['start']}-{window['end']} of take {meta['take']} failed with {error}, try a smaller --chunk_frames")
+        # the next runs read the windows of the take from here
+        return json.dumps({"windows": windows})
+
+
+def stage_anim_sequence(args, index, meta, session):
+    for window in meta["windows"]:
+        animation_name = export_animation(
+            performance_asset=unreal.load_asset(window["performance_asset"]),
+            export_sequence_location=args.performance_path,
+            replace=args.force
+        )
+        window["animation_sequence"] = os.path.join(args.performance_path, animation_name)
+        print(f"Animation sequence created: {window['animation_sequence']}")
+        unreal.EditorAssetLibrary.save_asset(window["animation_sequence"])
+        index.set_artifact(meta["subject"], meta["take"], "animation_sequence" + window["suffix"], window["animation_sequence"])
+
+
+def spawn_metahuman(session):
+    # add a new actor into the world and find its Face component, once per run
+    if "actor" not in session:
+        actor_path = "/Game/MetaHumans/Bernice/BP_Bernice" # the path of the actor, can be changed
+        actor_class = assets.load_blueprint_class(actor_path)
+        coordinate = unreal.Vector(-25200.0, -25200.0, 100.0) # randomly put it on a coordinate of the world
+        editor_subsystem = unreal.EditorActorSubsystem()
+        session["actor"] = editor_subsystem.spawn_actor_from_class(actor_class, coordinate)
+        components = session["actor"].get_components_by_class(unreal.SkeletalMeshComponent)
+        print(f"Components of Bernice: {components}")
+        session["face_component"] = next((component for component in components if component.get_name() == "Face"), None)
+    return session["actor"]
+
+
+def level_sequence_name(window):
+    # the level sequence of a window and the face anim exports of its take are named after the performance asset
+    return f"LS_{window['performance_asset'].split('/')[-1]}"
+
+
+def is_sequence_template(level_sequence_path):
+    return bool(level_sequence_path) and os.path.basename(level_sequence_path).startswith(SEQUENCE_TEMPLATE_PREFIX)
+
+
+def create_level_sequence(args, new_actor, face_component, window):
+    """
+    Create the level sequence of a frame window with the MetaHuman playing its animation sequence,
+    replacing the one an interrupted run left behind. Returns the level sequence and its face binding.
+    """
+    frames = window["end"] - window["start"]
     #create a new level sequence
     asset_tools = unreal.AssetToolsHelpers.get_asset_tools()
-    asset_name = f"LS_{meta['performance_asset'].split('/')[-1]}"
+    asset_name = level_sequence_name(window)
+    level_sequence_path = os.path.join(args.performance_path, asset_name)
+    if unreal.EditorAssetLibrary.does_asset_exist(level_sequence_path):
+        delete_asset(level_sequence_path)
     level_sequence = unreal.AssetTools.create_asset(asset_tools, asset_name, package_path=args.performance_path, asset_class=unreal.LevelSequence, factory=unreal.LevelSequenceFactoryNew())
 
     level_sequence.set_playback_start(0) #starting frame will always be 0
     level_sequence.set_playback_end(frames) #end
 
-    anim_asset = unreal.load_asset(meta["animation_sequence"])
+    anim_asset = unreal.load_asset(window["animation_sequence"])
     params = unreal.MovieSceneSkeletalAnimationParams()
     params.set_editor_property("Animation", anim_asset)
 
@@ -293,18 +397,6 @@ for meta in performances:
     transform_section.set_range(start_frame, end_frame)
     anim_section.set_range(start_frame, end_frame)
 
-    #add face animation track
-    components = new_actor.get_components_by_class(unreal.SkeletalMeshComponent)
-    print(f"Components of Bernice: ")
-    print(components)
-
-    face_component = None
-    for component in components:
-        if component.get_name() == "Face":
-            face_component = component
-            break
-    print(face_component)
-
     #get the face track (same technique as above):
     face_binding = level_sequence.add_possessable(face_component)
     print(face_binding)
@@ -316,9 +408,83 @@ for meta in performances:
     transform_section2.set_range(start_frame, end_frame)
     anim_section2.set_range(start_frame, end_frame)
 
-    # bake to control rig to the face
-    print("level sequence: " + str(level_sequence))
+    window["level_sequence"] = level_sequence_path
+    return level_sequence, face_binding
 
+
+def sequence_template(args, session, slot):
+    """
+    Slot of the template pool, built the first time a run needs it: the MetaHuman and its Face component
+    bound with their transform and skeletal animation tracks. A template an earlier run left behind is
+    bound to the actor of that run, it is replaced.
+    """
+    pool = session.setdefault("sequence_templates", [])
+    while len(pool) <= slot:
+        new_actor = spawn_metahuman(session)
+        asset_name = f"{SEQUENCE_TEMPLATE_PREFIX}{args.target_metahuman}_{args.start_anim}_{len(pool)}"
+        level_sequence_path = os.path.join(args.performance_path, asset_name)
+        if unreal.EditorAssetLibrary.does_asset_exist(level_sequence_path):
+            delete_asset(level_sequence_path)
+        asset_tools = unreal.AssetToolsHelpers.get_asset_tools()
+        level_sequence = unreal.AssetTools.create_asset(asset_tools, asset_name, package_path=args.performance_path, asset_class=unreal.LevelSequence, factory=unreal.LevelSequenceFactoryNew())
+        actor_binding = level_sequence.add_possessable(new_actor)
+        face_binding = level_sequence.add_possessable(session["face_component"])
+        # the sections whose range follows the frames of the window, the face animation section is found per take
+        sections = [actor_binding.add_track(unreal.MovieScene3DTransformTrack).add_section(),
+                    actor_binding.add_track(unreal.MovieSceneSkeletalAnimationTrack).add_section(),
+                    face_binding.add_track(unreal.MovieScene3DTransformTrack).add_section()]
+        face_binding.add_track(unreal.MovieSceneSkeletalAnimationTrack).add_section()
+        pool.append({"level_sequence": level_sequence, "path": level_sequence_path, "face_binding": face_binding, "sections": sections})
+    return pool[slot]
+
+
+def apply_sequence_template(args, session, slot, window):
+    """
+    Point a slot of the template pool at the animation sequence and frames of a window: the playback
+    range, the section ranges and the animation params are swapped and the control rig track of the
+    previous bake is removed. Returns the level sequence and its face binding, like create_level_sequence.
+    """
+    template = sequence_template(args, session, slot)
+    level_sequence, face_binding = template["level_sequence"], template["face_binding"]
+    frames = window["end"] - window["start"]
+    level_sequence.set_playback_start(0)
+    level_sequence.set_playback_end(frames)
+
+    # bake_to_control_rig added a control rig track to the face, the next bake has to start from the animation alone
+    for track in face_binding.find_tracks_by_exact_type(unreal.MovieSceneControlRigParameterTrack):
+        face_binding.remove_track(track)
+    anim_tracks = face_binding.find_tracks_by_exact_type(unreal.MovieSceneSkeletalAnimationTrack)
+    anim_track = anim_tracks[0] if anim_tracks else face_binding.add_track(unreal.MovieSceneSkeletalAnimationTrack)
+    anim_sections = anim_track.get_sections()
+    anim_section = anim_sections[0] if anim_sections else anim_track.add_section()
+    anim_section.set_is_active(True)
+
+    params = unreal.MovieSceneSkeletalAnimationParams()
+    params.set_editor_property("Animation", unreal.load_asset(window["animation_sequence"]))
+    anim_section.set_editor_property("Params", params)
+    for section in template["sections"] + [anim_section]:
+        section.set_range(0, frames)
+
+    window["level_sequence"] = template["path"]
+    return level_sequence, face_binding
+
+
+def stage_level_sequence(args, index, meta, session):
+    new_actor = spawn_metahuman(session)
+    session["level_sequences"] = {}
+    for slot, window in enumerate(meta["windows"]):
+        if args.sequence_mode == "template":
+            previous = window["level_sequence"]
+            session["level_sequences"][window["suffix"]] = apply_sequence_template(args, session, slot, window)
+            # the level sequence a per take run built for this window is not needed anymore
+            if previous and not is_sequence_template(previous) and unreal.EditorAssetLibrary.does_asset_exist(previous):
+                delete_asset(previous)
+        else:
+            session["level_sequences"][window["suffix"]] = create_level_sequence(args, new_actor, session["face_component"], window)
+        index.set_artifact(meta["subject"], meta["take"], "level_sequence" + window["suffix"], window["level_sequence"])
+
+
+def stage_bake(args, index, meta, session):
     editor_subsystem = unreal.UnrealEditorSubsystem()
     world = editor_subsystem.get_editor_world()
     print("world: " + str(world))
@@ -326,18 +492,189 @@ for meta in performances:
     anim_seq_export_options = unreal.AnimSeqExportOption()
     print("anim_seq_export_options: " + str(anim_seq_export_options))
 
-    control_rig = unreal.load_object(name='/Game/MetaHumans/Common/Face/Face_ControlBoard_CtrlRig', outer = None)# can be changed
-    control_rig_class = control_rig.get_control_rig_class()# use class type in the under argument
+    control_rig_class = assets.control_rig_class('/Game/MetaHumans/Common/Face/Face_ControlBoard_CtrlRig')# can be changed, use class type in the under argument
     print("control rig class: " + str(control_rig_class))
-    
-    unreal.ControlRigSequencerLibrary.bake_to_control_rig(world, level_sequence, control_rig_class = control_rig_class, export_options = anim_seq_export_options, tolerance = 0.01, reduce_keys = False, binding = face_binding)
 
-    # Refresh to visually see the new level sequence
-    unreal.LevelSequenceEditorBlueprintLibrary.refresh_current_level_sequence()
+    for window in meta["windows"]:
+        level_sequence, face_binding = session["level_sequences"][window["suffix"]]
+        # bake to control rig to the face
+        print("level sequence: " + str(level_sequence))
+        with metrics.span("bake_to_control_rig", items=window["end"] - window["start"], subject=meta["subject"], take=meta["take"], window=window["suffix"]):
+            unreal.ControlRigSequencerLibrary.bake_to_control_rig(world, level_sequence, control_rig_class = control_rig_class, export_options = anim_seq_export_options, tolerance = 0.01, reduce_keys = False, binding = face_binding)
+
+        # Refresh to visually see the new level sequence
+        unreal.LevelSequenceEditorBlueprintLibrary.refresh_current_level_sequence()
+        # the export of a later run reads the baked keys from the saved level sequence
+        unreal.EditorAssetLibrary.save_loaded_asset(level_sequence)
+
 
-    # Export the current face animation keys to a json file
-    output_path = meta['output_path']
-    mgMetaHuman_face_keys_export(level_sequence, output_path)
+def window_level_sequence(window, level_sequences):
+    """
+    Level sequence of a window and the face binding of a template to export it with, the face binding
+    is None for a per take sequence so the export binds its actors.
+    """
+    if window["suffix"] not in level_sequences:
+        return unreal.load_asset(window["level_sequence"]), None
+    level_sequence, face_binding = level_sequences[window["suffix"]]
+    return level_sequence, face_binding if is_sequence_template(window["level_sequence"]) else None
+
+
+def stage_face_anim_export(args, index, meta, session):
+    level_sequences = session.get("level_sequences", {})
+    windows = meta["windows"]
+    if len(windows) == 1:
+        level_sequence, face_binding = window_level_sequence(windows[0], level_sequences)
+        # Export the current face animation keys to a json file
+        written_files, face_anim, failures = mgMetaHuman_face_keys_export(level_sequence, meta["output_path"], args.export_format, args.reduce_tolerance, args.reduced_only, level_sequence_name(windows[0]), face_binding)
+    else:
+        # the keys of every window, stitched on the frames of the whole take before they are written
+        window_anims = []
+        failures = {}
+        for window in windows:
+            level_sequence, face_binding = window_level_sequence(window, level_sequences)
+            _, window_anim, window_failures = mgMetaHuman_face_keys_export(level_sequence, meta["output_path"], export_format=None, face_binding=face_binding)
+            window_anims.append((window["start"], window_anim))
+            failures.update(window_failures)
+        face_anim = face_curves.stitch_face_anims(window_anims)
+        editor_asset_name = level_sequence_name(windows[0])[:-len(windows[0]["suffix"])]
+        written_files = write_face_anim_exports(face_anim, meta["output_path"], editor_asset_name, args.export_format, args.reduce_tolerance, args.reduced_only)
+    for file_path in written_files:
+        index.set_artifact(meta["subject"], meta["take"], "face_anim" if file_path.endswith(".json") else "face_curves", file_path)
+    # the Maya side reads the keyed frame count from here instead of parsing the export
+    index.update_take(meta["subject"], meta["take"], key_frames=len(next(iter(face_anim.values()), [])), controls=len(face_anim))
     unreal.LevelSequenceEditorBlueprintLibrary.refresh_current_level_sequence()
+    return json.dumps({"failed_controls": failures}) if failures else None
 
-print("Well Done! Jerry!")
+
+TAKE_STAGE_FUNCTIONS = {
+    "performance": stage_performance,
+    "anim_sequence": stage_anim_sequence,
+    "level_sequence": stage_level_sequence,
+    "bake": stage_bake,
+    "face_anim_export": stage_face_anim_export,
+}
+
+
+def run_take_stages(args, index, meta, session, force=False):
+    """
+    Run the stages of one take from its first stage that isn't done, every stage is recorded in the
+    take index as it finishes so an interrupted run resumes where it stopped. Every stage is a span of
+    metrics.py with the frames of the take as items. Returns the stages run.
+    """
+    subject, take = meta["subject"], meta["take"]
+    stage = TAKE_STAGES[0] if force else index.resume_stage(subject, take, TAKE_STAGES)
+    if stage is None:
+        return []
+    # the face bindings bake_to_control_rig needs only exist in the run that built the level sequences,
+    # and a template may play another take by now
+    if "level_sequences" not in session and (stage == "bake" or (stage == "face_anim_export" and any(is_sequence_template(window["level_sequence"]) for window in meta["windows"]))):
+        stage = "level_sequence"
+    stages = TAKE_STAGES[TAKE_STAGES.index(stage):]
+    # the later stages have to run again on top of the redone ones
+    for stage in stages:
+        index.set_stage(subject, take, stage, "pending")
+    for stage in stages:
+        try:
+            with metrics.span(stage, items=meta["frames"], subject=subject, take=take):
+                detail = TAKE_STAGE_FUNCTIONS[stage](args, index, meta, session)
+        except Exception as error:
+            index.set_stage(subject, take, stage, "failed", f"{type(error).__name__}: {error}")
+            raise
+        index.set_stage(subject, take, stage, detail=detail)
+    return stages
+
+
+def main():
+    global assets
+    args = parser.parse_args()
+    # the key reduction only exists in the binary export
+    if args.export_format == "json" and (args.reduce_tolerance is not None or args.reduced_only):
+        parser.error("--reduce_tolerance and --reduced_only need --export_format binary or both")
+    if args.reduced_only and args.reduce_tolerance is None:
+        parser.error("--reduced_only needs --reduce_tolerance")
+    # stitching crossfades two windows at a time, a third window must not reach into an overlap
+    if not 0 <= args.chunk_overlap < args.chunk_frames // 2:
+        parser.error("--chunk_overlap has to be at least 0 and smaller than half of --chunk_frames")
+    metrics.configure(args.metrics, "UE_PerformanceToSequence")
+    # what an earlier run in this editor loaded may have been deleted or reloaded since
+    assets = asset_resolver.AssetResolver()
+
+    #path that contains video data, start to process performance
+    path = args.raw_data_path #can be changed
+    output_order = 1
+    # the take index knows the captures and their frame counts, raw_data_path is only listed again once its mtime changed
+    index = take_index.TakeIndex(args.take_index)
+    subject = args.subject or args.identity
+    take_index.index_captures(index, subject, path, args.rescan)
+    # takes the other scripts registered under the subject without a capture folder have nothing to process here
+    takes = [take for take in index.takes(subject, start=args.start_anim, end=None if args.end_anim == -1 else args.end_anim) if take.path]
+    required_captures = [take.path for take in takes]
+
+    print(f"The required captures are {len(required_captures)} takes of {subject}: {os.path.basename(required_captures[0]) if required_captures else None} .. {os.path.basename(required_captures[-1]) if required_captures else None}")
+
+    performance_meta = {
+          "subject": None,
+          "take": None,
+          "raw_data_path": None,
+          "identity": None,
+          "capture_data": None,
+          "frames": -1,
+          "windows": None,
+          "target_metahuman": None,
+          "output_path": None,
+    }
+
+    session = {}
+    failed_takes = {}
+
+    for take in takes:
+        capture_path = take.path
+        meta = performance_meta.copy()
+        meta["subject"] = subject
+        meta["take"] = take.take
+        meta["raw_data_path"] = capture_path
+        meta["identity"] = os.path.join(args.base_path, args.identity)
+        meta["capture_data"] = os.path.join(args.base_path, args.capture_data_path, 'Fretlyn_' + capture_path.split("_")[-1])
+        # the frame count of take.json is in the index
+        meta["frames"] = take.frames
+        # the frame windows and assets of the stages done by earlier runs
+        detail = index.stage_detail(subject, take.take, "performance") if index.stage_status(subject, take.take, "performance") == "done" else None
+        windows = json.loads(detail)["windows"] if detail else None
+        meta["windows"] = [frame_window(start, end, True) for start, end in windows] if windows else [frame_window(0, take.frames, False)]
+        for window in meta["windows"]:
+            for kind in ASSET_KINDS:
+                window[kind] = index.artifact(subject, take.take, kind + window["suffix"])
+        # Set the target MetaHuman
+        meta["target_metahuman"] = os.path.join(args.metahuman_path, args.target_metahuman)
+        meta["output_path"] = args.output_path
+        session.pop("level_sequences", None)
+        try:
+            with metrics.span("take", subject=subject, take=take.take) as take_span:
+                stages = run_take_stages(args, index, meta, session, force=args.force)
+                # a take that is already done processed no frames
+                take_span.items = take.frames if stages else 0
+                take_span.fields["stages"] = stages
+        except Exception as error:
+            unreal.log_error(f"Take {take.take} failed: {type(error).__name__}: {error}")
+            failed_takes[take.take] = f"{type(error).__name__}: {error}"
+            continue
+        if stages:
+            print(f"Take {take.take} ran {', '.join(stages)} in {take_span.seconds:.1f} s, {len(meta['windows'])} windows of {meta['frames']} frames")
+        else:
+            print(f"Take {take.take} is already done, skipping")
+    print("The performance process is done!")
+    resolved = assets.summary()
+    print(f"Asset cache: {resolved['hits']} hits, {resolved['misses']} loads in {resolved['load_seconds']:.2f} s, about {resolved['saved_seconds']:.2f} s saved")
+    metrics.record("asset_resolver", resolved["load_seconds"], items=resolved["misses"], hits=resolved["hits"],
+                   saved_seconds=round(resolved["saved_seconds"], 6))
+
+    if failed_takes:
+        print(f"{len(failed_takes)} takes failed, they resume from their failed stage on the next run:")
+        for take, error in sorted(failed_takes.items()):
+            print(f"  {take}: {error}")
+        sys.exit(1)
+    print("Well Done! Jerry!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Memoized asset loads for UE_PerformanceToSequence.py.
+
+The skeleton, the identity and the face control rig are the same for every take, but the script
+used to load them again in every take. AssetResolver loads each of them once per run, counts the hits,
+misses and load time of every asset and estimates the time the hits saved (a hit saves the mean
+load time of its asset). Assets the script creates or deletes per take aren't resolved here, and
+invalidate drops a cached asset that was deleted or replaced.
+"""
+import time
+
+import unreal
+
+
+def resolver_key(path):
+    # "/Game/A//B", "/Game/A/B.B" and "\\Game\\A\\B" name the same asset
+    path = path.replace("\\", "/").split(".")[0]
+    while "//" in path:
+        path = path.replace("//", "/")
+    return path.rstrip("/")
+
+
+class AssetResolver:
+    """
+    Cache of the loaded assets and classes of one run by kind and package path, with their stats:
+    {(kind, path): {"hits", "misses", "load_seconds"}}. A load that returns None isn't cached, the
+    asset may be created later in the run.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self.stats = {}
+
+    def _resolve(self, kind, path, load):
+        key = (kind, resolver_key(path))
+        stats = self.stats.setdefault(key, {"hits": 0, "misses": 0, "load_seconds": 0.0})
+        if key in self._cache:
+            stats["hits"] += 1
+            return self._cache[key]
+        start = time.perf_counter()
+        value = load()
+        stats["misses"] += 1
+        stats["load_seconds"] += time.perf_counter() - start
+        if value is not None:
+            self._cache[key] = value
+        return value
+
+    def load_asset(self, path):
+        return self._resolve("asset", path, lambda: unreal.load_asset(path))
+
+    def load_blueprint_class(self, path):
+        return self._resolve("blueprint_class", path, lambda: unreal.EditorAssetLibrary.load_blueprint_class(path))
+
+    def control_rig_class(self, path):
+        """
+        Class of the control rig blueprint at path, the control_rig_class bake_to_control_rig takes.
+        """
+        def load():
+            control_rig = unreal.load_object(name=path, outer=None)
+            return control_rig.get_control_rig_class() if control_rig is not None else None
+        return self._resolve("control_rig_class", path, load)
+
+    def invalidate(self, path=None):
+        """
+        Drop every cached asset and class of path, or the whole cache. The stats are kept.
+        """
+        if path is None:
+            self._cache.clear()
+            return
+        key = resolver_key(path)
+        for cached in [cached for cached in self._cache if cached[1] == key]:
+            del self._cache[cached]
+
+    def summary(self):
+        """
+        {"hits", "misses", "load_seconds", "saved_seconds"} over every asset.
+        """
+        totals = {"hits": 0, "misses": 0, "load_seconds": 0.0, "saved_seconds": 0.0}
+        for stats in self.stats.values():
+            totals["hits"] += stats["hits"]
+            totals["misses"] += stats["misses"]
+            totals["load_seconds"] += stats["load_seconds"]
+            if stats["misses"]:
+                totals["saved_seconds"] += stats["hits"] * stats["load_seconds"] / stats["misses"]
+        return totals
@@ -0,0 +1,86 @@
+"""
+Benchmark mgApplyFaceMocap, bulk curve keying against one setKeyframe per key, on the fake Maya
+modules of fake_maya.py. Both paths key on top of the same existing keys and have to produce the
+same curves, also with the scene in another linear unit than centimeters.
+
+  python benchmarks/bench_apply_face_mocap.py --frames 600 --controls 250 --linear_unit m
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fake_maya
+from synthetic_dataset import synthetic_face_anim
+
+LINEAR_UNITS = {"mm": 5, "cm": 6, "m": 8}
+
+
+def load_maya_script():
+    spec = importlib.util.spec_from_file_location("maya_export", os.path.join(REPO_DIR, "Maya_Auto_Multiple_Export_Version2.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def existing_curves(maya_script, face_anim):
+    # a key between the first two frames and one after the last, setKeyframe keeps both
+    curves = {}
+    for name, keys in face_anim.items():
+        curve = curves.setdefault(maya_script.resolve_control_attribute(name), {})
+        curve.update({keys[0][1] + 0.5: -1.0, keys[-1][1] + 1.0: -1.0})
+    return curves
+
+
+def run(maya_script, scene, file_path, bulk, curves):
+    scene.curves = {curve: dict(keys) for curve, keys in curves.items()}
+    scene.reset_calls()
+    start = time.perf_counter()
+    maya_script.mgApplyFaceMocap(file_path, bulk=bulk)
+    return time.perf_counter() - start, sum(scene.calls.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mgApplyFaceMocap benchmark")
+    parser.add_argument("--frames", type=int, default=600, help="Keys per control")
+    parser.add_argument("--controls", type=int, default=250, help="Number of controls")
+    parser.add_argument("--linear_unit", type=str, default="cm", choices=sorted(LINEAR_UNITS), help="Linear UI unit of the scene")
+    args = parser.parse_args()
+
+    scene = fake_maya.install()
+    scene.linear_unit = LINEAR_UNITS[args.linear_unit]
+    maya_script = load_maya_script()
+    face_anim = synthetic_face_anim(args.frames, args.controls)
+    scene.add_nodes(maya_script.resolve_control_attribute(name)[0] for name in face_anim)
+    curves = existing_curves(maya_script, face_anim)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "LS_Performance_face_anim.json")
+        with open(file_path, "w") as file:
+            file.write(json.dumps(face_anim))
+
+        per_key_time, per_key_calls = run(maya_script, scene, file_path, False, curves)
+        per_key_curves = scene.curves
+        bulk_time, bulk_calls = run(maya_script, scene, file_path, True, curves)
+
+    if per_key_curves.keys() != scene.curves.keys():
+        raise Exception("bulk keying touched different curves than setKeyframe")
+    for curve, keys in per_key_curves.items():
+        bulk_keys = scene.curves[curve]
+        if keys.keys() != bulk_keys.keys() or any(abs(keys[t] - bulk_keys[t]) > 1e-9 for t in keys):
+            raise Exception(f"bulk keying produced a different curve for {curve}")
+
+    print(f"controls: {args.controls}, keys per control: {args.frames}, linear unit: {args.linear_unit}")
+    print(f"per-key setKeyframe: {per_key_calls:8d} calls {per_key_time:8.3f} s")
+    print(f"bulk addKeys:        {bulk_calls:8d} calls {bulk_time:8.3f} s")
+    fake_maya.uninstall()
+
+
+if __name__ == "__main__":
+    main()
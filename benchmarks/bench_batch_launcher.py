@@ -0,0 +1,97 @@
+"""
+Run the shards of UE_BatchLauncher.py with fake_ue_worker.py standing in for the editor, over a
+synthetic capture set where the bake of some takes fails once. Checks that exactly the shards with a
+failing take are retried, that the retries finish them, that the shard logs and outputs are merged and
+that the face anim artifacts of the take index follow the merged files. With --retries 0 the failing
+shards stay failed and their outputs are not merged. Reports the wall time per worker count.
+
+  python benchmarks/bench_batch_launcher.py --takes 12 --frames 60 --workers 3 --fail_takes 3,8
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import take_index
+import UE_BatchLauncher as launcher
+from synthetic_dataset import write_captures
+
+SUBJECT = "Fretlyn"
+
+
+def run_batch(tmp_dir, args, workers, retries):
+    raw_data_path = os.path.join(tmp_dir, "raw")
+    write_captures(raw_data_path, args.takes, args.frames, SUBJECT)
+    index_path = os.path.join(tmp_dir, "index.sqlite")
+    work_dir = os.path.join(tmp_dir, "work")
+    output_path = os.path.join(tmp_dir, "output")
+    with take_index.TakeIndex(index_path) as index:
+        take_index.index_captures(index, SUBJECT, raw_data_path)
+        shards = launcher.split_shards(launcher.pending_takes(index, SUBJECT), args.takes_per_shard)
+    command = (f'"{sys.executable}" "{os.path.join(REPO_DIR, "fake_ue_worker.py")}" --seconds_per_frame {args.seconds_per_frame} '
+               f'--fail_takes {args.fail_takes} --state_dir "{tmp_dir}" -- --raw_data_path "{raw_data_path}" --take_index "{index_path}" '
+               f'--start_anim {{start}} --end_anim {{end}} --output_path "{{output}}"')
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        success = launcher.run_shards(shards, command, work_dir, SUBJECT, index_path, workers=workers, retries=retries, poll_seconds=0.05)
+    seconds = time.perf_counter() - start
+    launcher.merge_logs(shards, os.path.join(work_dir, "launcher.log"))
+    with take_index.TakeIndex(index_path) as index:
+        moved = launcher.merge_outputs(shards, work_dir, output_path, index)
+        face_anims = index.artifacts(SUBJECT, "face_anim")
+        still_pending = launcher.pending_takes(index, SUBJECT)
+
+    failing = {int(take) for take in args.fail_takes.split(",")}
+    for shard in shards:
+        retried = bool(failing & set(shard["takes"]))
+        expected_attempts = 1 + (retried and retries > 0)
+        if len(shard["attempts"]) != expected_attempts:
+            raise Exception(f"shard {shard['takes']} ran {len(shard['attempts'])} times, expected {expected_attempts}")
+        if retried and shard["attempts"][0]["exit_code"] == 0:
+            raise Exception(f"shard {shard['takes']} didn't report the failure of its bake")
+        if shard["status"] != ("failed" if retried and not retries else "done"):
+            raise Exception(f"shard {shard['takes']} ended {shard['status']}")
+    done_takes = [take for shard in shards if shard["status"] == "done" for take in shard["takes"]]
+    merged = sorted(os.listdir(output_path))
+    if moved != len(done_takes) or len(merged) != len(done_takes):
+        raise Exception(f"merged {moved} files for {len(done_takes)} takes of finished shards")
+    if any(os.path.dirname(face_anims[take]) != output_path for take in done_takes):
+        raise Exception("face anim artifacts of the take index don't point at the merged files")
+    if success != (not still_pending):
+        raise Exception(f"run_shards returned {success} with takes {still_pending} left")
+    with open(os.path.join(work_dir, "launcher.log"), "r") as file:
+        headers = sum(line.startswith("===== shard") for line in file)
+    if headers != sum(len(shard["attempts"]) for shard in shards):
+        raise Exception(f"the merged log has {headers} attempts")
+    return seconds, shards, success
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded UE batch launcher benchmark")
+    parser.add_argument("--takes", type=int, default=12, help="Number of takes")
+    parser.add_argument("--frames", type=int, default=60, help="Frames per take")
+    parser.add_argument("--workers", type=int, default=3, help="Worker processes of the parallel runs")
+    parser.add_argument("--takes_per_shard", type=int, default=2, help="Takes per shard")
+    parser.add_argument("--fail_takes", type=str, default="3,8", help="Comma separated takes whose bake fails once")
+    parser.add_argument("--seconds_per_frame", type=float, default=0.002, help="Processing time of start_pipeline per frame")
+    args = parser.parse_args()
+
+    print(f"takes: {args.takes} x {args.frames} frames, {args.takes_per_shard} takes per shard, bake of takes {args.fail_takes} fails once")
+    for workers, retries in [(1, 2), (args.workers, 2), (args.workers, 0)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            seconds, shards, success = run_batch(tmp_dir, args, workers, retries)
+        attempts = sum(len(shard["attempts"]) for shard in shards)
+        failed = sum(shard["status"] != "done" for shard in shards)
+        print(f"{workers} workers, {retries} retries: {seconds:6.2f} s, {len(shards)} shards in {attempts} attempts, "
+              f"{failed} failed, {'every take exported' if success else 'takes left for the next run'}")
+
+
+if __name__ == "__main__":
+    main()
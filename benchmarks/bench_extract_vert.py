@@ -0,0 +1,79 @@
+"""
+Benchmark the bulk OBJ vertex parser behind extract_vert against the original per-line parser.
+
+  python benchmarks/bench_extract_vert.py                 # synthetic 24049-vertex frames
+  python benchmarks/bench_extract_vert.py a.obj b.obj ...  # real frames
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from synthetic_dataset import write_synthetic_obj
+
+
+def load_script(file_name, module_name):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(REPO_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def extract_vert_per_line(filepath):
+    # the original extract_vert, kept as the reference implementation
+    with open(filepath, "r") as file:
+        vertex_data = [line.split()[1:4] for line in file if line.startswith("v ")]
+        vertex_array = np.array(vertex_data).astype(dtype="float32")
+        vert = np.reshape(vertex_array, (-1, vertex_array.shape[0] * vertex_array.shape[1]))
+        return vert
+
+
+def time_frames(extract, paths, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            extract(path)
+        best = min(best, time.perf_counter() - start)
+    return len(paths) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="extract_vert benchmark")
+    parser.add_argument("objs", nargs="*", help="OBJ frames to parse, synthetic frames are generated if empty")
+    parser.add_argument("--frames", type=int, default=20, help="Number of synthetic frames")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions, the best run is reported")
+    args = parser.parse_args()
+
+    sentence_packing = load_script("sentence-packing.py", "sentence_packing")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = args.objs
+        if not paths:
+            paths = [os.path.join(tmp_dir, f"Object_{i:03d}.obj") for i in range(args.frames)]
+            for seed, path in enumerate(paths):
+                write_synthetic_obj(path, seed)
+
+        for path in paths:
+            expected = extract_vert_per_line(path)
+            actual = sentence_packing.extract_vert(path)
+            if actual.shape != expected.shape or not np.array_equal(actual, expected):
+                raise Exception(f"extract_vert output differs from the per-line parser for {path}")
+
+        per_line_fps = time_frames(extract_vert_per_line, paths, args.repeat)
+        bulk_fps = time_frames(sentence_packing.extract_vert, paths, args.repeat)
+
+    print(f"frames: {len(paths)}")
+    print(f"per-line extract_vert: {per_line_fps:8.1f} frames/sec")
+    print(f"bulk extract_vert:     {bulk_fps:8.1f} frames/sec ({bulk_fps / per_line_fps:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
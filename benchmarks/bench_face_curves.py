@@ -0,0 +1,85 @@
+"""
+Benchmark the key reduction of face_curves.py on synthetic face anims with sparse controls: size of
+the .mhfc files with and without the dense matrix against the JSON export, reduced keys and write and
+read times for every tolerance. Every reduced file has to stay within its tolerance of the raw keys,
+and a file without the dense matrix has to read back with the NaN gaps of the sparse controls.
+
+  python benchmarks/bench_face_curves.py --frames 2000 --controls 250 --tolerances 1e-4 1e-3 1e-2
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import face_curves
+from synthetic_dataset import synthetic_face_anim
+
+
+def sparse_face_anim(num_frames, num_controls, sparse_every):
+    # every sparse_every-th control only has keys on the first and last third of the take, like a
+    # control the solver left alone in between
+    face_anim = synthetic_face_anim(num_frames, num_controls)
+    for num, control_name in enumerate(face_anim):
+        if sparse_every and num % sparse_every == sparse_every - 1:
+            face_anim[control_name] = [key for key in face_anim[control_name] if not num_frames // 3 < key[1] <= 2 * num_frames // 3]
+    return face_anim
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face curve key reduction benchmark")
+    parser.add_argument("--frames", type=int, default=2000, help="Frames per take")
+    parser.add_argument("--controls", type=int, default=250, help="Number of controls")
+    parser.add_argument("--sparse_every", type=int, default=10, help="Every n-th control has a gap of a third of the take, 0 for none")
+    parser.add_argument("--tolerances", type=float, nargs="+", default=[1e-4, 1e-3, 1e-2], help="Reduction tolerances")
+    args = parser.parse_args()
+
+    face_anim = sparse_face_anim(args.frames, args.controls, args.sparse_every)
+    control_names, frames, values = face_anim_columns = face_curves.face_anim_to_columns(face_anim)
+    matrix = np.frombuffer(values, dtype=np.float32).reshape(len(frames), len(control_names))
+    keyed = ~np.isnan(matrix)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, "face_anim.json")
+        with open(json_path, "w") as file:
+            json.dump(face_anim, file)
+        dense_path = os.path.join(tmp_dir, "dense" + face_curves.EXTENSION)
+        face_curves.write_curves(dense_path, *face_anim_columns)
+        json_size, dense_size = os.path.getsize(json_path), os.path.getsize(dense_path)
+
+        for tolerance in args.tolerances:
+            for dense in (True, False):
+                path = os.path.join(tmp_dir, f"reduced_{tolerance}_{int(dense)}{face_curves.EXTENSION}")
+                start = time.perf_counter()
+                face_curves.write_curves(path, *face_anim_columns, reduce_tolerance=tolerance, dense=dense)
+                write_time = time.perf_counter() - start
+                start = time.perf_counter()
+                curves = face_curves.read_curves(path)
+                read_values = np.array(curves.values)
+                read_time = time.perf_counter() - start
+                header = face_curves.read_header(path)
+                reduced = face_curves.read_reduced(path, header)
+                error = face_curves.reduction_error(frames, matrix, reduced)
+                if error > tolerance or header["reduced"]["max_error"] > tolerance:
+                    raise Exception(f"reduction at tolerance {tolerance} is off by {error}")
+                if not np.array_equal(~np.isnan(read_values), keyed):
+                    raise Exception(f"{os.path.basename(path)} reads back with different NaN gaps")
+                if not dense and np.abs(read_values[keyed] - matrix[keyed]).max() > tolerance:
+                    raise Exception(f"{os.path.basename(path)} reads back off by more than {tolerance}")
+                rows.append((tolerance, dense, header["reduced"]["num_keys"], error, os.path.getsize(path), write_time, read_time))
+
+    print(f"frames: {args.frames}, controls: {args.controls}, keys: {int(keyed.sum())}, "
+          f"json {json_size / 1024:.0f} KB, dense {dense_size / 1024:.0f} KB")
+    for tolerance, dense, num_keys, error, size, write_time, read_time in rows:
+        print(f"tolerance {tolerance:<8g} {'with dense' if dense else 'reduced only':12s} {num_keys:9d} keys, max error {error:.3g}, "
+              f"{size / 1024:7.0f} KB ({json_size / size:5.1f}x json), write {write_time:6.3f} s, read {read_time:6.3f} s")
+
+
+if __name__ == "__main__":
+    main()
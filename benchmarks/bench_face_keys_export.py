@@ -0,0 +1,98 @@
+"""
+Benchmark the face keys export, batched channel extraction against reading every key, on the fake
+unreal module of fake_unreal.py. Both have to export the same keys. The extraction is timed on its
+own and as part of the whole export with its JSON write, --seconds_per_call gives every engine call
+the latency of the Python/engine bridge.
+
+  python benchmarks/bench_face_keys_export.py --frames 600 --controls 250 --sparse_every 10 --seconds_per_call 0.00002
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fake_unreal
+
+
+def load_ue_script():
+    spec = importlib.util.spec_from_file_location("ue_performance", os.path.join(REPO_DIR, "UE_PerformanceToSequence.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def extract_per_key(channels):
+    # the key by key loop mgMetaHuman_face_keys_export had before face_channels.py
+    import unreal
+    face_anim = {}
+    for channel in channels:
+        channel_name = str(channel.get_name())
+        channel_string_list = channel_name.split('_')
+        control_name = channel_name.replace('_' + channel_string_list[-1], '')
+        try:
+            numKeys = channel.get_num_keys()
+            key_list = [None] * numKeys
+            keys = channel.get_keys()
+            for key in range(0, numKeys):
+                key_value = keys[key].get_value()
+                key_time = keys[key].get_time(time_unit=unreal.SequenceTimeUnit.DISPLAY_RATE).frame_number.value
+                key_list[key] = ([key_value, key_time])
+            face_anim[control_name] = key_list
+        except:
+            face_anim[control_name] = []
+    return face_anim
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face keys export benchmark")
+    parser.add_argument("--frames", type=int, default=600, help="Frames per take")
+    parser.add_argument("--controls", type=int, default=250, help="Number of controls")
+    parser.add_argument("--sparse_every", type=int, default=10, help="Every n-th channel only has a key every 4 frames, 0 for none")
+    parser.add_argument("--seconds_per_call", type=float, default=0.0, help="Wall time of every engine call")
+    args = parser.parse_args()
+
+    editor = fake_unreal.install()
+    editor.seconds_per_call = args.seconds_per_call
+    ue_script = load_ue_script()
+    channels = fake_unreal.synthetic_channels(args.controls, args.frames, sparse_every=args.sparse_every, failing=[1])
+    sequence = editor.add_face_sequence("LS_Performance_1", channels)
+
+    editor.reset_calls()
+    start = time.perf_counter()
+    per_key = extract_per_key(channels)
+    per_key_time = time.perf_counter() - start
+    per_key_calls = sum(editor.calls.values())
+
+    editor.reset_calls()
+    start = time.perf_counter()
+    channel_keys, _ = ue_script.face_channels.extract_channels(sequence, channels)
+    batched = ue_script.face_channels.to_face_anim(channel_keys)
+    extract_time = time.perf_counter() - start
+    extract_calls = sum(editor.calls.values())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        editor.reset_calls()
+        start = time.perf_counter()
+        written_files, face_anim, failures = ue_script.mgMetaHuman_face_keys_export(sequence, tmp_dir)
+        batched_time = time.perf_counter() - start
+        batched_calls = sum(editor.calls.values())
+        with open(written_files[0], "r") as file:
+            exported = json.load(file)
+
+    if batched != per_key or exported != per_key:
+        raise Exception("batched extraction exported different keys than the per key loop")
+    print(f"controls: {args.controls}, frames: {args.frames}, failed controls: {sorted(failures)}")
+    print(f"per key reads:     {per_key_calls:8d} calls {per_key_time:8.3f} s")
+    print(f"extract_channels:  {extract_calls:8d} calls {extract_time:8.3f} s")
+    print(f"batched export:    {batched_calls:8d} calls {batched_time:8.3f} s (including the JSON write)")
+    fake_unreal.uninstall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark npy-to-obj.py against writing the frames of a packed sentence a "v %f %f %f" line at a
+time, and with replace_obj_blocks, which writes the whole reference OBJ, normals and faces included,
+with the vertex block of every frame. Every written frame has to parse back to its sentence frame.
+
+  python benchmarks/bench_npy_to_obj.py --frames 120 --workers 4
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from mesh_io import read_obj_vertices, replace_obj_blocks
+from sentence_loader import UNTRIMMED_DIR
+from synthetic_dataset import write_obj, write_sentences, neutral_mesh
+
+
+def load_npy_to_obj():
+    spec = importlib.util.spec_from_file_location("npy_to_obj", os.path.join(REPO_DIR, "npy-to-obj.py"))
+    module = importlib.util.module_from_spec(spec)
+    # the worker processes find write_frames by module name
+    sys.modules["npy_to_obj"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_per_line(frames, output_dir):
+    for frame, vertices in enumerate(frames.reshape(len(frames), -1, 3)):
+        with open(os.path.join(output_dir, f"{frame:05d}.obj"), "w") as file:
+            for x, y, z in vertices:
+                file.write(f"v {x:f} {y:f} {z:f}\n")
+
+
+def write_replace_blocks(frames, reference, output_dir):
+    for frame, vertices in enumerate(frames.reshape(len(frames), -1, 3)):
+        with open(os.path.join(output_dir, f"{frame:05d}.obj"), "wb") as file:
+            file.write(replace_obj_blocks(reference, b"v ", vertices))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NPY to OBJ benchmark")
+    parser.add_argument("--frames", type=int, default=120, help="Frames of the sentence")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes of the parallel run")
+    args = parser.parse_args()
+
+    npy_to_obj = load_npy_to_obj()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_sentences(tmp_dir, 1, 1, args.frames, frame_jitter=0)
+        sentence_dir = os.path.join(tmp_dir, UNTRIMMED_DIR)
+        sentence_path = os.path.join(sentence_dir, sorted(os.listdir(sentence_dir))[0])
+        frames = np.load(sentence_path)
+        reference_path = os.path.join(tmp_dir, "reference.obj")
+        write_obj(reference_path, neutral_mesh())
+        with open(reference_path, "rb") as file:
+            reference = file.read()
+
+        runs = [
+            ("per line", lambda output_dir: write_per_line(frames, output_dir)),
+            ("replace_obj_blocks", lambda output_dir: write_replace_blocks(frames, reference, output_dir)),
+            ("npy-to-obj, 1 worker", lambda output_dir: npy_to_obj.npy_to_obj([sentence_path], reference_path, output_dir, workers=1)),
+            (f"npy-to-obj, {args.workers} workers",
+             lambda output_dir: npy_to_obj.npy_to_obj([sentence_path], reference_path, output_dir, workers=args.workers)),
+        ]
+        results = []
+        for index, (label, run) in enumerate(runs):
+            output_dir = os.path.join(tmp_dir, f"out_{index}")
+            os.makedirs(output_dir)
+            start = time.perf_counter()
+            run(output_dir)
+            seconds = time.perf_counter() - start
+            paths = sorted(os.path.join(root, name) for root, _, names in os.walk(output_dir) for name in names)
+            if len(paths) != len(frames):
+                raise Exception(f"{label} wrote {len(paths)} OBJs for {len(frames)} frames")
+            for path in paths[::max(1, len(paths) // 8)]:
+                frame = int(os.path.splitext(path)[0].split("_")[-1].split(os.sep)[-1])
+                if np.abs(read_obj_vertices(path).ravel() - frames[frame]).max() > 1e-6:
+                    raise Exception(f"{label}: {path} doesn't match frame {frame}")
+            results.append((label, seconds, sum(os.path.getsize(path) for path in paths)))
+
+    print(f"frames: {len(frames)}, {frames.shape[1] // 3} vertices")
+    for label, seconds, size in results:
+        print(f"{label:24s} {seconds:7.3f} s {len(frames) / seconds:8.1f} frames/s {size / (1 << 20):8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Benchmark suite of the post-processing stages on a synthetic dataset (see synthetic_dataset.py):
+extract_vert, the normalization, do_sentence_packing, get_frame_numbers and the face curve parsing.
+Every benchmark reports its throughput over the best of --repeat runs, and the peak memory allocated
+by one more run under tracemalloc (the main process only, not the packing workers).
+
+With --metrics the results are appended as spans of metrics.py, to compare two runs:
+
+  python benchmarks/bench_postprocessing.py --frames 60 --metrics tonight.jsonl
+  python metrics.py report tonight.jsonl --baseline last_night.jsonl --threshold 10
+
+The read-ahead of mesh_io.prefetch_files only pays off when reads are slow, --read_latency_ms adds
+a delay to every file read like the one of the network storage:
+
+  python benchmarks/bench_postprocessing.py --only packing normalization --read_latency_ms 5
+
+  python benchmarks/bench_postprocessing.py [--dataset DIR] [--subjects 1 --scenarios 2 --frames 20] [--only packing normalization]
+"""
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fake_maya
+import face_curves
+import mesh_io
+import metrics
+import take_index
+from synthetic_dataset import make_dataset, load_dataset, DATASET_FILE
+
+
+def load_script(file_name, module_name):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(REPO_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    # the packing workers find the functions they run by module name
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def dataset_files(root, tree, pattern="*.obj"):
+    return sorted(glob.glob(os.path.join(root, tree, "*", "*", pattern)))
+
+
+# every benchmark is (group, unit, setup), setup(context) returns the function to time, which
+# returns the number of items it processed
+
+def bench_extract_vert(context):
+    paths = dataset_files(context["root"], "normalized")
+
+    def run():
+        for path in paths:
+            context["sentence_packing"].extract_vert(path)
+        return len(paths)
+    return run
+
+
+def bench_extract_vert_normalize(context):
+    paths = dataset_files(context["root"], "raw")
+
+    def run():
+        for path in paths:
+            context["sentence_packing"].extract_vert(path, normalize=True)
+        return len(paths)
+    return run
+
+
+def normalization(read_ahead=mesh_io.READ_AHEAD):
+    def setup(context):
+        normalize_script = context["normalize_script"]
+        normalize_script.BASE_DATA_PATH = context["root"]
+        num_files = len(dataset_files(context["root"], "raw"))
+
+        def run():
+            normalize_script.do_normalization("numpy", force=True, index_path=context["index_path"], rescan=True,
+                                              read_ahead=read_ahead)
+            return num_files
+        return run
+    return setup
+
+
+def packing(workers, source, read_ahead=mesh_io.READ_AHEAD, stats=True):
+    def setup(context):
+        num_frames = len(dataset_files(context["root"], source))
+
+        def run():
+            failures = context["sentence_packing"].do_sentence_packing(
+                context["root"], workers=workers or context["workers"], source=source, force=True,
+                index_path=context["index_path"], rescan=True, read_ahead=read_ahead, stats=stats)
+            if failures:
+                raise Exception(f"packing failed: {failures}")
+            return num_frames
+        return run
+    return setup
+
+
+def face_anim_paths(context):
+    return sorted(glob.glob(os.path.join(context["root"], "face_anim", "*_face_anim.json")))
+
+
+def binary_paths(context):
+    # the binary exports of the JSON exports, converted once
+    paths = []
+    for json_path in face_anim_paths(context):
+        binary_path = os.path.splitext(json_path)[0] + face_curves.EXTENSION
+        if not os.path.exists(binary_path):
+            face_curves.convert_json(json_path)
+        paths.append(binary_path)
+    return paths
+
+
+def bench_get_frame_numbers_json(context):
+    paths = face_anim_paths(context)
+
+    def run():
+        for path in paths:
+            context["maya_script"].get_frame_numbers(path)
+        return len(paths)
+    return run
+
+
+def bench_get_frame_numbers_binary(context):
+    paths = binary_paths(context)
+
+    def run():
+        for path in paths:
+            context["maya_script"].get_frame_numbers(path)
+        return len(paths)
+    return run
+
+
+def bench_get_frame_numbers_index(context):
+    paths = face_anim_paths(context)
+    index = take_index.TakeIndex(context["index_path"])
+    for take, path in enumerate(paths, 1):
+        index.update_take("synthetic", take, key_frames=context["params"]["frames"], controls=context["params"]["controls"])
+        index.set_artifact("synthetic", take, "face_anim", path)
+
+    def run():
+        for path in paths:
+            context["maya_script"].get_frame_numbers(path, index)
+        return len(paths)
+    return run
+
+
+def num_keys(context):
+    return len(face_anim_paths(context)) * context["params"]["frames"] * context["params"]["controls"]
+
+
+def bench_read_face_anim_json(context):
+    paths = face_anim_paths(context)
+
+    def run():
+        for path in paths:
+            face_curves.read_face_anim_json(path)
+        return num_keys(context)
+    return run
+
+
+def load_face_curves(paths_of):
+    def setup(context):
+        paths = paths_of(context)
+
+        def run():
+            for path in paths:
+                for _ in context["maya_script"].load_face_curves(path):
+                    pass
+            return num_keys(context)
+        return run
+    return setup
+
+
+def bench_read_curves(context):
+    paths = binary_paths(context)
+
+    def run():
+        for path in paths:
+            # touch the memory-mapped values
+            float(face_curves.read_curves(path).values.sum())
+        return num_keys(context)
+    return run
+
+
+BENCHMARKS = {
+    "extract_vert": ("extract_vert", "frames", bench_extract_vert),
+    "extract_vert_normalize": ("extract_vert", "frames", bench_extract_vert_normalize),
+    "normalization": ("normalization", "files", normalization()),
+    "normalization_no_read_ahead": ("normalization", "files", normalization(read_ahead=0)),
+    "sentence_packing": ("packing", "frames", packing(1, "normalized")),
+    "sentence_packing_workers": ("packing", "frames", packing(None, "normalized")),
+    "sentence_packing_raw": ("packing", "frames", packing(1, "raw")),
+    "sentence_packing_no_read_ahead": ("packing", "frames", packing(1, "normalized", read_ahead=0)),
+    "sentence_packing_no_stats": ("packing", "frames", packing(1, "normalized", stats=False)),
+    "get_frame_numbers_json": ("frame_numbers", "files", bench_get_frame_numbers_json),
+    "get_frame_numbers_binary": ("frame_numbers", "files", bench_get_frame_numbers_binary),
+    "get_frame_numbers_index": ("frame_numbers", "files", bench_get_frame_numbers_index),
+    "read_face_anim_json": ("curves", "keys", bench_read_face_anim_json),
+    "load_face_curves_json": ("curves", "keys", load_face_curves(face_anim_paths)),
+    "load_face_curves_binary": ("curves", "keys", load_face_curves(binary_paths)),
+    "read_curves_binary": ("curves", "keys", bench_read_curves),
+}
+
+
+def measure(run, repeat):
+    """
+    Best time of repeat runs and the peak memory allocated by one more run, the prints of the
+    pipeline functions are kept out of the output.
+    """
+    best = float("inf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            items = run()
+            best = min(best, time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return items, best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-processing benchmark suite")
+    parser.add_argument("--dataset", type=str, help="Dataset folder, generated there when it has no dataset.json yet, a temporary one by default", default=None)
+    parser.add_argument("--subjects", type=int, default=1, help="Subjects of a generated dataset")
+    parser.add_argument("--scenarios", type=int, default=2, help="Scenarios per subject of a generated dataset")
+    parser.add_argument("--frames", type=int, default=20, help="Frames per scenario of a generated dataset")
+    parser.add_argument("--controls", type=int, default=250, help="Face controls of a generated dataset")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions, the best run is reported")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes of sentence_packing_workers")
+    parser.add_argument("--read_latency_ms", type=float, default=0.0, help="Delay added to every file read by mesh_io, to stand in for network storage")
+    parser.add_argument("--only", type=str, nargs="*", help="Benchmarks or groups to run, all by default", default=None)
+    parser.add_argument("--json", type=str, help="Also write the results to this file", default=None)
+    parser.add_argument("--metrics", type=str, help="Append the results as spans to this metrics file", default=None)
+    args = parser.parse_args()
+
+    selected = [name for name, (group, _, _) in BENCHMARKS.items() if not args.only or name in args.only or group in args.only]
+    if not selected:
+        parser.error(f"no benchmark matches {args.only}, choose from {sorted(BENCHMARKS)}")
+    metrics.configure(args.metrics, "bench_postprocessing")
+    fake_maya.install()
+    if args.read_latency_ms:
+        read_file = mesh_io.read_file
+
+        def slow_read_file(filepath):
+            time.sleep(args.read_latency_ms / 1000.0)
+            return read_file(filepath)
+        # the packing workers are forked with it
+        mesh_io.read_file = slow_read_file
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = args.dataset or os.path.join(tmp_dir, "dataset")
+        if not os.path.exists(os.path.join(root, DATASET_FILE)):
+            start = time.perf_counter()
+            make_dataset(root, args.subjects, args.scenarios, args.frames, args.controls)
+            print(f"Generated the dataset in {root} in {time.perf_counter() - start:.1f} s")
+        context = {
+            "root": root,
+            "params": load_dataset(root),
+            "index_path": os.path.join(tmp_dir, "takes.sqlite"),
+            "workers": args.workers,
+            "sentence_packing": load_script("sentence-packing.py", "sentence_packing"),
+            "normalize_script": load_script("normalize-all-in-raw.py", "normalize_all_in_raw"),
+            "maya_script": load_script("Maya_Auto_Multiple_Export_Version2.py", "maya_export"),
+        }
+        params = context["params"]
+        print(f"dataset: {len(params['subjects'])} subjects x {params['scenarios']} scenarios x {params['frames']} frames, "
+              f"{params['num_vertices']} vertices, {params['controls']} controls")
+        print(f"{'benchmark':32s} {'items':>9s} {'unit':>7s} {'best s':>9s} {'items/s':>12s} {'alloc MB':>9s}")
+
+        results = []
+        for name in selected:
+            group, unit, setup = BENCHMARKS[name]
+            items, seconds, peak = measure(setup(context), args.repeat)
+            result = {"name": name, "group": group, "unit": unit, "items": items, "seconds": seconds,
+                      "items_per_second": items / seconds if seconds > 0 else None, "peak_alloc_mb": peak / (1 << 20)}
+            results.append(result)
+            print(f"{name:32s} {items:9d} {unit:>7s} {seconds:9.4f} {result['items_per_second']:12.1f} {result['peak_alloc_mb']:9.1f}")
+            metrics.record(name, seconds, items=items, group=group, unit=unit, peak_alloc_mb=round(result["peak_alloc_mb"], 1),
+                           dataset=params)
+
+    peak_rss = metrics.memory_usage()[0]
+    if peak_rss is not None:
+        print(f"peak RSS of the suite: {peak_rss / (1 << 20):.1f} MB")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"dataset": params, "results": results}, file, indent=2)
+    fake_maya.uninstall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark the memory-mapped SentenceLoader of sentence_loader.py against loading every packed
+sentence with np.load and indexing the frames by hand, on synthetic sentences of synthetic_dataset.py.
+Both have to serve the same frames.
+
+  python benchmarks/bench_sentence_loader.py --subjects 2 --scenarios 4 --frames 100 --batch_size 256
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import metrics
+from sentence_loader import SentenceLoader, UNTRIMMED_DIR
+from synthetic_dataset import write_sentences
+
+
+def rss_mb():
+    current = metrics.memory_usage()[1]
+    return current / (1 << 20) if current is not None else float("nan")
+
+
+def load_all(sentence_dir):
+    # what the training jobs do today: every sentence in memory and a frame index built from them
+    names = sorted(name for name in os.listdir(sentence_dir) if name.endswith(".npy"))
+    sentences = []
+    for name in names:
+        frames = np.load(os.path.join(sentence_dir, name))
+        sentences.append(frames.reshape(len(frames) if frames.ndim == 2 else 1, -1))
+    index = [(sentence, row) for sentence, frames in enumerate(sentences) for row in range(len(frames))]
+    return sentences, index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packed sentence loader benchmark")
+    parser.add_argument("--subjects", type=int, default=2, help="Subjects")
+    parser.add_argument("--scenarios", type=int, default=4, help="Sentences per subject")
+    parser.add_argument("--frames", type=int, default=100, help="Frames per sentence, give or take half")
+    parser.add_argument("--batch_size", type=int, default=256, help="Frames per random batch")
+    parser.add_argument("--batches", type=int, default=50, help="Random batches to read")
+    parser.add_argument("--window", type=int, default=32, help="Frames per window")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_sentences(tmp_dir, args.subjects, args.scenarios, args.frames)
+        sentence_dir = os.path.join(tmp_dir, UNTRIMMED_DIR)
+        rng = np.random.default_rng(0)
+
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        sentences, index = load_all(sentence_dir)
+        load_all_time = time.perf_counter() - start
+        load_all_rss = rss_mb() - rss_before
+
+        start = time.perf_counter()
+        cold = SentenceLoader(sentence_dir)
+        cold_time = time.perf_counter() - start
+        start = time.perf_counter()
+        loader = SentenceLoader(sentence_dir)
+        warm_time = time.perf_counter() - start
+        if len(loader) != len(index):
+            raise Exception(f"the loader has {len(loader)} frames, np.load {len(index)}")
+
+        batches = [loader.random_frames(args.batch_size, rng) for _ in range(args.batches)]
+        start = time.perf_counter()
+        for frames in batches:
+            np.stack([sentences[index[frame][0]][index[frame][1]] for frame in frames])
+        load_all_batch_time = time.perf_counter() - start
+        start = time.perf_counter()
+        out = np.empty((args.batch_size, loader.frame_size), dtype=np.float32)
+        for frames in batches:
+            loader.gather(frames, out)
+        gather_time = time.perf_counter() - start
+        expected = np.stack([sentences[index[frame][0]][index[frame][1]] for frame in batches[-1]])
+        if not np.array_equal(out, expected):
+            raise Exception("the loader served different frames than np.load")
+
+        starts = loader.window_starts(args.window, args.window)
+        start = time.perf_counter()
+        checksum = sum(float(window[0, 0]) for window in loader.windows(starts, args.window))
+        window_time = time.perf_counter() - start
+        del sentences, index, checksum
+
+    num_frames = len(loader)
+    print(f"sentences: {loader.num_sentences}, frames: {num_frames}, {num_frames * loader.frame_size * 4 / (1 << 20):.0f} MB")
+    print(f"np.load all:        startup {load_all_time:8.3f} s, +{load_all_rss:7.1f} MB RSS, "
+          f"{args.batches * args.batch_size / load_all_batch_time:10.0f} random frames/s")
+    print(f"SentenceLoader:     startup {cold_time:8.3f} s cold, {warm_time:.4f} s with the index file, "
+          f"{args.batches * args.batch_size / gather_time:10.0f} random frames/s gathered")
+    print(f"windows as views:   {len(starts)} windows of {args.window} frames in {window_time:.4f} s")
+
+
+if __name__ == "__main__":
+    main()
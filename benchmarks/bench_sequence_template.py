@@ -0,0 +1,97 @@
+"""
+Run UE_PerformanceToSequence.py on the fake unreal module of fake_unreal.py with a new level sequence
+per take and with the template pool of --sequence_mode template, on the same synthetic capture set.
+Reports the engine calls of the level sequence stage per take, the add_possessable calls of the run,
+the level sequences left in the project and the tracks the sequences hold at the end. Both modes have to export the same face anim keys.
+
+  python benchmarks/bench_sequence_template.py --takes 40 --frames 300 [--chunk_frames 120]
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fake_unreal
+import metrics
+from synthetic_dataset import write_captures
+
+
+def load_ue_script():
+    spec = importlib.util.spec_from_file_location("ue_performance", os.path.join(REPO_DIR, "UE_PerformanceToSequence.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_mode(mode, args, tmp_dir, raw_data_path):
+    editor = fake_unreal.install()
+    ue_script = load_ue_script()
+    for take in range(1, args.takes + 1):
+        editor.add_capture(f"/Game/FacialCapture/Fretlyn_CaptureSource_Ingested/Fretlyn_{take}")
+    # count the engine calls of the level sequence stage alone
+    stage_calls = [0]
+    stage_level_sequence = ue_script.TAKE_STAGE_FUNCTIONS["level_sequence"]
+
+    def counted_stage(*stage_args):
+        before = sum(editor.calls.values())
+        detail = stage_level_sequence(*stage_args)
+        stage_calls[0] += sum(editor.calls.values()) - before
+        return detail
+    ue_script.TAKE_STAGE_FUNCTIONS["level_sequence"] = counted_stage
+    output_path = os.path.join(tmp_dir, mode)
+    metrics_path = os.path.join(tmp_dir, f"{mode}.jsonl")
+    sys.argv = ["UE_PerformanceToSequence.py", "--raw_data_path", raw_data_path, "--output_path", output_path,
+                "--take_index", os.path.join(tmp_dir, f"{mode}.sqlite"), "--sequence_mode", mode, "--metrics", metrics_path]
+    if args.chunk_frames:
+        sys.argv += ["--chunk_mode", "always", "--chunk_frames", str(args.chunk_frames)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        ue_script.main()
+    spans = [span for span in metrics.read_spans([metrics_path]) if span["name"] == "level_sequence"]
+    sequences = [asset for asset in editor.assets.values() if isinstance(asset, editor.unreal.LevelSequence)]
+    tracks = sum(len(binding.tracks) for sequence in sequences for binding in sequence.get_bindings())
+    result = {
+        "calls": stage_calls[0],
+        "possessables": editor.calls["LevelSequence.add_possessable"],
+        "seconds": sum(span["seconds"] for span in spans),
+        "sequences": len(sequences),
+        "tracks": tracks,
+        "exports": {name: json.load(open(os.path.join(output_path, name))) for name in sorted(os.listdir(output_path))},
+    }
+    fake_unreal.uninstall()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Level sequence template benchmark")
+    parser.add_argument("--takes", type=int, default=40, help="Number of takes")
+    parser.add_argument("--frames", type=int, default=300, help="Frames per take")
+    parser.add_argument("--chunk_frames", type=int, default=0, help="Process every take in windows of this many frames, 0 for one window")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_data_path = os.path.join(tmp_dir, "raw")
+        write_captures(raw_data_path, args.takes, args.frames)
+        results = {}
+        for mode in ("per_take", "template"):
+            start = time.perf_counter()
+            results[mode] = run_mode(mode, args, tmp_dir, raw_data_path)
+            results[mode]["total"] = time.perf_counter() - start
+
+    if results["per_take"]["exports"] != results["template"]["exports"]:
+        raise Exception("the template pool exported different face anim keys")
+    print(f"takes: {args.takes} x {args.frames} frames, {len(results['template']['exports'])} face anim exports identical")
+    for mode, result in results.items():
+        print(f"{mode:9s} {result['calls'] / args.takes:7.1f} engine calls/take, {result['possessables']:4d} add_possessable, level_sequence stage {result['seconds']:7.3f} s, "
+              f"run {result['total']:6.2f} s, {result['sequences']:4d} level sequences, {result['tracks']:5d} tracks left")
+
+
+if __name__ == "__main__":
+    main()
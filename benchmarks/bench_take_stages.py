@@ -0,0 +1,91 @@
+"""
+Run UE_PerformanceToSequence.py on the fake unreal module of fake_unreal.py over a synthetic capture
+set, with one take failing in the bake, then run it again and after an editor restart. The re-runs
+only redo the stages that aren't done in the take index.
+
+  python benchmarks/bench_take_stages.py --takes 40 --frames 300 --fail_take 17 [--seconds_per_load 0.05]
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fake_unreal
+import take_index
+from synthetic_dataset import write_captures
+
+
+def load_ue_script():
+    spec = importlib.util.spec_from_file_location("ue_performance", os.path.join(REPO_DIR, "UE_PerformanceToSequence.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run(ue_script, editor, argv):
+    editor.reset_calls()
+    sys.argv = ["UE_PerformanceToSequence.py"] + argv
+    start = time.perf_counter()
+    exit_code = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            ue_script.main()
+        except SystemExit as error:
+            exit_code = error.code
+    return time.perf_counter() - start, exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-take stage checkpointing benchmark")
+    parser.add_argument("--takes", type=int, default=40, help="Number of takes")
+    parser.add_argument("--frames", type=int, default=300, help="Frames per take")
+    parser.add_argument("--fail_take", type=int, default=17, help="Take whose bake fails in the first run")
+    parser.add_argument("--seconds_per_load", type=float, default=0.0, help="Wall time of every asset load of the fake editor")
+    args = parser.parse_args()
+
+    editor = fake_unreal.install()
+    editor.seconds_per_load = args.seconds_per_load
+    ue_script = load_ue_script()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_data_path = os.path.join(tmp_dir, "raw")
+        output_path = os.path.join(tmp_dir, "output")
+        index_path = os.path.join(tmp_dir, "takes.sqlite")
+        write_captures(raw_data_path, args.takes, args.frames)
+        for take in range(1, args.takes + 1):
+            editor.add_capture(f"/Game/FacialCapture/Fretlyn_CaptureSource_Ingested/Fretlyn_{take}")
+        argv = ["--raw_data_path", raw_data_path, "--output_path", output_path, "--take_index", index_path]
+
+        # the bake of fail_take fails once
+        original_bake = editor.unreal.ControlRigSequencerLibrary.bake_to_control_rig
+        failed = []
+
+        def failing_bake(world, level_sequence, **kwargs):
+            if level_sequence.get_name() == f"LS_Performance_Fretlyn_{args.fail_take}" and not failed:
+                failed.append(level_sequence.get_name())
+                raise RuntimeError("simulated bake crash")
+            return original_bake(world, level_sequence, **kwargs)
+
+        editor.unreal.ControlRigSequencerLibrary.bake_to_control_rig = staticmethod(failing_bake)
+        for label, restart in [("first run", False), ("re-run", False), ("re-run, all done", False), ("after restart", True)]:
+            if restart:
+                editor.restart()
+            elapsed, exit_code = run(ue_script, editor, argv)
+            with take_index.TakeIndex(index_path) as index:
+                exported = sum(index.stage_status("Fretlyn", take, "face_anim_export") == "done" for take in range(1, args.takes + 1))
+            loads = sum(count for name, count in editor.calls.items() if "load_" in name)
+            resolved = ue_script.assets.summary()
+            print(f"{label:18s} exit {exit_code} {sum(editor.calls.values()):8d} engine calls "
+                  f"{editor.calls['ControlRigSequencerLibrary.bake_to_control_rig']:4d} bakes {elapsed:7.3f} s, {exported}/{args.takes} takes exported, "
+                  f"{loads:4d} loads, {resolved['hits']:4d} cache hits saved {resolved['saved_seconds']:.2f} s")
+    fake_unreal.uninstall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark the vectorized frame displacement of trimming.py against a per-frame loop, on synthetic
+sentences of synthetic_dataset.py. Both have to find the same active ranges.
+
+  python benchmarks/bench_trim_sentences.py --scenarios 4 --frames 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from sentence_loader import SentenceLoader, UNTRIMMED_DIR
+from synthetic_dataset import write_sentences
+from trimming import frame_displacement, active_range
+
+
+def displacement_per_frame(frames):
+    # one frame at a time, the way a script without trimming.py would do it
+    reference = np.asarray(frames[0]).reshape(-1, 3)
+    return np.array([np.linalg.norm(np.asarray(frame).reshape(-1, 3) - reference, axis=1).max() for frame in frames], dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rest-pose trimming benchmark")
+    parser.add_argument("--subjects", type=int, default=1, help="Subjects")
+    parser.add_argument("--scenarios", type=int, default=4, help="Sentences per subject")
+    parser.add_argument("--frames", type=int, default=200, help="Frames per sentence, give or take half")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_sentences(tmp_dir, args.subjects, args.scenarios, args.frames)
+        loader = SentenceLoader(os.path.join(tmp_dir, UNTRIMMED_DIR))
+        timings = {}
+        ranges = {}
+        # both read the sentences from the page cache
+        for num in range(loader.num_sentences):
+            float(loader.sentence(num).sum())
+        for label, displacement in [("per frame", displacement_per_frame), ("vectorized", frame_displacement)]:
+            start = time.perf_counter()
+            ranges[label] = [active_range(displacement(loader.sentence(num)), relative_threshold=0.05, min_active=3)
+                             for num in range(loader.num_sentences)]
+            timings[label] = time.perf_counter() - start
+        if ranges["per frame"] != ranges["vectorized"]:
+            raise Exception(f"the ranges differ: {ranges}")
+        kept = sum(end - start for start, end in ranges["vectorized"])
+        num_frames = len(loader)
+        del loader
+
+    print(f"sentences: {args.subjects * args.scenarios}, kept {kept} of {num_frames} frames")
+    for label, seconds in timings.items():
+        print(f"{label:12s} {seconds:8.3f} s {num_frames / seconds:10.1f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark the int16 store of vertex_store.py against the float32 packed sentences, on synthetic
+sentences of synthetic_dataset.py: size on disk, encoding time and decoded frames/s against np.load.
+Every decoded sentence has to stay within its recorded error.
+
+  python benchmarks/bench_vertex_store.py --scenarios 4 --frames 200 --components 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from sentence_loader import UNTRIMMED_DIR
+from synthetic_dataset import write_sentences
+from vertex_store import VertexStore, compress_sentences
+
+
+def folder_size(path, extension):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path) if name.endswith(extension))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed vertex store benchmark")
+    parser.add_argument("--subjects", type=int, default=1, help="Subjects")
+    parser.add_argument("--scenarios", type=int, default=4, help="Sentences per subject")
+    parser.add_argument("--frames", type=int, default=200, help="Frames per sentence, give or take half")
+    parser.add_argument("--components", type=int, default=32, help="Components of the PCA basis")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Largest coordinate error")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_sentences(tmp_dir, args.subjects, args.scenarios, args.frames)
+        sentence_dir = os.path.join(tmp_dir, UNTRIMMED_DIR)
+        names = sorted(name for name in os.listdir(sentence_dir) if name.endswith(".npy"))
+        raw_size = folder_size(sentence_dir, ".npy")
+
+        start = time.perf_counter()
+        sentences = [np.load(os.path.join(sentence_dir, name)) for name in names]
+        load_time = time.perf_counter() - start
+        num_frames = sum(len(frames) for frames in sentences)
+
+        rows = []
+        for mode, compress in [("delta", False), ("delta", True), ("pca", False), ("pca", True)]:
+            store_dir = os.path.join(tmp_dir, f"{mode}_{int(compress)}")
+            start = time.perf_counter()
+            headers, failures = compress_sentences(sentence_dir, store_dir, mode=mode, tolerance=args.tolerance,
+                                                   components=args.components, compress=compress)
+            encode_time = time.perf_counter() - start
+            if failures:
+                raise Exception(f"{mode} failed: {failures}")
+            store = VertexStore(store_dir)
+            # the neutral and basis are loaded once per subject, not per sentence
+            for name in names:
+                store.load(name)
+            start = time.perf_counter()
+            decoded = [store.load(name) for name in names]
+            decode_time = time.perf_counter() - start
+            for name, frames, frames_decoded in zip(names, sentences, decoded):
+                if np.abs(frames_decoded - frames).max() > headers[name]["max_error"] * (1 + 1e-6) + 1e-12:
+                    raise Exception(f"{mode}: {name} is off by more than its recorded error")
+            fallbacks = sum(header["mode"] != mode for header in headers.values())
+            worst = max(header["max_error"] for header in headers.values())
+            # the neutral and the basis of the subjects count too
+            rows.append((f"{mode}{' + zlib' if compress else ''}", raw_size / folder_size(store_dir, ""),
+                         encode_time, decode_time, worst, fallbacks))
+            del store, decoded
+
+    print(f"sentences: {len(names)}, frames: {num_frames}, {raw_size / (1 << 20):.1f} MB float32")
+    print(f"{'np.load':14s} {'':>8s} {'':>10s} {num_frames / load_time:12.0f} frames/s")
+    for label, ratio, encode_time, decode_time, worst, fallbacks in rows:
+        print(f"{label:14s} {ratio:7.1f}x {encode_time:8.3f} s {num_frames / decode_time:12.0f} frames/s decoded, "
+              f"max error {worst:.3g}" + (f", {fallbacks} fell back to delta" if fallbacks else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Generate synthetic datasets with the layout of the real ones, for the benchmarks to run without the
+captures on H:\\datasets or /data6.
+
+  <root>/captures/<subject>/<subject>_<take>/take.json              capture folders UE_PerformanceToSequence.py reads
+  <root>/face_anim/LS_Performance_<subject>_<take>_face_anim.json   what mgMetaHuman_face_keys_export writes
+  <root>/raw/<date_subject>/<scenario>/Object_<frame>.obj           what export_obj_sequence writes in Maya
+  <root>/normalized/<date_subject>/<scenario>/Object_<frame>.obj    what normalize-all-in-raw.py writes
+  <root>/vertices_npy_untrimmed/<date_subject>_<scenario>.npy       what sentence-packing.py writes, see write_sentences
+  <root>/dataset.json                                               the parameters of the dataset
+
+The meshes are a neutral head shape with a few smooth expressions blended in over the sentence. The
+first and last frames of every sentence stay at the rest pose like real captures. The same
+parameters always generate the same dataset.
+
+  python benchmarks/synthetic_dataset.py OUTPUT --subjects 2 --scenarios 3 --frames 60
+"""
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from normalization import numpy_normalize, normalize_vertices
+
+NUM_VERTICES = 24049
+DATASET_FILE = "dataset.json"
+
+
+def write_obj(filepath, verts):
+    # same layout as a Maya OBJexport: header, vertices, uvs, normals, faces
+    num_vertices = len(verts)
+    with open(filepath, "w") as file:
+        file.write("# This file uses centimeters as units for non-parametric coordinates.\n\n")
+        file.write("mtllib Object.mtl\ng default\n")
+        file.write(("v %f %f %f\n" * num_vertices) % tuple(np.asarray(verts, dtype=np.float64).ravel()))
+        file.write("vt 0.5 0.5\n" * num_vertices)
+        file.write("vn 0.0 0.0 1.0\n" * num_vertices)
+        file.write("s off\ng head_lod0_mesh\nusemtl initialShadingGroup\n")
+        file.write("f 1/1/1 2/2/2 3/3/3\n" * (2 * num_vertices))
+
+
+def write_synthetic_obj(filepath, seed, num_vertices=NUM_VERTICES):
+    # a frame of random vertices, for the parser benchmarks
+    rng = np.random.default_rng(seed)
+    write_obj(filepath, rng.uniform(-20.0, 20.0, size=(num_vertices, 3)))
+
+
+def synthetic_face_anim(num_frames, num_controls):
+    # the three control name shapes the exporter produces
+    face_anim = {}
+    for num in range(num_controls):
+        if num % 3 == 0:
+            name = f"CTRL_expressions_{num}"
+        elif num % 3 == 1:
+            name = f"CTRL_C_control_{num}.X"
+        else:
+            name = f"CTRL_C_control_{num}.Rotation.Z"
+        face_anim[name] = [[math.sin(0.05 * frame + num), frame] for frame in range(1, num_frames + 1)]
+    return face_anim
+
+
+def write_captures(raw_data_path, num_takes, num_frames, subject="Fretlyn"):
+    # capture folders named like the ingested takes, with the take.json the script reads the frame count from
+    for take in range(1, num_takes + 1):
+        capture_path = os.path.join(raw_data_path, f"{subject}_{take}")
+        os.makedirs(capture_path, exist_ok=True)
+        with open(os.path.join(capture_path, "take.json"), "w") as file:
+            json.dump({"frames": num_frames}, file)
+
+
+def neutral_mesh(num_vertices=NUM_VERTICES, seed=0):
+    """
+    Rest pose of a synthetic head, an ellipsoid of about the size of the MetaHuman head in centimeters
+    (Z up like the Maya export).
+    """
+    rng = np.random.default_rng(seed)
+    # evenly spread points on the sphere
+    index = np.arange(num_vertices) + 0.5
+    polar = np.arccos(1.0 - 2.0 * index / num_vertices)
+    azimuth = math.pi * (1.0 + 5 ** 0.5) * index
+    sphere = np.stack([np.cos(azimuth) * np.sin(polar), np.sin(azimuth) * np.sin(polar), np.cos(polar)], axis=1)
+    verts = sphere * np.array([8.0, 10.0, 12.0]) + np.array([0.0, 2.0, 160.0])
+    return verts + rng.normal(0.0, 0.05, size=verts.shape)
+
+
+def expression_basis(neutral, num_expressions=8, seed=0):
+    """
+    Smooth vertex displacements of (num_expressions, num_vertices, 3), up to about 1 cm.
+    """
+    rng = np.random.default_rng(seed + 1)
+    centered = (neutral - neutral.mean(axis=0)) / np.abs(neutral - neutral.mean(axis=0)).max(axis=0)
+    basis = np.empty((num_expressions,) + neutral.shape)
+    for num in range(num_expressions):
+        frequency = rng.uniform(0.5, 2.0, size=3)
+        phase = rng.uniform(0.0, 2.0 * math.pi, size=3)
+        basis[num] = np.sin(centered * frequency * math.pi + phase) * rng.uniform(0.2, 1.0)
+    return basis
+
+
+def sentence_weights(num_frames, num_expressions=8, rest_frames=0.1, seed=0):
+    """
+    Expression weights of a sentence of (num_frames, num_expressions). The first and last rest_frames
+    of the frames stay at the rest pose and the expressions fade in and out around them.
+    """
+    rng = np.random.default_rng(seed + 2)
+    frames = np.arange(num_frames)
+    weights = np.sin(np.outer(frames, rng.uniform(0.02, 0.2, size=num_expressions)) + rng.uniform(0.0, 6.0, size=num_expressions))
+    rest = int(num_frames * rest_frames)
+    fade = max(1, rest)
+    envelope = np.clip(np.minimum(frames - rest, num_frames - 1 - rest - frames) / fade, 0.0, 1.0)
+    return weights * envelope[:, None]
+
+
+def sentence_frames(num_frames, num_vertices=NUM_VERTICES, num_expressions=8, rest_frames=0.1, seed=0):
+    """
+    Vertex positions of a synthetic sentence, (num_frames, num_vertices, 3) float64 in centimeters.
+    """
+    neutral = neutral_mesh(num_vertices)
+    basis = expression_basis(neutral, num_expressions)
+    weights = sentence_weights(num_frames, num_expressions, rest_frames, seed)
+    return neutral + np.tensordot(weights, basis, axes=1)
+
+
+def make_dataset(root, subjects=1, scenarios=2, frames=20, controls=250, num_vertices=NUM_VERTICES, normalized=True,
+                 captures=True, face_anims=True, meshes=True, rest_frames=0.1):
+    """
+    Write a synthetic dataset under root, see the module docstring for the layout.
+    Returns the parameters, also written to root/dataset.json.
+    """
+    params = {"subjects": [f"20240101_S{num:02d}" for num in range(1, subjects + 1)], "scenarios": scenarios, "frames": frames,
+              "controls": controls, "num_vertices": num_vertices, "rest_frames": rest_frames}
+    os.makedirs(root, exist_ok=True)
+    for subject_num, date_subject in enumerate(params["subjects"]):
+        subject = date_subject.split("_")[-1]
+        if captures:
+            write_captures(os.path.join(root, "captures", subject), scenarios, frames, subject)
+        if face_anims:
+            os.makedirs(os.path.join(root, "face_anim"), exist_ok=True)
+            for take in range(1, scenarios + 1):
+                with open(os.path.join(root, "face_anim", f"LS_Performance_{subject}_{take}_face_anim.json"), "w") as file:
+                    file.write(json.dumps(synthetic_face_anim(frames, controls)))
+        if not meshes:
+            continue
+        for take in range(1, scenarios + 1):
+            scenario_id = f"{take:03d}"
+            raw_dir = os.path.join(root, "raw", date_subject, scenario_id)
+            os.makedirs(raw_dir, exist_ok=True)
+            verts = sentence_frames(frames, num_vertices, rest_frames=rest_frames, seed=subject_num * 1000 + take)
+            for frame, frame_verts in enumerate(verts, 1):
+                write_obj(os.path.join(raw_dir, f"Object_{frame:03d}.obj"), frame_verts)
+            if normalized:
+                normalized_dir = os.path.join(root, "normalized", date_subject, scenario_id)
+                os.makedirs(normalized_dir, exist_ok=True)
+                for obj in sorted(os.listdir(raw_dir)):
+                    numpy_normalize(os.path.join(raw_dir, obj), os.path.join(normalized_dir, obj))
+    with open(os.path.join(root, DATASET_FILE), "w") as file:
+        json.dump(params, file, indent=2)
+    return params
+
+
+def write_sentences(root, subjects=1, scenarios=2, frames=200, num_vertices=NUM_VERTICES, rest_frames=0.1, frame_jitter=0.5):
+    """
+    Write packed sentences straight into root/vertices_npy_untrimmed, without the OBJ trees, for the
+    benchmarks of the stages after the packing. The frame counts vary by up to frame_jitter around frames.
+    Returns the paths of the sentences.
+    """
+    output_dir = os.path.join(root, "vertices_npy_untrimmed")
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(0)
+    paths = []
+    for subject_num in range(subjects):
+        date_subject = f"20240101_S{subject_num + 1:02d}"
+        for take in range(1, scenarios + 1):
+            num_frames = max(1, int(frames * (1.0 + rng.uniform(-frame_jitter, frame_jitter))))
+            verts = sentence_frames(num_frames, num_vertices, rest_frames=rest_frames, seed=subject_num * 1000 + take)
+            path = os.path.join(output_dir, f"{date_subject}_{take:03d}.npy")
+            np.save(path, normalize_vertices(verts).reshape(num_frames, -1))
+            paths.append(path)
+    return paths
+
+
+def load_dataset(root):
+    with open(os.path.join(root, DATASET_FILE), "r") as file:
+        return json.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset")
+    parser.add_argument("root", type=str, help="Dataset folder to write")
+    parser.add_argument("--subjects", type=int, default=1, help="Number of subjects")
+    parser.add_argument("--scenarios", type=int, default=2, help="Scenarios (takes) per subject")
+    parser.add_argument("--frames", type=int, default=20, help="Frames per scenario")
+    parser.add_argument("--controls", type=int, default=250, help="Face controls of the face anim exports")
+    parser.add_argument("--num_vertices", type=int, default=NUM_VERTICES, help="Vertices per mesh")
+    parser.add_argument("--rest_frames", type=float, default=0.1, help="Part of the frames at the rest pose at both ends of a sentence")
+    parser.add_argument("--no_normalized", action="store_true", help="Only write raw/, not normalized/")
+    args = parser.parse_args()
+
+    params = make_dataset(args.root, args.subjects, args.scenarios, args.frames, args.controls, args.num_vertices,
+                          normalized=not args.no_normalized, rest_frames=args.rest_frames)
+    print(f"Wrote {len(params['subjects'])} subjects x {args.scenarios} scenarios x {args.frames} frames to {args.root}")
+
+
+if __name__ == "__main__":
+    main()
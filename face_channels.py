@@ -0,0 +1,85 @@
+"""
+Batched extraction of the face control rig channel keys for mgMetaHuman_face_keys_export.
+
+Reading a channel key by key costs two engine calls per key (get_value and get_time). A channel baked
+with one key per frame is read with a single evaluate_keys call over the extents of its keys instead,
+four engine calls per channel without materialising its keys, only channels with gaps keep the per
+key reads. Keys come back as numpy arrays (lists without numpy) and a
+channel that can't be read is recorded in the failures instead of silently exported without keys.
+"""
+from collections import namedtuple
+
+import unreal
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# frame numbers at display rate and key values of one channel
+ChannelKeys = namedtuple("ChannelKeys", ["times", "values"])
+
+
+def channel_control_name(channel):
+    # channel names are the control name followed by _<suffix>
+    channel_name = str(channel.get_name())
+    channel_string_list = channel_name.split('_')
+    return channel_name.replace('_' + channel_string_list[-1], '')
+
+
+def _channel_keys(times, values):
+    if np is None:
+        return ChannelKeys(list(times), list(values))
+    return ChannelKeys(np.fromiter(times, dtype=np.int64), np.fromiter(values, dtype=np.float64))
+
+
+def _key_time(key):
+    return key.get_time(time_unit=unreal.SequenceTimeUnit.DISPLAY_RATE).frame_number.value
+
+
+def read_channel_keys(channel, display_rate):
+    """
+    Read the keys of one channel as ChannelKeys, frames at display_rate. Evaluating the channel over
+    the extents of its keys gives one value per frame, when that is one value per key the channel is
+    keyed on every frame and the values are its keys. Otherwise the keys are read one by one.
+    """
+    num_keys = channel.get_num_keys()
+    if num_keys == 0:
+        return _channel_keys([], [])
+    key_range = channel.compute_effective_range()
+    values = channel.evaluate_keys(key_range, display_rate)
+    if len(values) == num_keys:
+        first = key_range.get_start_frame()
+        return _channel_keys(range(first, first + num_keys), values)
+    keys = channel.get_keys()
+    return _channel_keys([_key_time(key) for key in keys], [key.get_value() for key in keys])
+
+
+def extract_channels(sequence, channels):
+    """
+    Read every channel of a control rig section, returns ({control_name: ChannelKeys}, {control_name: error}).
+    A control whose channel fails is still exported, without keys.
+    """
+    channel_keys = {}
+    failures = {}
+    display_rate = sequence.get_display_rate()
+    for channel in channels:
+        control_name = channel_control_name(channel)
+        try:
+            channel_keys[control_name] = read_channel_keys(channel, display_rate)
+        except Exception as error:
+            failures[control_name] = f"{type(error).__name__}: {error}"
+            channel_keys[control_name] = _channel_keys([], [])
+    return channel_keys, failures
+
+
+def to_face_anim(channel_keys):
+    """
+    Turn {control_name: ChannelKeys} into the {control_name: [[value, frame], ...]} dict of the JSON export.
+    """
+    face_anim = {}
+    for control_name, (times, values) in channel_keys.items():
+        if np is not None:
+            times, values = times.tolist(), values.tolist()
+        face_anim[control_name] = [[value, time] for value, time in zip(values, times)]
+    return face_anim
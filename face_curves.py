@@ -0,0 +1,430 @@
+"""
+Dense binary format for the face control curves exported by mgMetaHuman_face_keys_export.
+
+A .mhfc file holds a frames x controls float32 matrix (NaN where a control has no key on a frame),
+the control name index and the frame number vector, optionally followed by the reduced keys of every
+control (see reduce_curves):
+
+  b"MHFC" | uint32 version | uint32 header length | JSON header {"controls", "num_frames", "num_controls",
+                                                                 "dense", "reduced"}
+  int32 frames[num_frames]                  (64 byte aligned)
+  float32 values[num_frames][num_controls]  (64 byte aligned, only if dense)
+  int32 key_counts[num_controls]            (64 byte aligned, only if reduced)
+  int32 key_frames[num_keys]                (64 byte aligned, only if reduced)
+  float32 key_values[num_keys]              (64 byte aligned, only if reduced)
+  uint8 key_mask[ceil(num_frames * num_controls / 8)]  (64 byte aligned, only if reduced and masked)
+
+"reduced" is null or {"tolerance", "num_keys", "max_error", "masked"}. A file written with dense=False
+only holds the reduced keys, read_curves rebuilds the matrix from them, within the tolerance of the raw
+keys. The reduced keys interpolate across the frames a control has no key on, so when the matrix has
+NaN gaps they are kept as key_mask, the np.packbits of the row-major frames x controls "has a key" matrix.
+
+Everything is little endian, the value matrix can be memory-mapped as is. Writing only needs the
+standard library so it also runs inside the Unreal editor, reading and key reduction need numpy.
+
+  python face_curves.py convert <face_anim.json or folder> [...] [--output_dir DIR]
+"""
+import os
+import sys
+import json
+import math
+import struct
+import argparse
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"MHFC"
+VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+EXTENSION = ".mhfc"
+_PREAMBLE = struct.Struct("<4sII")
+_ALIGNMENT = 64
+
+FaceCurves = namedtuple("FaceCurves", ["controls", "frames", "values"])
+# keys of every control concatenated in control order, key_counts[c] of them for control c
+ReducedCurves = namedtuple("ReducedCurves", ["key_counts", "key_frames", "key_values"])
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _layout(header):
+    """
+    Offsets of the sections present in a file with this header, {section: offset}.
+    """
+    num_frames, num_controls = header["num_frames"], header["num_controls"]
+    sizes = [("frames", 4 * num_frames)]
+    if header.get("dense", True):
+        sizes.append(("values", 4 * num_frames * num_controls))
+    if header.get("reduced"):
+        num_keys = header["reduced"]["num_keys"]
+        sizes += [("key_counts", 4 * num_controls), ("key_frames", 4 * num_keys), ("key_values", 4 * num_keys)]
+        if header["reduced"].get("masked"):
+            sizes.append(("key_mask", (num_frames * num_controls + 7) // 8))
+    offsets = {}
+    offset = _PREAMBLE.size + header["header_length"]
+    for section, size in sizes:
+        offsets[section] = offset = _align(offset)
+        offset += size
+    return offsets
+
+
+def _little_endian_bytes(typecode, values):
+    if np is not None and isinstance(values, np.ndarray):
+        return np.ascontiguousarray(values, dtype="<i4" if typecode == "i" else "<f4").tobytes()
+    values = array(typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def face_anim_to_columns(face_anim):
+    """
+    Turn a {control_name: [[value, frame], ...]} dict into (control_names, frames, values) with
+    values a flat row-major frames x controls float32 array, NaN where a control has no key.
+    """
+    control_names = list(face_anim)
+    frames = sorted({int(key[1]) for keys in face_anim.values() for key in keys})
+    rows = {frame: row for row, frame in enumerate(frames)}
+    num_controls = len(control_names)
+    values = array("f", [math.nan]) * (len(frames) * num_controls)
+    for column, control_name in enumerate(control_names):
+        for value, frame in face_anim[control_name]:
+            values[rows[int(frame)] * num_controls + column] = value
+    return control_names, frames, values
+
+
+def write_curves(path, control_names, frames, values, reduce_tolerance=None, dense=True):
+    """
+    Write a .mhfc file. values is the row-major frames x controls matrix, either flat or as a 2D numpy array.
+    With reduce_tolerance the reduced keys of every control are stored after the matrix, dense=False
+    leaves the matrix out and only keeps the reduced keys, with the NaN gaps of the matrix as its key mask.
+    """
+    header = {
+        "controls": list(control_names),
+        "num_frames": len(frames),
+        "num_controls": len(control_names),
+        "dense": dense,
+        "reduced": None,
+    }
+    frames = [int(frame) for frame in frames]
+    values_bytes = _little_endian_bytes("f", values)
+    if len(values_bytes) != 4 * len(frames) * len(control_names):
+        raise ValueError(f"Expected {len(frames)} x {len(control_names)} values, got {len(values_bytes) // 4}")
+    sections = {"frames": _little_endian_bytes("i", frames)}
+    if dense:
+        sections["values"] = values_bytes
+    if reduce_tolerance is not None:
+        if np is None:
+            raise ImportError("Reducing face curve keys needs numpy")
+        matrix = np.frombuffer(values_bytes, dtype="<f4").reshape(len(frames), len(control_names))
+        reduced = reduce_curves(frames, matrix, reduce_tolerance)
+        keyed = ~np.isnan(matrix)
+        header["reduced"] = {
+            "tolerance": reduce_tolerance,
+            "num_keys": len(reduced.key_frames),
+            "max_error": reduction_error(frames, matrix, reduced),
+            "masked": not dense and not keyed.all(),
+        }
+        sections["key_counts"] = _little_endian_bytes("i", reduced.key_counts)
+        sections["key_frames"] = _little_endian_bytes("i", reduced.key_frames)
+        sections["key_values"] = _little_endian_bytes("f", reduced.key_values)
+        if header["reduced"]["masked"]:
+            sections["key_mask"] = np.packbits(keyed, axis=None).tobytes()
+    elif not dense:
+        raise ValueError("A file without the dense matrix needs a reduce_tolerance")
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    header["header_length"] = len(header_bytes)
+    offsets = _layout(header)
+    with open(path, "wb") as file:
+        file.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        for section, offset in offsets.items():
+            file.write(b"\0" * (offset - file.tell()))
+            file.write(sections[section])
+
+
+def write_face_anim(path, face_anim, reduce_tolerance=None, dense=True):
+    """
+    Write a {control_name: [[value, frame], ...]} dict as a .mhfc file.
+    """
+    write_curves(path, *face_anim_to_columns(face_anim), reduce_tolerance=reduce_tolerance, dense=dense)
+
+
+def _reduce_keys(frames, values, tolerance):
+    """
+    Indices of the keys to keep so that linear interpolation between them stays within tolerance of
+    every dropped key. Greedy: a segment grows while its end key is inside the cone of slopes that
+    passes within tolerance of every key it skips, so each key is visited once.
+    """
+    num_keys = len(frames)
+    if num_keys <= 2:
+        return list(range(num_keys))
+    if values.max() - values.min() <= tolerance:
+        # flat run, the line between the end keys stays inside [min, max]
+        return [0, num_keys - 1]
+    kept = [0]
+    start = 0
+    while start < num_keys - 1:
+        low, high = -math.inf, math.inf
+        end = start + 1
+        for index in range(start + 1, num_keys):
+            run = frames[index] - frames[start]
+            slope = (values[index] - values[start]) / run
+            if not low <= slope <= high:
+                break
+            end = index
+            low = max(low, (values[index] - tolerance - values[start]) / run)
+            high = min(high, (values[index] + tolerance - values[start]) / run)
+            if low > high:
+                break
+        kept.append(end)
+        start = end
+    return kept
+
+
+def reduce_curves(frames, values, tolerance):
+    """
+    Reduce the keys of every column of a frames x controls matrix (NaN gaps are skipped) to the
+    ones linear interpolation needs to stay within tolerance. Constant runs collapse to their end
+    keys. Returns ReducedCurves.
+    """
+    frames = np.asarray(frames, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    key_counts = np.zeros(values.shape[1], dtype=np.int32)
+    key_frames, key_values = [], []
+    for column in range(values.shape[1]):
+        keyed = ~np.isnan(values[:, column])
+        column_frames, column_values = frames[keyed], values[keyed, column]
+        kept = _reduce_keys(column_frames.tolist(), column_values, tolerance)
+        key_counts[column] = len(kept)
+        key_frames.append(column_frames[kept])
+        key_values.append(column_values[kept])
+    if not key_frames:
+        return ReducedCurves(key_counts, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+    return ReducedCurves(key_counts, np.concatenate(key_frames).astype(np.int32), np.concatenate(key_values).astype(np.float32))
+
+
+def evaluate_curves(reduced, frames):
+    """
+    Rebuild the frames x controls float32 matrix of ReducedCurves at the given frames, all controls
+    at once. Values are linearly interpolated between keys and held before the first and after the
+    last key of a control, controls without keys are NaN.
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    key_counts = np.asarray(reduced.key_counts, dtype=np.int64)
+    key_frames = np.asarray(reduced.key_frames, dtype=np.float64)
+    key_values = np.asarray(reduced.key_values, dtype=np.float64)
+    num_controls = len(key_counts)
+    result = np.full((len(frames), num_controls), np.nan, dtype=np.float32)
+    if len(frames) == 0 or len(key_frames) == 0:
+        return result
+
+    ends = np.cumsum(key_counts)
+    starts = ends - key_counts
+    # one searchsorted over every control: each control's keys are shifted into their own frame range
+    low = min(key_frames.min(), frames.min())
+    span = max(key_frames.max(), frames.max()) - low + 1
+    control_of_key = np.repeat(np.arange(num_controls), key_counts)
+    shifted_keys = control_of_key * span + (key_frames - low)
+    keyed = key_counts > 0
+    controls = np.flatnonzero(keyed)
+    queries = controls[:, None] * span + (frames[None, :] - low)
+    left = np.searchsorted(shifted_keys, queries, side="right") - 1
+    first, last = starts[controls, None], ends[controls, None] - 1
+    left = np.clip(left, first, last)
+    right = np.minimum(left + 1, last)
+    run = key_frames[right] - key_frames[left]
+    weight = np.where(run > 0, (frames[None, :] - key_frames[left]) / np.where(run > 0, run, 1), 0.0)
+    weight = np.clip(weight, 0.0, 1.0)
+    interpolated = key_values[left] + weight * (key_values[right] - key_values[left])
+    result[:, controls] = interpolated.T
+    return result
+
+
+def reduction_error(frames, values, reduced):
+    """
+    Largest absolute difference between the raw keys of a frames x controls matrix and the
+    reduced keys evaluated at the same frames.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    if values.size == 0:
+        return 0.0
+    difference = np.abs(evaluate_curves(reduced, frames) - values)
+    keyed = ~np.isnan(values)
+    return float(difference[keyed].max()) if keyed.any() else 0.0
+
+
+def read_header(path):
+    """
+    Read only the header of a .mhfc file, returns the JSON header dict.
+    """
+    with open(path, "rb") as file:
+        magic, version, header_length = _PREAMBLE.unpack(file.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a face curves file")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"{path} has unsupported face curves version {version}")
+        header = json.loads(file.read(header_length).decode("utf-8"))
+    header["header_length"] = header_length
+    return header
+
+
+def read_reduced(path, header=None):
+    """
+    Read the reduced keys of a .mhfc file as ReducedCurves, None if it was written without them.
+    """
+    header = header or read_header(path)
+    if not header.get("reduced"):
+        return None
+    offsets = _layout(header)
+    num_keys = header["reduced"]["num_keys"]
+    return ReducedCurves(
+        np.fromfile(path, dtype="<i4", count=header["num_controls"], offset=offsets["key_counts"]),
+        np.fromfile(path, dtype="<i4", count=num_keys, offset=offsets["key_frames"]),
+        np.fromfile(path, dtype="<f4", count=num_keys, offset=offsets["key_values"]))
+
+
+def read_curves(path, mmap=True):
+    """
+    Read a .mhfc file as FaceCurves(controls, frames, values) with values a frames x controls
+    float32 matrix, memory-mapped unless mmap is False. Files without the dense matrix have it
+    evaluated from their reduced keys, NaN where their key mask has no key.
+    """
+    header = read_header(path)
+    num_frames, num_controls = header["num_frames"], header["num_controls"]
+    offsets = _layout(header)
+    frames = np.fromfile(path, dtype="<i4", count=num_frames, offset=offsets["frames"])
+    if not header.get("dense", True):
+        values = evaluate_curves(read_reduced(path, header), frames)
+        if header["reduced"].get("masked"):
+            mask = np.fromfile(path, dtype=np.uint8, count=(num_frames * num_controls + 7) // 8, offset=offsets["key_mask"])
+            keyed = np.unpackbits(mask, count=num_frames * num_controls).astype(bool).reshape(num_frames, num_controls)
+            values[~keyed] = np.nan
+    elif num_frames * num_controls == 0:
+        values = np.empty((num_frames, num_controls), dtype="<f4")
+    elif mmap:
+        values = np.memmap(path, dtype="<f4", mode="r", offset=offsets["values"], shape=(num_frames, num_controls))
+    else:
+        values = np.fromfile(path, dtype="<f4", count=num_frames * num_controls, offset=offsets["values"])
+        values = values.reshape(num_frames, num_controls)
+    return FaceCurves(header["controls"], frames, values)
+
+
+def iter_keys(curves):
+    """
+    Yield (control_name, key_frames, key_values) lists for every control of FaceCurves, skipping the NaN gaps.
+    """
+    for column, control_name in enumerate(curves.controls):
+        values = curves.values[:, column]
+        keyed = ~np.isnan(values)
+        yield control_name, curves.frames[keyed].tolist(), values[keyed].tolist()
+
+
+def curves_to_face_anim(curves):
+    """
+    Turn FaceCurves back into the {control_name: [[value, frame], ...]} dict of the JSON export.
+    """
+    face_anim = {}
+    for control_name, frames, values in iter_keys(curves):
+        face_anim[control_name] = [[value, frame] for value, frame in zip(values, frames)]
+    return face_anim
+
+
+def frame_windows(num_frames, chunk_frames, overlap):
+    """
+    [start, end) windows of at most chunk_frames frames covering [0, num_frames), consecutive windows
+    share overlap frames. The overlap has to stay below half the chunk size, stitch_face_anims only
+    crossfades two windows and a longer one would make three windows share frames.
+    """
+    if not 0 <= overlap < chunk_frames // 2:
+        raise ValueError(f"The overlap ({overlap}) has to be at least 0 and smaller than half the chunk size ({chunk_frames} // 2)")
+    windows = []
+    start = 0
+    while True:
+        end = min(start + chunk_frames, num_frames)
+        windows.append((start, end))
+        if end >= num_frames:
+            return windows
+        start = end - overlap
+
+
+def stitch_face_anims(windows):
+    """
+    Stitch the {control_name: [[value, frame], ...]} exports of overlapping frame windows, given as
+    [(first_frame, face_anim)] in window order, into one export on the frames of the whole take.
+    Window frames are shifted by first_frame, where two windows overlap the values crossfade
+    linearly from the earlier window to the later one so the curves stay continuous.
+    """
+    control_names = list(dict.fromkeys(name for _, face_anim in windows for name in face_anim))
+    stitched = {}
+    for control_name in control_names:
+        keys = {}
+        for first_frame, face_anim in windows:
+            window_keys = {first_frame + int(frame): value for value, frame in face_anim.get(control_name, [])}
+            overlap = sorted(frame for frame in window_keys if frame in keys)
+            for frame, value in window_keys.items():
+                if frame not in keys:
+                    keys[frame] = value
+                elif overlap[-1] > overlap[0]:
+                    weight = (frame - overlap[0]) / (overlap[-1] - overlap[0])
+                    keys[frame] = keys[frame] * (1 - weight) + value * weight
+                else:
+                    keys[frame] = (keys[frame] + value) / 2
+        stitched[control_name] = [[keys[frame], frame] for frame in sorted(keys)]
+    return stitched
+
+
+def read_face_anim_json(path):
+    """
+    Read a face anim JSON export, with or without the "anim_keys_dict = " prefix.
+    """
+    with open(path, "r") as file:
+        content = file.read()
+    return json.loads(content.split("=", 1)[-1].strip())
+
+
+def convert_json(json_path, output_dir=None, reduce_tolerance=None, dense=True):
+    """
+    Convert a face anim JSON export into a .mhfc file next to it (or in output_dir), returns its path.
+    """
+    face_anim = read_face_anim_json(json_path)
+    output_path = os.path.splitext(json_path)[0] + EXTENSION
+    if output_dir:
+        output_path = os.path.join(output_dir, os.path.basename(output_path))
+    write_face_anim(output_path, face_anim, reduce_tolerance=reduce_tolerance, dense=dense)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face control curves in the dense binary format")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Convert face anim JSON exports to .mhfc")
+    convert_parser.add_argument("paths", nargs="+", help="JSON files or folders containing them")
+    convert_parser.add_argument("--output_dir", type=str, help="Output folder, next to the JSON files by default", default=None)
+    convert_parser.add_argument("--reduce_tolerance", type=float, help="Also store the keys reduced within this error", default=None)
+    convert_parser.add_argument("--reduced_only", action="store_true", help="Only store the reduced keys, not the dense matrix")
+    args = parser.parse_args()
+    if args.reduced_only and args.reduce_tolerance is None:
+        parser.error("--reduced_only needs --reduce_tolerance")
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for path in args.paths:
+        json_paths = [path]
+        if os.path.isdir(path):
+            json_paths = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".json")]
+        for json_path in json_paths:
+            output_path = convert_json(json_path, args.output_dir, args.reduce_tolerance, not args.reduced_only)
+            print(f"Converted {json_path} ({os.path.getsize(json_path)} bytes) to {output_path} ({os.path.getsize(output_path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Stand-in for the parts of maya.cmds and maya.api used by Maya_Auto_Multiple_Export_Version2.py, so the
+face mocap application can be tested and benchmarked without Maya.
+
+    import fake_maya
+    scene = fake_maya.install()       # registers maya, maya.cmds, maya.api.OpenMaya(Anim) in sys.modules
+    scene.add_nodes(["CTRL_C_jaw", ...])
+    scene.add_mesh("head_lod0_mesh", lambda time: points)  # (num_vertices, 3) positions at a frame
+    ...                                # import / run the Maya script
+    scene.calls["setKeyframe"]         # number of calls per command / API method
+    scene.curves[("CTRL_C_jaw", "translateY")]  # {time: value}, radians and centimeters like in Maya
+    fake_maya.uninstall()
+
+Every cmds call and API call that crosses into the "scene" is counted in scene.calls.
+"""
+import sys
+import math
+import types
+from collections import Counter
+
+MODULE_NAMES = ["maya", "maya.cmds", "maya.api", "maya.api.OpenMaya", "maya.api.OpenMayaAnim"]
+
+
+# centimeters per unit of the MDistance units
+CENTIMETERS = {5: 0.1, 6: 1.0, 8: 100.0}
+
+
+def is_angular(attr):
+    return attr.startswith("rotate")
+
+
+def is_linear(attr):
+    return attr.startswith("translate")
+
+
+class FakeScene:
+    """
+    State shared by the fake modules: nodes, selection, animation curves and call counters.
+    """
+
+    def __init__(self):
+        self.nodes = set()
+        self.selection = []
+        self.curves = {}
+        self.calls = Counter()
+        self.current_time = 0.0
+        self.exported_files = []
+        self.meshes = {}
+        # linear UI unit as an MDistance unit, centimeters like a default scene
+        self.linear_unit = 6
+
+    def add_nodes(self, names):
+        self.nodes.update(names)
+
+    def add_mesh(self, name, points_at):
+        """
+        Add a deforming mesh, points_at(time) returns its world space (num_vertices, 3) positions.
+        """
+        self.nodes.add(name)
+        self.meshes[name] = points_at
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def set_key(self, node, attr, time, value):
+        self.curves.setdefault((node, attr), {})[float(time)] = float(value)
+
+
+def _build_cmds(scene):
+    cmds = types.ModuleType("maya.cmds")
+
+    def ls(*args, **kwargs):
+        scene.calls["ls"] += 1
+        if kwargs.get("sl") or kwargs.get("selection"):
+            return list(scene.selection)
+        return sorted(scene.nodes)
+
+    def objExists(name):
+        scene.calls["objExists"] += 1
+        return name in scene.nodes
+
+    def setKeyframe(node, attribute, v, t):
+        scene.calls["setKeyframe"] += 1
+        # setKeyframe takes UI units, degrees for angles and the linear unit of the scene for distances
+        if is_angular(attribute):
+            v = math.radians(v)
+        elif is_linear(attribute):
+            v *= CENTIMETERS[scene.linear_unit]
+        scene.set_key(node, attribute, t, v)
+        return 1
+
+    def currentTime(time=None, edit=False, query=False):
+        scene.calls["currentTime"] += 1
+        if query or time is None:
+            return scene.current_time
+        scene.current_time = float(time)
+        return scene.current_time
+
+    def file(filename, **kwargs):
+        scene.calls["file"] += 1
+        scene.exported_files.append((filename, scene.current_time, kwargs))
+        with open(filename, "w") as export_file:
+            export_file.write(f"# fake {kwargs.get('type', 'export')} at frame {scene.current_time}\n")
+        return filename
+
+    for function in (ls, objExists, setKeyframe, currentTime, file):
+        setattr(cmds, function.__name__, function)
+    return cmds
+
+
+def _build_open_maya(scene):
+    om = types.ModuleType("maya.api.OpenMaya")
+
+    class MPlug:
+        def __init__(self, node, attr):
+            self.node = node
+            self.attr = attr
+
+        def name(self):
+            return f"{self.node}.{self.attr}"
+
+    class MSelectionList:
+        def __init__(self):
+            self.items = []
+
+        def add(self, name):
+            scene.calls["MSelectionList.add"] += 1
+            node = name.split(".")[0]
+            if node not in scene.nodes:
+                raise RuntimeError(f"({name}) no such object")
+            self.items.append(name)
+            return self
+
+        def getPlug(self, index):
+            scene.calls["MSelectionList.getPlug"] += 1
+            return MPlug(*self.items[index].split(".", 1))
+
+        def getDagPath(self, index):
+            scene.calls["MSelectionList.getDagPath"] += 1
+            return MDagPath(self.items[index])
+
+    class MDagPath:
+        def __init__(self, name):
+            self.name = name
+
+        def partialPathName(self):
+            return self.name
+
+    class MSpace:
+        kObject = 2
+        kWorld = 4
+
+    class MFnMesh:
+        def __init__(self, dag_path):
+            if dag_path.name not in scene.meshes:
+                raise RuntimeError(f"{dag_path.name} is not a mesh")
+            self.name = dag_path.name
+
+        @property
+        def numVertices(self):
+            return len(scene.meshes[self.name](scene.current_time))
+
+        def getPoints(self, space=MSpace.kObject):
+            scene.calls["MFnMesh.getPoints"] += 1
+            return [(x, y, z, 1.0) for x, y, z in scene.meshes[self.name](scene.current_time)]
+
+    class MTime:
+        kFilm = 6
+
+        def __init__(self, value=0.0, unit=kFilm):
+            self.value = float(value)
+            self.unit = unit
+
+        @staticmethod
+        def uiUnit():
+            return MTime.kFilm
+
+    class MAngle:
+        kRadians = 1
+        kDegrees = 2
+
+        def __init__(self, value=0.0, unit=kRadians):
+            self.value = float(value)
+            self.unit = unit
+
+        @staticmethod
+        def uiUnit():
+            return MAngle.kDegrees
+
+        def asRadians(self):
+            return math.radians(self.value) if self.unit == MAngle.kDegrees else self.value
+
+    class MDistance:
+        kMillimeters = 5
+        kCentimeters = 6
+        kMeters = 8
+
+        def __init__(self, value=0.0, unit=kCentimeters):
+            self.value = float(value)
+            self.unit = unit
+
+        @staticmethod
+        def uiUnit():
+            return scene.linear_unit
+
+        def asCentimeters(self):
+            return self.value * CENTIMETERS[self.unit]
+
+    class MTimeArray(list):
+        pass
+
+    class MDoubleArray(list):
+        pass
+
+    for cls in (MPlug, MSelectionList, MDagPath, MSpace, MFnMesh, MTime, MAngle, MDistance, MTimeArray, MDoubleArray):
+        setattr(om, cls.__name__, cls)
+    return om
+
+
+def _build_open_maya_anim(scene):
+    oma = types.ModuleType("maya.api.OpenMayaAnim")
+
+    class MFnAnimCurve:
+        kAnimCurveTA = 0
+        kAnimCurveTL = 1
+        kAnimCurveTT = 2
+        kAnimCurveTU = 3
+        kAnimCurveUA = 4
+        kAnimCurveUL = 5
+        kTangentGlobal = 0
+
+        def __init__(self, curve=None):
+            self.curve = curve
+
+        def create(self, plug):
+            scene.calls["MFnAnimCurve.create"] += 1
+            scene.curves.setdefault((plug.node, plug.attr), {})
+            self.curve = (plug.node, plug.attr)
+            return self.curve
+
+        @property
+        def animCurveType(self):
+            attr = self.curve[1]
+            if is_angular(attr):
+                return MFnAnimCurve.kAnimCurveTA
+            if is_linear(attr):
+                return MFnAnimCurve.kAnimCurveTL
+            return MFnAnimCurve.kAnimCurveTU
+
+        def addKeys(self, times, values, tangentInType=0, tangentOutType=0, keepExistingKeys=False, change=None):
+            scene.calls["MFnAnimCurve.addKeys"] += 1
+            if len(times) != len(values):
+                raise ValueError("times and values must have the same length")
+            keys = scene.curves[self.curve]
+            if not keepExistingKeys and len(times):
+                # existing keys in the range of the new ones are replaced
+                first, last = min(t.value for t in times), max(t.value for t in times)
+                for time in [time for time in keys if first <= time <= last]:
+                    del keys[time]
+            for time, value in zip(times, values):
+                keys[time.value] = float(value)
+
+    class MAnimUtil:
+        @staticmethod
+        def findAnimation(plug):
+            scene.calls["MAnimUtil.findAnimation"] += 1
+            key = (plug.node, plug.attr)
+            return [key] if key in scene.curves else []
+
+    oma.MFnAnimCurve = MFnAnimCurve
+    oma.MAnimUtil = MAnimUtil
+    return oma
+
+
+def install():
+    """
+    Register fresh fake maya modules in sys.modules and return their FakeScene.
+    """
+    scene = FakeScene()
+    maya = types.ModuleType("maya")
+    maya_api = types.ModuleType("maya.api")
+    maya.cmds = _build_cmds(scene)
+    maya.api = maya_api
+    maya_api.OpenMaya = _build_open_maya(scene)
+    maya_api.OpenMayaAnim = _build_open_maya_anim(scene)
+    sys.modules.update({
+        "maya": maya,
+        "maya.cmds": maya.cmds,
+        "maya.api": maya_api,
+        "maya.api.OpenMaya": maya_api.OpenMaya,
+        "maya.api.OpenMayaAnim": maya_api.OpenMayaAnim,
+    })
+    return scene
+
+
+def uninstall():
+    for name in MODULE_NAMES:
+        sys.modules.pop(name, None)
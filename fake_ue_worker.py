@@ -0,0 +1,65 @@
+"""
+Stand-in for an Unreal editor process running UE_PerformanceToSequence.py, for testing UE_BatchLauncher.py
+without the editor. It runs the script on the fake unreal module of fake_unreal.py, with the captures of
+raw_data_path registered as ingested capture data.
+
+  python fake_ue_worker.py [--seconds_per_frame 0.001] [--fail_takes 3,17 --state_dir DIR] -- <UE_PerformanceToSequence.py args>
+
+The bake of every take in --fail_takes fails once, --state_dir remembers across processes which ones did.
+"""
+import os
+import sys
+import argparse
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_unreal
+
+
+def load_ue_script():
+    spec = importlib.util.spec_from_file_location(
+        "ue_performance", os.path.join(os.path.dirname(os.path.abspath(__file__)), "UE_PerformanceToSequence.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fail_bakes_once(editor, takes, state_dir):
+    bake = editor.unreal.ControlRigSequencerLibrary.bake_to_control_rig
+
+    def failing_bake(world, level_sequence, **kwargs):
+        take = level_sequence.get_name().split("_")[-1]
+        marker = os.path.join(state_dir, f"failed_bake_{take}")
+        if take in takes and not os.path.exists(marker):
+            open(marker, "w").close()
+            raise RuntimeError(f"simulated bake failure of take {take}")
+        return bake(world, level_sequence, **kwargs)
+
+    editor.unreal.ControlRigSequencerLibrary.bake_to_control_rig = staticmethod(failing_bake)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Unreal editor worker")
+    parser.add_argument("--seconds_per_frame", type=float, help="Processing time of start_pipeline per frame", default=0.0)
+    parser.add_argument("--fail_takes", type=str, help="Comma separated takes whose bake fails once", default="")
+    parser.add_argument("--state_dir", type=str, help="Folder remembering the failures across processes", default=".")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER, help="Arguments of UE_PerformanceToSequence.py after --")
+    args = parser.parse_args()
+    script_args = args.script_args[1:] if args.script_args[:1] == ["--"] else args.script_args
+
+    editor = fake_unreal.install()
+    editor.seconds_per_frame = args.seconds_per_frame
+    ue_script = load_ue_script()
+    # the capture data assets the script derives from the capture folder names
+    script = ue_script.parser.parse_args(script_args)
+    for capture in os.listdir(script.raw_data_path):
+        editor.add_capture(os.path.join(script.base_path, script.capture_data_path, 'Fretlyn_' + capture.split("_")[-1]))
+    if args.fail_takes:
+        fail_bakes_once(editor, set(args.fail_takes.split(",")), args.state_dir)
+
+    sys.argv = ["UE_PerformanceToSequence.py"] + script_args
+    ue_script.main()
+
+
+if __name__ == "__main__":
+    main()
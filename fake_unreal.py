@@ -0,0 +1,655 @@
+"""
+Stand-in for the parts of the unreal module used by UE_PerformanceToSequence.py and face_channels.py,
+so the pipeline and the face keys export can be tested and benchmarked without the Unreal editor.
+
+    import fake_unreal
+    editor = fake_unreal.install()     # registers unreal in sys.modules
+    channels = fake_unreal.synthetic_channels(num_controls=250, num_frames=600)
+    sequence = editor.add_face_sequence("LS_Performance_1", channels)
+    editor.add_capture("/Game/FacialCapture/Fretlyn_CaptureSource_Ingested/Fretlyn_1")
+    editor.fail_calls["ControlRigSequencerLibrary.bake_to_control_rig"] = 1  # the next call raises
+    ...                                # import / run the UE script
+    editor.calls["FloatChannel.get_value"]  # number of calls per engine method
+    editor.restart()                   # only the saved assets survive, like an editor crash
+    fake_unreal.uninstall()
+
+Every method call that would cross the Python/engine bridge is counted in editor.calls and takes
+editor.seconds_per_call of wall time, 0 by default. Assets live in editor.assets by package path,
+the MetaHuman content the script loads is there from the start.
+"""
+import sys
+import math
+import bisect
+import time
+import types
+from collections import Counter
+
+
+class FakeEditor:
+    """
+    State shared by the fake module: level sequences, bound actors and call counters.
+    """
+
+    def __init__(self, module, num_controls=20):
+        self.unreal = module
+        self.calls = Counter()
+        self.fail_calls = {}
+        self.sequences = []
+        self.logs = []
+        self.assets = {}
+        self.saved = set()
+        self.actors = []
+        # number of channels bake_to_control_rig gives the face control rig track
+        self.num_controls = num_controls
+        # wall time start_pipeline takes per processed frame
+        self.seconds_per_frame = 0.0
+        # longest processing range of start_pipeline, longer ones return TOO_MANY_FRAMES
+        self.max_pipeline_frames = 1 << 30
+        # wall time of every asset, object and blueprint class load
+        self.seconds_per_load = 0.0
+        # wall time of every call across the Python/engine bridge
+        self.seconds_per_call = 0.0
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def add_asset(self, asset, saved=True):
+        self.assets[asset_key(asset.get_path_name())] = asset
+        if saved:
+            self.saved.add(asset_key(asset.get_path_name()))
+        return asset
+
+    def add_capture(self, path):
+        """
+        Add an ingested capture data asset at its package path.
+        """
+        package_path, name = path.replace("\\", "/").rsplit("/", 1)
+        return self.add_asset(self.unreal.FootageCaptureData(name, package_path))
+
+    def restart(self):
+        """
+        Drop what a crash of the editor loses: unsaved assets, spawned actors and the call counters.
+        """
+        self.assets = {key: asset for key, asset in self.assets.items() if key in self.saved}
+        self.actors = []
+        self.calls.clear()
+
+    def add_face_sequence(self, name, channels, character="BP_Bernice"):
+        """
+        Add a level sequence with a MetaHuman actor whose Face binding has a control rig track
+        holding channels, like a sequence after bake_to_control_rig.
+        """
+        unreal = self.unreal
+        sequence = unreal.LevelSequence(name)
+        actor = unreal.Actor(character)
+        binding = sequence.add_possessable(actor)
+        binding.display_name = character
+        face_binding = binding.add_child("Face")
+        face_binding.add_track(unreal.MovieSceneControlRigParameterTrack).add_section().channels = list(channels)
+        self.sequences.append(sequence)
+        return sequence
+
+
+def asset_key(path):
+    # "/Game/A//B.B" and "/Game/A/B" name the same asset
+    path = path.replace("\\", "/").split(".")[0]
+    while "//" in path:
+        path = path.replace("//", "/")
+    return path.rstrip("/")
+
+
+def synthetic_channels(num_controls, num_frames, first_frame=0, sparse_every=0, failing=(), take_offset=0):
+    """
+    Face control rig channels keyed on every frame like a baked control rig. Every sparse_every-th
+    channel only has a key every 4 frames, the channels at the indices in failing raise when read.
+    Names have the _<index> suffix the control rig section gives them. Values are a function of the
+    frame of the take, take_offset is the take frame of the first sequence frame.
+    """
+    module = sys.modules["unreal"]
+    channels = []
+    for num in range(num_controls):
+        # the three control name shapes of the face board, distinct once the suffix is stripped
+        if num % 3 == 0:
+            name = f"CTRL_expressions_c{num}"
+        elif num % 3 == 1:
+            name = f"CTRL_C_control_c{num}.X"
+        else:
+            name = f"CTRL_C_control_c{num}.Rotation.Z"
+        step = 4 if sparse_every and num % sparse_every == sparse_every - 1 else 1
+        frames = range(first_frame, first_frame + num_frames, step)
+        keys = [(frame, math.sin(0.05 * (frame + take_offset) + num)) for frame in frames]
+        channels.append(module.MovieSceneScriptingFloatChannel(f"{name}_{num}", keys, failing=num in failing))
+    return channels
+
+
+def _build_unreal(editor_holder):
+    unreal = types.ModuleType("unreal")
+
+    def count(name):
+        editor = editor_holder[0]
+        editor.calls[name] += 1
+        if editor.seconds_per_call:
+            time.sleep(editor.seconds_per_call)
+        if editor.fail_calls.get(name):
+            editor.fail_calls[name] -= 1
+            raise RuntimeError(f"{name} failed")
+
+    def log(message):
+        editor_holder[0].logs.append(("log", str(message)))
+
+    def log_warning(message):
+        editor_holder[0].logs.append(("warning", str(message)))
+
+    def log_error(message):
+        editor_holder[0].logs.append(("error", str(message)))
+
+    class Object:
+        def __init__(self, name, package_path="/Game/"):
+            self.name = name
+            self.package_path = package_path
+            self.properties = {}
+
+        def get_name(self):
+            return self.name
+
+        def get_path_name(self):
+            return f"{asset_key(self.package_path)}/{self.name}.{self.name}"
+
+        def set_editor_property(self, name, value):
+            count(f"{type(self).__name__}.set_editor_property")
+            self.properties[name] = value
+
+        def get_editor_property(self, name):
+            count(f"{type(self).__name__}.get_editor_property")
+            return self.properties.get(name)
+
+    class Vector:
+        def __init__(self, x=0.0, y=0.0, z=0.0):
+            self.x, self.y, self.z = x, y, z
+
+    class SequenceTimeUnit:
+        DISPLAY_RATE = 0
+        TICK_RESOLUTION = 1
+
+    class FrameNumber:
+        def __init__(self, value):
+            self.value = value
+
+    class FrameTime:
+        def __init__(self, frame_number):
+            self.frame_number = FrameNumber(frame_number)
+
+    class FrameRate:
+        def __init__(self, numerator=30, denominator=1):
+            self.numerator = numerator
+            self.denominator = denominator
+
+    class SequencerScriptingRange:
+        def __init__(self, inclusive_start, exclusive_end):
+            self.inclusive_start = inclusive_start
+            self.exclusive_end = exclusive_end
+
+        def get_start_frame(self):
+            count("SequencerScriptingRange.get_start_frame")
+            return self.inclusive_start
+
+    class MovieSceneScriptingFloatKey:
+        def __init__(self, frame, value):
+            self.frame = frame
+            self.value = value
+
+        def get_value(self):
+            count("FloatKey.get_value")
+            return self.value
+
+        def get_time(self, time_unit=SequenceTimeUnit.DISPLAY_RATE):
+            count("FloatKey.get_time")
+            return FrameTime(self.frame)
+
+    class MovieSceneScriptingFloatChannel:
+        def __init__(self, name, keys, failing=False):
+            self.name = name
+            self.keys = sorted(keys)
+            self.frames = [key[0] for key in self.keys]
+            self.failing = failing
+
+        def get_name(self):
+            count("FloatChannel.get_name")
+            return self.name
+
+        def get_num_keys(self):
+            count("FloatChannel.get_num_keys")
+            return len(self.keys)
+
+        def get_keys(self):
+            count("FloatChannel.get_keys")
+            if self.failing:
+                raise RuntimeError(f"channel {self.name} can't be read")
+            return [MovieSceneScriptingFloatKey(frame, value) for frame, value in self.keys]
+
+        def compute_effective_range(self):
+            # the extents of the key times
+            count("FloatChannel.compute_effective_range")
+            return SequencerScriptingRange(self.keys[0][0], self.keys[-1][0] + 1)
+
+        def evaluate(self, frame):
+            # linear between keys, held before the first and after the last key
+            if frame <= self.frames[0]:
+                return self.keys[0][1]
+            if frame >= self.frames[-1]:
+                return self.keys[-1][1]
+            right_index = bisect.bisect_left(self.frames, frame)
+            (left_frame, left), (right_frame, right) = self.keys[right_index - 1], self.keys[right_index]
+            return left + (right - left) * (frame - left_frame) / (right_frame - left_frame)
+
+        def evaluate_keys(self, scripting_range, frame_rate):
+            count("FloatChannel.evaluate_keys")
+            if self.failing:
+                raise RuntimeError(f"channel {self.name} can't be read")
+            keyed = dict(self.keys)
+            return [keyed[frame] if frame in keyed else self.evaluate(frame)
+                    for frame in range(scripting_range.inclusive_start, scripting_range.exclusive_end)]
+
+    class MovieSceneSection:
+        def __init__(self):
+            self.channels = []
+            self.properties = {}
+            self.range = None
+            self.active = True
+
+        def set_range(self, start, end):
+            count("MovieSceneSection.set_range")
+            self.range = (start, end)
+
+        def set_is_active(self, active):
+            count("MovieSceneSection.set_is_active")
+            self.active = active
+
+        def set_editor_property(self, name, value):
+            count("MovieSceneSection.set_editor_property")
+            self.properties[name] = value
+
+    class MovieSceneTrack:
+        def __init__(self):
+            self.sections = []
+
+        def add_section(self):
+            count("MovieSceneTrack.add_section")
+            self.sections.append(MovieSceneSection())
+            return self.sections[-1]
+
+        def get_sections(self):
+            count("MovieSceneTrack.get_sections")
+            return list(self.sections)
+
+    class MovieScene3DTransformTrack(MovieSceneTrack):
+        pass
+
+    class MovieSceneSkeletalAnimationTrack(MovieSceneTrack):
+        pass
+
+    class MovieSceneControlRigParameterTrack(MovieSceneTrack):
+        pass
+
+    class MovieSceneSectionExtensions:
+        @staticmethod
+        def get_all_channels(section):
+            count("MovieSceneSectionExtensions.get_all_channels")
+            return list(section.channels)
+
+    class MovieSceneBindingProxy:
+        def __init__(self, name, bound_object=None, parent=None):
+            self.name = name
+            self.display_name = name
+            self.bound_object = bound_object
+            self.parent = parent
+            self.children = []
+            self.tracks = []
+
+        def get_name(self):
+            count("MovieSceneBindingProxy.get_name")
+            return self.name
+
+        def get_display_name(self):
+            count("MovieSceneBindingProxy.get_display_name")
+            return self.display_name
+
+        def get_parent(self):
+            count("MovieSceneBindingProxy.get_parent")
+            return self.parent
+
+        def get_child_possessables(self):
+            count("MovieSceneBindingProxy.get_child_possessables")
+            return list(self.children)
+
+        def get_tracks(self):
+            count("MovieSceneBindingProxy.get_tracks")
+            return list(self.tracks)
+
+        def add_track(self, track_class):
+            count("MovieSceneBindingProxy.add_track")
+            self.tracks.append(track_class())
+            return self.tracks[-1]
+
+        def find_tracks_by_exact_type(self, track_class):
+            count("MovieSceneBindingProxy.find_tracks_by_exact_type")
+            return [track for track in self.tracks if type(track) is track_class]
+
+        def remove_track(self, track):
+            count("MovieSceneBindingProxy.remove_track")
+            self.tracks.remove(track)
+
+        def add_child(self, name, bound_object=None):
+            self.children.append(MovieSceneBindingProxy(name, bound_object, parent=self))
+            return self.children[-1]
+
+    class Actor:
+        def __init__(self, label):
+            self.label = label
+            self.components = [SkeletalMeshComponent("Body", self), SkeletalMeshComponent("Face", self)]
+
+        def get_actor_label(self):
+            count("Actor.get_actor_label")
+            return self.label
+
+        def get_components_by_class(self, component_class):
+            count("Actor.get_components_by_class")
+            return [component for component in self.components if isinstance(component, component_class)]
+
+    class SkeletalMeshComponent:
+        def __init__(self, name, owner):
+            self.name = name
+            self.owner = owner
+
+        def get_name(self):
+            count("SkeletalMeshComponent.get_name")
+            return self.name
+
+    class BoundObjects:
+        def __init__(self, binding, bound_objects):
+            self.binding_proxy = binding
+            self.bound_objects = bound_objects
+
+    class LevelSequence(Object):
+        def __init__(self, name, package_path="/Game/"):
+            super().__init__(name, package_path)
+            self.bindings = []
+            self.playback = [0, 0]
+            self.display_rate = FrameRate(30)
+
+        def get_bindings(self):
+            # the component bindings are children of their actor binding
+            count("LevelSequence.get_bindings")
+            bindings = []
+            for binding in self.bindings:
+                bindings += [binding] + binding.children
+            return bindings
+
+        def add_possessable(self, bound_object):
+            count("LevelSequence.add_possessable")
+            if isinstance(bound_object, SkeletalMeshComponent):
+                parent = self.add_possessable(bound_object.owner)
+                for child in parent.children:
+                    if child.bound_object is bound_object:
+                        return child
+                return parent.add_child(bound_object.name, bound_object)
+            for binding in self.bindings:
+                if binding.bound_object is bound_object:
+                    return binding
+            name = bound_object.get_actor_label() if isinstance(bound_object, Actor) else str(bound_object)
+            self.bindings.append(MovieSceneBindingProxy(name, bound_object))
+            return self.bindings[-1]
+
+        def set_playback_start(self, frame):
+            count("LevelSequence.set_playback_start")
+            self.playback[0] = frame
+
+        def set_playback_end(self, frame):
+            count("LevelSequence.set_playback_end")
+            self.playback[1] = frame
+
+        def get_playback_start(self):
+            count("LevelSequence.get_playback_start")
+            return self.playback[0]
+
+        def get_playback_end(self):
+            count("LevelSequence.get_playback_end")
+            return self.playback[1]
+
+        def get_playback_range(self):
+            count("LevelSequence.get_playback_range")
+            return SequencerScriptingRange(*self.playback)
+
+        def get_display_rate(self):
+            count("LevelSequence.get_display_rate")
+            return self.display_rate
+
+        def make_range(self, start_frame, duration):
+            count("LevelSequence.make_range")
+            return SequencerScriptingRange(start_frame, start_frame + duration)
+
+    class SequencerTools:
+        @staticmethod
+        def get_bound_objects(world, sequence, bindings, range):
+            count("SequencerTools.get_bound_objects")
+            return [BoundObjects(binding, [binding.bound_object] if binding.bound_object else []) for binding in bindings]
+
+    class UnrealEditorSubsystem:
+        def get_editor_world(self):
+            count("UnrealEditorSubsystem.get_editor_world")
+            return "EditorWorld"
+
+    def get_editor_subsystem(subsystem_class):
+        count("get_editor_subsystem")
+        return subsystem_class()
+
+    class SystemLibrary:
+        pass
+
+    def load(name, path):
+        count(name)
+        time.sleep(editor_holder[0].seconds_per_load)
+        return editor_holder[0].assets.get(asset_key(path))
+
+    def load_asset(path):
+        return load("load_asset", path)
+
+    def load_object(name, outer=None):
+        return load("load_object", name)
+
+    class EditorAssetLibrary:
+        @staticmethod
+        def get_path_name_for_loaded_asset(asset):
+            count("EditorAssetLibrary.get_path_name_for_loaded_asset")
+            return asset.get_path_name()
+
+        @staticmethod
+        def does_asset_exist(path):
+            count("EditorAssetLibrary.does_asset_exist")
+            return asset_key(path) in editor_holder[0].assets
+
+        @staticmethod
+        def load_asset(path):
+            return load("EditorAssetLibrary.load_asset", path)
+
+        @staticmethod
+        def load_blueprint_class(path):
+            count("EditorAssetLibrary.load_blueprint_class")
+            time.sleep(editor_holder[0].seconds_per_load)
+            return editor_holder[0].assets[asset_key(path)]
+
+        @staticmethod
+        def delete_asset(path):
+            count("EditorAssetLibrary.delete_asset")
+            editor_holder[0].saved.discard(asset_key(path))
+            return editor_holder[0].assets.pop(asset_key(path), None) is not None
+
+        @staticmethod
+        def save_asset(path, only_if_is_dirty=True):
+            count("EditorAssetLibrary.save_asset")
+            if asset_key(path) not in editor_holder[0].assets:
+                return False
+            editor_holder[0].saved.add(asset_key(path))
+            return True
+
+        @staticmethod
+        def save_loaded_asset(asset, only_if_is_dirty=True):
+            count("EditorAssetLibrary.save_loaded_asset")
+            editor_holder[0].saved.add(asset_key(asset.get_path_name()))
+            return True
+
+    class AssetTools:
+        def create_asset(self, asset_name, package_path, asset_class, factory):
+            count("AssetTools.create_asset")
+            return editor_holder[0].add_asset(asset_class(asset_name, package_path), saved=False)
+
+    class AssetToolsHelpers:
+        @staticmethod
+        def get_asset_tools():
+            return AssetTools()
+
+    class MetaHumanPerformanceFactoryNew:
+        pass
+
+    class LevelSequenceFactoryNew:
+        pass
+
+    class FootageCaptureData(Object):
+        pass
+
+    class MetaHumanIdentity(Object):
+        pass
+
+    class Skeleton(Object):
+        pass
+
+    class AnimSequence(Object):
+        pass
+
+    class Blueprint(Object):
+        pass
+
+    class ControlRigBlueprint(Object):
+        def get_control_rig_class(self):
+            count("ControlRigBlueprint.get_control_rig_class")
+            return "Face_ControlBoard_CtrlRig_C"
+
+    class StartPipelineErrorType:
+        NONE = "NONE"
+        TOO_MANY_FRAMES = "TOO_MANY_FRAMES"
+        NO_FRAMES = "NO_FRAMES"
+
+    class MetaHumanPerformance(Object):
+        def __init__(self, name, package_path="/Game/"):
+            super().__init__(name, package_path)
+            self.blocking = False
+            self.processed = None
+
+        def set_blocking_processing(self, blocking):
+            count("MetaHumanPerformance.set_blocking_processing")
+            self.blocking = blocking
+
+        def start_pipeline(self):
+            count("MetaHumanPerformance.start_pipeline")
+            start = self.properties.get("start_frame_to_process", 0)
+            end = self.properties.get("end_frame_to_process", start)
+            if end - start > editor_holder[0].max_pipeline_frames:
+                return StartPipelineErrorType.TOO_MANY_FRAMES
+            time.sleep((end - start) * editor_holder[0].seconds_per_frame)
+            self.processed = (start, end)
+            return StartPipelineErrorType.NONE
+
+    class PerformanceExportRange:
+        WHOLE_SEQUENCE = "WHOLE_SEQUENCE"
+        PROCESSING_RANGE = "PROCESSING_RANGE"
+
+    class MetaHumanPerformanceExportAnimationSettings:
+        def __init__(self):
+            self.enable_head_movement = True
+            self.target_skeleton_or_skeletal_mesh = None
+            self.show_export_dialog = True
+            self.export_range = PerformanceExportRange.WHOLE_SEQUENCE
+
+    class MetaHumanPerformanceExportUtils:
+        @staticmethod
+        def export_animation_sequence(performance, export_settings):
+            count("MetaHumanPerformanceExportUtils.export_animation_sequence")
+            animation = AnimSequence(f"AS_{performance.get_name()}", performance.package_path)
+            animation.properties["processed"] = performance.processed
+            return editor_holder[0].add_asset(animation, saved=False)
+
+    class EditorActorSubsystem:
+        def spawn_actor_from_class(self, actor_class, location):
+            count("EditorActorSubsystem.spawn_actor_from_class")
+            actor = Actor(actor_class.get_name())
+            editor_holder[0].actors.append(actor)
+            return actor
+
+    class MovieSceneSkeletalAnimationParams(Object):
+        def __init__(self):
+            super().__init__("MovieSceneSkeletalAnimationParams")
+
+    class AnimSeqExportOption:
+        pass
+
+    class ControlRigSequencerLibrary:
+        @staticmethod
+        def bake_to_control_rig(world, level_sequence, control_rig_class, export_options, tolerance, reduce_keys, binding):
+            count("ControlRigSequencerLibrary.bake_to_control_rig")
+            start, end = level_sequence.playback
+            # the curves follow the frames of the take the animation sequence was processed from
+            take_offset = 0
+            for track in binding.tracks:
+                for section in track.sections:
+                    params = section.properties.get("Params")
+                    animation = params.properties.get("Animation") if params else None
+                    if animation and animation.properties.get("processed"):
+                        take_offset = animation.properties["processed"][0]
+            channels = synthetic_channels(editor_holder[0].num_controls, end - start, first_frame=start, take_offset=take_offset)
+            binding.add_track(MovieSceneControlRigParameterTrack).add_section().channels = channels
+            return True
+
+    class LevelSequenceEditorBlueprintLibrary:
+        @staticmethod
+        def refresh_current_level_sequence():
+            count("LevelSequenceEditorBlueprintLibrary.refresh_current_level_sequence")
+
+    for value in (log, log_warning, log_error, load_asset, load_object, get_editor_subsystem, Object, Vector,
+                  SequenceTimeUnit, FrameNumber, FrameTime, FrameRate, SequencerScriptingRange,
+                  MovieSceneScriptingFloatKey, MovieSceneScriptingFloatChannel, MovieSceneSection, MovieSceneTrack,
+                  MovieScene3DTransformTrack, MovieSceneSkeletalAnimationTrack, MovieSceneControlRigParameterTrack,
+                  MovieSceneSectionExtensions, MovieSceneBindingProxy, Actor, SkeletalMeshComponent, BoundObjects,
+                  LevelSequence, SequencerTools, UnrealEditorSubsystem, SystemLibrary, EditorAssetLibrary, AssetTools,
+                  AssetToolsHelpers, MetaHumanPerformanceFactoryNew, LevelSequenceFactoryNew, FootageCaptureData,
+                  MetaHumanIdentity, Skeleton, AnimSequence, Blueprint, ControlRigBlueprint, StartPipelineErrorType,
+                  MetaHumanPerformance, PerformanceExportRange, MetaHumanPerformanceExportAnimationSettings,
+                  MetaHumanPerformanceExportUtils, EditorActorSubsystem, MovieSceneSkeletalAnimationParams,
+                  AnimSeqExportOption, ControlRigSequencerLibrary, LevelSequenceEditorBlueprintLibrary):
+        setattr(unreal, value.__name__, value)
+    return unreal
+
+
+# the MetaHuman content UE_PerformanceToSequence.py loads by fixed path
+DEFAULT_ASSETS = [
+    ("MetaHumanIdentity", "/Game/FacialCapture/", "Fretlyn"),
+    ("Skeleton", "/Game/MetaHumans/Common/Face/", "Face_Archetype_Skeleton"),
+    ("ControlRigBlueprint", "/Game/MetaHumans/Common/Face/", "Face_ControlBoard_CtrlRig"),
+    ("Blueprint", "/Game/MetaHumans/Bernice/", "BP_Bernice"),
+]
+
+
+def install():
+    """
+    Register a fresh fake unreal module in sys.modules and return its FakeEditor.
+    """
+    editor_holder = [None]
+    unreal = _build_unreal(editor_holder)
+    editor_holder[0] = editor = FakeEditor(unreal)
+    for class_name, package_path, name in DEFAULT_ASSETS:
+        editor.add_asset(getattr(unreal, class_name)(name, package_path))
+    sys.modules["unreal"] = unreal
+    return editor
+
+
+def uninstall():
+    sys.modules.pop("unreal", None)
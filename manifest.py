@@ -0,0 +1,79 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+
+def file_fingerprint(path, content_hash=False):
+    """
+    Fingerprint of an input file, its size and mtime or the sha1 of its content.
+    """
+    if content_hash:
+        digest = hashlib.sha1()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return "sha1:" + digest.hexdigest()
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def files_fingerprint(paths, content_hash=False):
+    """
+    Fingerprint of an ordered list of input files, changes when a file is added, removed or modified.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(f"{os.path.basename(path)}={file_fingerprint(path, content_hash)};".encode("utf-8"))
+    return f"{len(paths)}:{digest.hexdigest()}"
+
+
+class Manifest:
+    """
+    Persistent record of the work done by a pipeline stage, one row per (stage, key) with the
+    fingerprint of the inputs, the parameters and the output that was produced.
+    Work is up to date when all three still match, anything else has to be redone.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "stage TEXT NOT NULL, key TEXT NOT NULL, fingerprint TEXT NOT NULL, params TEXT NOT NULL, "
+            "output TEXT NOT NULL, output_size INTEGER NOT NULL, updated REAL NOT NULL, "
+            "PRIMARY KEY (stage, key))")
+        self.connection.commit()
+
+    def is_current(self, stage, key, fingerprint, params, output):
+        row = self.connection.execute(
+            "SELECT fingerprint, params, output, output_size FROM entries WHERE stage = ? AND key = ?",
+            (stage, key)).fetchone()
+        if row is None:
+            return False
+        if row[0] != fingerprint or row[1] != json.dumps(params, sort_keys=True) or row[2] != output:
+            return False
+        # the output has to be there and untouched as well
+        return os.path.exists(output) and os.path.getsize(output) == row[3]
+
+    def record(self, stage, key, fingerprint, params, output):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (stage, key, fingerprint, json.dumps(params, sort_keys=True), output, os.path.getsize(output), time.time()))
+
+    def forget(self, stage, key):
+        self.connection.execute("DELETE FROM entries WHERE stage = ? AND key = ?", (stage, key))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,222 @@
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# files read ahead by prefetch_files and the bytes they may hold before the reads pause
+READ_AHEAD = 8
+READ_AHEAD_BYTES = 256 << 20
+
+# export_vertex_sequence writes one packed (frames, num_vertices * 3) float32 file per sequence
+# and the faces / UVs once in an OBJ next to it
+VERTEX_SEQUENCE_FILE = "vertices.npy"
+TOPOLOGY_FILE = "topology.obj"
+
+_BLOCK_END_PATTERNS = {}
+
+
+def _block_end_pattern(tag):
+    # a block ends at the first line that doesn't start with the tag
+    if tag not in _BLOCK_END_PATTERNS:
+        _BLOCK_END_PATTERNS[tag] = re.compile(b"\n(?!" + re.escape(tag) + b")")
+    return _BLOCK_END_PATTERNS[tag]
+
+
+def find_obj_blocks(data, tag=b"v "):
+    """
+    Find the runs of consecutive lines starting with tag (b"v ", b"vn ", ...) in an OBJ held in memory.
+    Returns a list of (start, end) byte offsets, end includes the trailing newline.
+    """
+    if data.startswith(tag):
+        start = 0
+    else:
+        start = data.find(b"\n" + tag) + 1
+        if start == 0:
+            return []
+
+    spans = []
+    block_end = _block_end_pattern(tag)
+    while True:
+        match = block_end.search(data, start)
+        end = match.end() if match else len(data)
+        spans.append((start, end))
+        # exporters write one block per object, look for the next one
+        start = data.find(b"\n" + tag, end - 1) + 1
+        if start == 0:
+            return spans
+
+
+def _count_lines(block):
+    return block.count(b"\n") + (0 if block.endswith(b"\n") else 1)
+
+
+def parse_obj_block(block, tag=b"v ", columns=3):
+    """
+    Parse a block of tag lines into a float32 array of shape (num_lines, columns).
+    """
+    num_lines = _count_lines(block)
+    # strip the tags and let numpy convert the whole block in one go
+    values = np.fromstring(block.replace(tag, b" "), dtype=np.float32, sep=" ")
+    if values.size % num_lines != 0 or values.size // num_lines < columns:
+        # mixed "v x y z" / "v x y z w" lines, fall back to a per-line parse
+        line_data = [line.split()[1:columns + 1] for line in block.splitlines() if line.startswith(tag)]
+        return np.array(line_data).astype(dtype="float32")
+    return values.reshape(num_lines, -1)[:, :columns]
+
+
+def parse_obj_vertices(data):
+    """
+    Parse the vertex positions ("v x y z" lines) of an OBJ file held in memory as bytes.
+    Only the vertex blocks are touched, faces, normals and UVs are skipped without being split.
+    Returns a float32 array of shape (num_vertices, 3).
+    """
+    blocks = [parse_obj_block(data[start:end]) for start, end in find_obj_blocks(data)]
+    if not blocks:
+        return np.empty((0, 3), dtype=np.float32)
+    if len(blocks) == 1:
+        return blocks[0]
+    return np.concatenate(blocks)
+
+
+def read_file(filepath):
+    with open(filepath, "rb") as file:
+        return file.read()
+
+
+def read_obj_vertices(filepath):
+    """
+    Read the vertex positions of an OBJ file as a float32 array of shape (num_vertices, 3).
+    """
+    return parse_obj_vertices(read_file(filepath))
+
+
+def prefetch_files(paths, depth=READ_AHEAD, max_bytes=READ_AHEAD_BYTES):
+    """
+    Yield (path, bytes) for every file of paths, in the order of paths, while the next files are read
+    on a thread pool. The caller parses one file while up to depth others are opened and read, which
+    hides the latency of the network storage even in a single process.
+    Reading ahead pauses while the files read but not yet yielded hold max_bytes or more, the file the
+    caller waits for is always read. depth 0 reads every file when it is its turn.
+    """
+    paths = list(paths)
+    if depth <= 0:
+        for path in paths:
+            yield path, read_file(path)
+        return
+
+    lock = threading.Lock()
+    buffered = [0]
+
+    def read(path):
+        data = read_file(path)
+        with lock:
+            buffered[0] += len(data)
+        return data
+
+    pending = deque()
+    next_path = 0
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        try:
+            while pending or next_path < len(paths):
+                while next_path < len(paths) and len(pending) < depth and (not pending or buffered[0] < max_bytes):
+                    pending.append((paths[next_path], executor.submit(read, paths[next_path])))
+                    next_path += 1
+                path, future = pending.popleft()
+                data = future.result()
+                with lock:
+                    buffered[0] -= len(data)
+                yield path, data
+        finally:
+            # the caller stopped early or a read failed, don't start the reads that are still queued
+            for _, future in pending:
+                future.cancel()
+
+
+def format_obj_lines(tag, values):
+    """
+    Format a (num_lines, columns) array as OBJ lines (tag is b"v ", b"vn ", ...) in a single formatting pass.
+    """
+    line_format = tag.decode("ascii") + " ".join(["%.6f"] * values.shape[1]) + "\n"
+    return ((line_format * values.shape[0]) % tuple(values.ravel().tolist())).encode("ascii")
+
+
+def format_obj_lines_fixed(tag, values, decimals=6):
+    """
+    Format a (num_lines, columns) array as OBJ lines with NumPy alone, no Python call per line or value.
+    Every value is right-aligned in a field as wide as the largest one, so the bytes are written
+    straight into a (num_lines, line length) array. The values parse back like the "%.6f" of
+    format_obj_lines, only the padding spaces differ. NaN and inf have no digits to write, they raise.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    num_lines, columns = values.shape
+    if not np.isfinite(values).all():
+        line = int(np.flatnonzero(~np.isfinite(values).all(axis=1))[0])
+        raise ValueError(f"Line {line} has a value that isn't finite: {values[line].tolist()}")
+    scaled = np.rint(values * 10 ** decimals).astype(np.int64)
+    negative = scaled < 0
+    whole, fraction = np.divmod(np.abs(scaled), 10 ** decimals)
+    int_digits = len(str(int(whole.max()))) if whole.size else 1
+    # separator and sign, integer digits, point, decimals
+    width = 2 + int_digits + 1 + decimals
+    tag = tag.rstrip()
+    chars = np.full((num_lines, len(tag) + columns * width + 1), ord(" "), dtype=np.uint8)
+    chars[:, :len(tag)] = np.frombuffer(tag, dtype=np.uint8)
+    chars[:, -1] = ord("\n")
+    fields = chars[:, len(tag):-1].reshape(num_lines, columns, width)
+    point = width - 1 - decimals
+    for digit in range(decimals):
+        fraction, fields[:, :, width - 1 - digit] = np.divmod(fraction, 10)
+        fields[:, :, width - 1 - digit] += ord("0")
+    fields[:, :, point] = ord(".")
+    # leading zeros of the integer part stay spaces, the sign goes right before its first digit
+    digits = np.ones(whole.shape, dtype=np.int64)
+    fields[:, :, point - 1] = ord("0") + whole % 10
+    whole //= 10
+    for digit in range(1, int_digits):
+        present = whole > 0
+        fields[:, :, point - 1 - digit] = np.where(present, ord("0") + whole % 10, ord(" "))
+        digits += present
+        whole //= 10
+    negative_lines, negative_columns = np.nonzero(negative)
+    fields[negative_lines, negative_columns, point - 1 - digits[negative_lines, negative_columns]] = ord("-")
+    return chars.tobytes()
+
+
+def split_obj_blocks(data, tag=b"v "):
+    """
+    Split an OBJ held in memory around its tag blocks, to write many meshes with its topology.
+    Returns (pieces, rows): the bytes before, between and after the blocks and the line count of every block.
+    """
+    pieces = []
+    rows = []
+    last_end = 0
+    for start, end in find_obj_blocks(data, tag):
+        pieces.append(data[last_end:start])
+        rows.append(_count_lines(data[start:end]))
+        last_end = end
+    pieces.append(data[last_end:])
+    return pieces, rows
+
+
+def replace_obj_blocks(data, tag, values):
+    """
+    Rewrite every tag block of an OBJ held in memory with the rows of values, in file order.
+    Everything outside these blocks is kept byte for byte. The lines are written by
+    format_obj_lines_fixed, values that aren't finite fall back to the "%.6f" of format_obj_lines.
+    """
+    pieces = []
+    row = 0
+    last_end = 0
+    for start, end in find_obj_blocks(data, tag):
+        num_lines = _count_lines(data[start:end])
+        pieces.append(data[last_end:start])
+        block = values[row:row + num_lines]
+        pieces.append(format_obj_lines_fixed(tag, block) if np.isfinite(block).all() else format_obj_lines(tag, block))
+        row += num_lines
+        last_end = end
+    if row != len(values):
+        raise ValueError(f"Expected {row} rows for the {tag!r} blocks, got {len(values)}")
+    pieces.append(data[last_end:])
+    return b"".join(pieces)
@@ -0,0 +1,275 @@
+"""
+Timing and memory spans shared by the pipeline scripts.
+
+Every script wraps its stages in spans (performance processing, export, bake, JSON write, Maya
+apply/export, normalize, pack), per take or per chunk of frames. A span records its wall time, the
+number of items it processed (frames, files, controls) and the peak RSS of the process, and is
+appended as one JSON line to the metrics file. Nothing is written when no metrics file is set.
+
+The metrics file is set with --metrics (or the metrics_path of the Maya script) or the
+PIPELINE_METRICS environment variable, worker processes inherit it. Several processes can append to
+the same file.
+
+  python metrics.py report metrics.jsonl [--by name|script|subject] [--baseline last_night.jsonl --threshold 10]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+
+METRICS_ENV = "PIPELINE_METRICS"
+
+_sink = {"path": os.environ.get(METRICS_ENV) or None, "script": None}
+_local = threading.local()
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def configure(path=None, script=None):
+    """
+    Append the spans of this process to path, PIPELINE_METRICS is used when path is None.
+    The path is put into the environment so the worker processes write to the same file.
+    """
+    path = path or os.environ.get(METRICS_ENV) or None
+    _sink["path"] = path
+    _sink["script"] = script
+    if path:
+        os.environ[METRICS_ENV] = path
+    return path
+
+
+def enabled():
+    return _sink["path"] is not None
+
+
+def script_name():
+    return _sink["script"] or os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ""))[0] or "python"
+
+
+def _windows_memory():
+    # psapi GetProcessMemoryInfo, Windows has no resource module
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi = ctypes.windll.psapi
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None, None
+    return counters.PeakWorkingSetSize, counters.WorkingSetSize
+
+
+def memory_usage():
+    """
+    (peak RSS, current RSS) of this process in bytes, None where the platform doesn't tell.
+    """
+    try:
+        if resource is None:
+            return _windows_memory()
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        peak = peak if sys.platform == "darwin" else peak * 1024
+        current = None
+        if os.path.exists("/proc/self/statm"):
+            with open("/proc/self/statm", "r") as file:
+                current = int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return peak, current
+    except (OSError, AttributeError, ValueError):
+        return None, None
+
+
+def _megabytes(size):
+    return None if size is None else round(size / (1 << 20), 1)
+
+
+def record(name, seconds, items=None, parent=None, status="ok", peak_rss_growth=None, **fields):
+    """
+    Append one span to the metrics file, for work that isn't timed by span() like a worker process.
+    """
+    if not enabled():
+        return None
+    peak, current = memory_usage()
+    entry = {
+        "name": name,
+        "script": script_name(),
+        "pid": os.getpid(),
+        "time": round(time.time(), 3),
+        "seconds": round(seconds, 6),
+        "items": items,
+        "items_per_second": round(items / seconds, 3) if items and seconds > 0 else None,
+        "peak_rss_mb": _megabytes(peak),
+        "rss_mb": _megabytes(current),
+        "peak_rss_growth_mb": _megabytes(peak_rss_growth),
+        "parent": parent,
+        "status": status,
+    }
+    entry.update(fields)
+    line = json.dumps(entry, default=str) + "\n"
+    # one write per line in append mode, so lines of concurrent processes don't interleave
+    with open(_sink["path"], "a") as file:
+        file.write(line)
+    return entry
+
+
+class Span:
+    """
+    A running span, items and fields can still be set inside the with block.
+    seconds is set when the block exits, also when no metrics file is set.
+    """
+
+    def __init__(self, name, items=None, fields=None):
+        self.name = name
+        self.items = items
+        self.fields = fields or {}
+        self.seconds = None
+
+    def add_items(self, count):
+        self.items = (self.items or 0) + count
+
+
+@contextmanager
+def span(name, items=None, parent=None, **fields):
+    """
+    Time the with block as a span named name, nested spans record the span they run in as parent.
+    Spans of worker processes pass the parent they run for, they have no enclosing span.
+    A span whose block raises is recorded with status failed and the error.
+    """
+    current = Span(name, items, fields)
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = parent or (stack[-1].name if stack else None)
+    peak_before = memory_usage()[0] if enabled() else None
+    stack.append(current)
+    start = time.perf_counter()
+    status, error = "ok", None
+    try:
+        yield current
+    except BaseException as exception:
+        status, error = "failed", f"{type(exception).__name__}: {exception}"
+        raise
+    finally:
+        current.seconds = time.perf_counter() - start
+        stack.pop()
+        if enabled():
+            peak_after = memory_usage()[0]
+            growth = peak_after - peak_before if peak_after is not None and peak_before is not None else None
+            if error is not None:
+                current.fields["error"] = error
+            record(current.name, current.seconds, current.items, parent, status, growth, **current.fields)
+
+
+def read_spans(paths):
+    spans = []
+    for path in paths:
+        with open(path, "r") as file:
+            for line in file:
+                line = line.strip()
+                # a process killed mid write leaves a partial last line
+                if line:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        pass
+    return spans
+
+
+def summarize(spans, by="name"):
+    """
+    Per (by, name) totals of the spans: count, failures, seconds, items, items/sec and peak RSS.
+    The share is the part of the wall time of the top level spans.
+    """
+    top_level = sum(entry["seconds"] for entry in spans if entry.get("parent") is None) or 1.0
+    rows = {}
+    for entry in spans:
+        key = entry["name"] if by == "name" else (str(entry.get(by)), entry["name"])
+        row = rows.setdefault(key, {"key": key, "count": 0, "failed": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                    "items": 0, "peak_rss_mb": None, "top_level": entry.get("parent") is None})
+        row["count"] += 1
+        row["failed"] += entry.get("status") == "failed"
+        row["seconds"] += entry["seconds"]
+        row["max_seconds"] = max(row["max_seconds"], entry["seconds"])
+        row["items"] += entry.get("items") or 0
+        if entry.get("peak_rss_mb") is not None:
+            row["peak_rss_mb"] = max(row["peak_rss_mb"] or 0.0, entry["peak_rss_mb"])
+    for row in rows.values():
+        row["mean_seconds"] = row["seconds"] / row["count"]
+        row["items_per_second"] = row["items"] / row["seconds"] if row["items"] and row["seconds"] > 0 else None
+        row["share"] = row["seconds"] / top_level if row["top_level"] else None
+    return sorted(rows.values(), key=lambda row: -row["seconds"])
+
+
+def regression(row, baseline_row):
+    """
+    Slowdown against the baseline in percent, by items/sec when both have items, mean seconds otherwise.
+    """
+    if row["items_per_second"] and baseline_row["items_per_second"]:
+        return (baseline_row["items_per_second"] / row["items_per_second"] - 1.0) * 100.0
+    if baseline_row["mean_seconds"] > 0:
+        return (row["mean_seconds"] / baseline_row["mean_seconds"] - 1.0) * 100.0
+    return None
+
+
+def _format(value, spec, width, suffix=""):
+    return "-".rjust(width) if value is None else format(value, spec) + suffix
+
+
+def report(paths, by="name", baseline=None, threshold=None):
+    """
+    Print where the time of a batch goes, with the change against a baseline run.
+    Returns the spans slower than the baseline by more than threshold percent.
+    """
+    rows = summarize(read_spans(paths), by)
+    baseline_rows = {row["key"]: row for row in summarize(read_spans([baseline]), by)} if baseline else {}
+    regressions = []
+    print(f"{'span':40s} {'count':>7s} {'failed':>6s} {'total s':>10s} {'mean s':>9s} {'max s':>9s} "
+          f"{'items':>9s} {'items/s':>10s} {'peak MB':>8s} {'share':>6s}" + (f" {'change':>8s}" if baseline else ""))
+    for row in rows:
+        key = row["key"] if by == "name" else "/".join(row["key"])
+        line = (f"{key[:40]:40s} {row['count']:7d} {row['failed']:6d} {row['seconds']:10.3f} {row['mean_seconds']:9.4f} "
+                f"{row['max_seconds']:9.4f} {row['items']:9d} {_format(row['items_per_second'], '10.1f', 10)} "
+                f"{_format(row['peak_rss_mb'], '8.1f', 8)} {_format(None if row['share'] is None else row['share'] * 100, '5.1f', 6, '%')}")
+        if baseline:
+            change = regression(row, baseline_rows[row["key"]]) if row["key"] in baseline_rows else None
+            line += f" {_format(change, '+7.1f', 8, '%')}"
+            if change is not None and threshold is not None and change > threshold:
+                regressions.append((key, change))
+        print(line)
+    for key, change in regressions:
+        print(f"Regression: {key} is {change:.1f}% slower than the baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the spans of the pipeline scripts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Show where the time of a batch goes")
+    report_parser.add_argument("paths", type=str, nargs="+", help="Metrics files written by the pipeline scripts")
+    report_parser.add_argument("--by", type=str, choices=["name", "script", "subject", "take", "pid"], help="Group the spans by this field and their name", default="name")
+    report_parser.add_argument("--baseline", type=str, help="Metrics file of an earlier run to compare with", default=None)
+    report_parser.add_argument("--threshold", type=float, help="Exit with an error when a span is slower than the baseline by this many percent", default=None)
+    args = parser.parse_args()
+
+    if args.command == "report":
+        if report(args.paths, args.by, args.baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import numpy as np
+
+from mesh_io import parse_obj_vertices, parse_obj_block, find_obj_blocks, replace_obj_blocks
+
+# blender_normalize imports with global_scale=(1/114)
+IMPORT_SCALE = 1 / 114
+
+
+def to_y_up(values):
+    """
+    Blender (Z up, -Y forward) to OBJ export axes (Y up, -Z forward): (x, y, z) -> (x, z, -y).
+    """
+    converted = np.empty_like(values)
+    converted[..., 0] = values[..., 0]
+    converted[..., 1] = values[..., 2]
+    converted[..., 2] = -values[..., 1]
+    return converted
+
+
+def normalize_vertices(verts):
+    """
+    NumPy equivalent of blender_normalize on a (num_vertices, 3) array of raw vertex positions:
+    the Y forward / Z up import with 1/114 scale, origin_set to the bounds center and the
+    -Z forward / Y up export. Returns float32 positions in the normalized OBJ space.
+    A (num_frames, num_vertices, 3) array normalizes every frame on its own.
+    """
+    verts = np.asarray(verts, dtype=np.float64) * IMPORT_SCALE
+    # the bounds center ends up at the origin
+    verts -= (verts.min(axis=-2, keepdims=True) + verts.max(axis=-2, keepdims=True)) / 2
+    return to_y_up(verts).astype(np.float32)
+
+
+def normalize_vertex_file(input_path, output_path, chunk_frames=256):
+    """
+    Normalize a packed (num_frames, num_vertices * 3) vertex sequence file, chunk_frames frames at a time.
+    """
+    frames = np.load(input_path, mmap_mode="r")
+    normalized = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32, shape=frames.shape)
+    for start in range(0, len(frames), chunk_frames):
+        chunk = frames[start:start + chunk_frames]
+        normalized[start:start + len(chunk)] = normalize_vertices(chunk.reshape(len(chunk), -1, 3)).reshape(len(chunk), -1)
+    normalized.flush()
+    del normalized
+
+
+def normalize_obj_data(data):
+    """
+    Normalize an OBJ held in memory. Vertices are normalized and normals are rotated to the
+    export axes, every other line is kept as is. Returns the normalized OBJ as bytes.
+    """
+    verts = parse_obj_vertices(data)
+    if len(verts):
+        data = replace_obj_blocks(data, b"v ", normalize_vertices(verts))
+    normal_blocks = [parse_obj_block(data[start:end], b"vn ") for start, end in find_obj_blocks(data, b"vn ")]
+    if normal_blocks:
+        data = replace_obj_blocks(data, b"vn ", to_y_up(np.concatenate(normal_blocks)))
+    return data
+
+
+def numpy_normalize(input_path, output_path, data=None):
+    """
+    Drop-in replacement for blender_normalize that doesn't need Blender.
+    data is the content of input_path when the caller already read it (see mesh_io.prefetch_files).
+    """
+    if data is None:
+        with open(input_path, "rb") as file:
+            data = file.read()
+    with open(output_path, "wb") as file:
+        file.write(normalize_obj_data(data))
+
+
+def compare_to_reference(input_path, reference_path):
+    """
+    Normalize a raw OBJ with NumPy and compare it to the Blender normalized reference OBJ.
+    Returns the largest absolute vertex difference.
+    """
+    with open(input_path, "rb") as file:
+        verts = normalize_vertices(parse_obj_vertices(file.read()))
+    with open(reference_path, "rb") as file:
+        reference = parse_obj_vertices(file.read())
+    if verts.shape != reference.shape:
+        raise ValueError(f"{input_path} has {len(verts)} vertices but {reference_path} has {len(reference)}")
+    return float(np.abs(verts - reference).max()) if len(verts) else 0.0
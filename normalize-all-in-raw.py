@@ -1,11 +1,28 @@
 # IMPORTANT:
-# Run this with blender --background --python normalize-all-in-raw.py
+# The default NumPy engine runs with plain python:
+#   python normalize-all-in-raw.py --subjects e
+# The Blender engine has to run with blender --background --python normalize-all-in-raw.py -- --engine blender
 # A custom version of Blender is installed at ~/blender-4.0.2-linux-x64/blender
 
 import os
-import bpy
+import sys
+import argparse
+
+# blender doesn't put the script directory on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from normalization import IMPORT_SCALE, numpy_normalize, normalize_vertex_file, compare_to_reference
+from mesh_io import prefetch_files, READ_AHEAD, READ_AHEAD_BYTES
+from manifest import Manifest, file_fingerprint
+from take_index import TakeIndex, DEFAULT_INDEX_PATH, folder_takes, list_folder
+import metrics
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
 
 BASE_DATA_PATH = '/data6/leoho/vasilisa'
+MANIFEST_NAME = 'manifest.sqlite'
 
 def p(dirpath):
     return os.path.join(BASE_DATA_PATH, *dirpath)
@@ -16,6 +33,8 @@ def create_if_not_exist(absolute_path):
         print(f'Directory {absolute_path} created')
 
 def blender_normalize(input_path, output_path):
+    if bpy is None:
+        raise RuntimeError('The blender engine has to run inside blender, use --engine numpy otherwise')
     # Delete all mesh objects
     bpy.ops.object.select_all(action='DESELECT')
     bpy.ops.object.select_by_type(type='MESH')
@@ -27,42 +46,131 @@ def blender_normalize(input_path, output_path):
     # Exports the selected mesh objects
     bpy.ops.wm.obj_export(filepath=output_path, forward_axis='NEGATIVE_Z', up_axis='Y', export_materials=False)
 
-def do_normalization():
+NORMALIZERS = {
+    'numpy': numpy_normalize,
+    'blender': blender_normalize,
+}
+
+def do_normalization(engine='numpy', subjects=None, force=False, content_hash=False, index_path=DEFAULT_INDEX_PATH, rescan=False,
+                     read_ahead=READ_AHEAD, read_ahead_mb=READ_AHEAD_BYTES >> 20):
+    """
+    Normalize raw/ into normalized/. Finished files are recorded in the manifest, files whose
+    input, parameters and output are unchanged since are skipped, unless force is set.
+    The subjects, their scenarios and the files of every scenario come from the listings kept in the
+    take index, a folder is only listed again when its mtime changed or rescan is set.
+    Every scenario is a normalize_scenario span of metrics.py, with the normalized files as items.
+    The NumPy engine reads up to read_ahead OBJs (at most read_ahead_mb of them) on threads while it
+    normalizes the current one, see mesh_io.prefetch_files.
+    """
     print('normalization start')
+    normalize = NORMALIZERS[engine]
+    params = {'engine': engine, 'scale': IMPORT_SCALE}
     
     # Create output directory if not exist
     create_if_not_exist(p(['normalized']))
     
-    # Sequential
-    # for date_subject in sorted(os.listdir(p(['raw']))):
-    #     create_if_not_exist(p(['normalized', date_subject]))
-    #     for scenario_id in sorted(os.listdir(p(['raw', date_subject]))):
-    #         print('Processing ' + p([date_subject, scenario_id]))
-    #         create_if_not_exist(p(['normalized', date_subject, scenario_id]))
-    #         for obj in sorted(os.listdir(p(['raw', date_subject, scenario_id]))):
-    #             target_obj_path = p(['raw', date_subject, scenario_id, obj])
-    #             output_obj_path = p(['normalized', date_subject, scenario_id, obj])
-    #             blender_normalize(target_obj_path, output_obj_path)
-    #             print('Normalized ' + target_obj_path)
-    
-    # Parallel subjects
-    date_subject = 'e'
-    create_if_not_exist(p(['normalized', date_subject]))
-    # all_remaining_scenarios = sorted(os.listdir(p(['raw', date_subject])))[18:]
-    # input(all_remaining_scenarios)
-    for scenario_id in sorted(os.listdir(p(['raw', date_subject]))):
-        # if scenario_id not in all_remaining_scenarios:
-            # continue
-        print('Processing ' + p([date_subject, scenario_id]))
-        create_if_not_exist(p(['normalized', date_subject, scenario_id]))
-        for obj in sorted(os.listdir(p(['raw', date_subject, scenario_id]))):
-            target_obj_path = p(['raw', date_subject, scenario_id, obj])
-            output_obj_path = p(['normalized', date_subject, scenario_id, obj])
-            blender_normalize(target_obj_path, output_obj_path)
-            print('Normalized ' + target_obj_path) 
+    with Manifest(p([MANIFEST_NAME])) as manifest, TakeIndex(index_path) as index:
+        for date_subject in subjects or list_folder(index, p(['raw']), rescan, folders_only=True):
+            create_if_not_exist(p(['normalized', date_subject]))
+            for take, raw_dir in folder_takes(index, date_subject, p(['raw', date_subject]), 'raw_dir', rescan):
+                scenario_id = os.path.basename(raw_dir)
+                print('Processing ' + p([date_subject, scenario_id]))
+                create_if_not_exist(p(['normalized', date_subject, scenario_id]))
+                with metrics.span('normalize_scenario', subject=date_subject, take=take, engine=engine) as scenario_span:
+                    skipped = 0
+                    pending = []
+                    for obj in list_folder(index, raw_dir, rescan):
+                        target_obj_path = p(['raw', date_subject, scenario_id, obj])
+                        output_obj_path = p(['normalized', date_subject, scenario_id, obj])
+                        key = '/'.join([date_subject, scenario_id, obj])
+                        fingerprint = file_fingerprint(target_obj_path, content_hash)
+                        if not force and manifest.is_current('normalize', key, fingerprint, params, output_obj_path):
+                            skipped += 1
+                            continue
+                        pending.append((obj, target_obj_path, output_obj_path, key, fingerprint))
+                    # blender imports the OBJs itself, only the NumPy engine gets them read ahead
+                    reads = prefetch_files([target_obj_path for obj, target_obj_path, _, _, _ in pending
+                                            if engine == 'numpy' and not obj.endswith('.npy')],
+                                           read_ahead, int(read_ahead_mb * (1 << 20)))
+                    for obj, target_obj_path, output_obj_path, key, fingerprint in pending:
+                        if obj.endswith('.npy'):
+                            # packed vertex sequence from export_vertex_sequence, always NumPy
+                            normalize_vertex_file(target_obj_path, output_obj_path)
+                        elif engine == 'numpy':
+                            _, data = next(reads)
+                            numpy_normalize(target_obj_path, output_obj_path, data)
+                        else:
+                            normalize(target_obj_path, output_obj_path)
+                        manifest.record('normalize', key, fingerprint, params, output_obj_path)
+                        scenario_span.add_items(1)
+                        print('Normalized ' + target_obj_path)
+                    scenario_span.fields['skipped'] = skipped
+                if skipped:
+                    print(f'Skipped {skipped} up to date files')
+                # a crash only costs the scenario that was in progress
+                manifest.commit()
+                index.set_artifact(date_subject, take, 'normalized_dir', p(['normalized', date_subject, scenario_id]))
+                index.set_stage(date_subject, take, 'normalize')
+
+def normalized_objs(subjects=None):
+    # (date_subject, scenario_id, obj) of every OBJ of the normalized/ tree
+    for date_subject in subjects or sorted(os.listdir(p(['normalized']))):
+        for scenario_id in sorted(os.listdir(p(['normalized', date_subject]))):
+            for obj in sorted(os.listdir(p(['normalized', date_subject, scenario_id]))):
+                if obj.endswith('.obj'):
+                    yield date_subject, scenario_id, obj
+
+def do_verification(subjects=None, tolerance=1e-5, max_files=-1):
+    """
+    Check the NumPy engine against an existing blender normalized/ tree.
+    Returns the number of files that differ by more than tolerance.
+    """
+    print('verification start')
+    checked = 0
+    failed = 0
+    max_error = 0.0
+    for date_subject, scenario_id, obj in normalized_objs(subjects):
+        if max_files != -1 and checked >= max_files:
+            break
+        target_obj_path = p(['raw', date_subject, scenario_id, obj])
+        error = compare_to_reference(target_obj_path, p(['normalized', date_subject, scenario_id, obj]))
+        checked += 1
+        max_error = max(max_error, error)
+        if error > tolerance:
+            failed += 1
+            print(f'Mismatch {target_obj_path}: max error {error:.3g} > {tolerance:.3g}')
+    print(f'Verified {checked} files, {failed} above tolerance, max error {max_error:.3g}')
+    return failed
 
 def main():
-  do_normalization()
+    global BASE_DATA_PATH
+    # blender passes the script arguments after --
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description='Normalize the raw OBJ tree into normalized/')
+    parser.add_argument('--base_data_path', type=str, help='Dataset root containing raw/', default=BASE_DATA_PATH)
+    parser.add_argument('--subjects', type=str, nargs='*', help='Subjects to normalize, all subjects by default', default=None)
+    parser.add_argument('--engine', type=str, choices=sorted(NORMALIZERS), help='Normalization engine', default='numpy')
+    parser.add_argument('--force', action='store_true', help='Normalize every file, even the ones the manifest has as up to date')
+    parser.add_argument('--content_hash', action='store_true', help='Detect changed inputs by content hash instead of size and mtime')
+    parser.add_argument('--take_index', type=str, help='Take index file shared by the pipeline scripts', default=DEFAULT_INDEX_PATH)
+    parser.add_argument('--rescan', action='store_true', help='List the raw/ folders even when the take index has them as unchanged')
+    parser.add_argument('--read_ahead', type=int, help='OBJs read ahead on threads by the NumPy engine, 0 to read them one by one', default=READ_AHEAD)
+    parser.add_argument('--read_ahead_mb', type=float, help='Memory the OBJs read ahead may hold', default=READ_AHEAD_BYTES >> 20)
+    parser.add_argument('--verify', action='store_true', help='Compare the NumPy engine with the existing normalized/ tree instead')
+    parser.add_argument('--tolerance', type=float, help='Largest vertex difference accepted by --verify', default=1e-5)
+    parser.add_argument('--max_files', type=int, help='Number of files checked by --verify, -1 for all', default=-1)
+    parser.add_argument('--metrics', type=str, help='JSONL file the timing spans are appended to, PIPELINE_METRICS by default', default=None)
+    args = parser.parse_args(argv)
+
+    metrics.configure(args.metrics)
+
+    BASE_DATA_PATH = args.base_data_path
+    if args.verify:
+        if do_verification(args.subjects, args.tolerance, args.max_files):
+            sys.exit(1)
+    else:
+        do_normalization(args.engine, args.subjects, args.force, args.content_hash, args.take_index, args.rescan,
+                         args.read_ahead, args.read_ahead_mb)
 
 if __name__ == '__main__':
-  main()
\ No newline at end of file
+  main()
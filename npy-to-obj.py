@@ -0,0 +1,171 @@
+import os
+import re
+import sys
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from mesh_io import split_obj_blocks, format_obj_lines_fixed, TOPOLOGY_FILE
+from vertex_store import VertexStore
+import metrics
+
+# faces, UVs and the rest of the reference OBJ, set once per process by set_topology
+_topology = {}
+
+
+def drop_normal_index(match):
+  return match.group(1) + (b"/" + match.group(2) if match.group(2) else b"")
+
+
+def load_topology(reference_path, keep_normals=False):
+  """
+  Read the topology template of a reference OBJ (an OBJexport of the mesh or the topology.obj of
+  export_vertex_sequence): the bytes around its vertex blocks and the vertex count of every block.
+  The normals of the reference don't fit other frames, they are dropped and the faces only keep
+  their vertex and UV indices, unless keep_normals is set.
+  """
+  with open(reference_path, "rb") as file:
+    data = file.read()
+  if not keep_normals:
+    pieces, _ = split_obj_blocks(data, b"vn ")
+    data = b"".join(pieces)
+    # f v/vt/vn -> f v/vt and f v//vn -> f v, on the face lines alone, comments and names can hold slashes too
+    data = re.sub(rb"(?m)^f .*$", lambda line: re.sub(rb"(\d+)/(\d*)/\d+", drop_normal_index, line.group(0)), data)
+  return split_obj_blocks(data)
+
+
+def set_topology(pieces, rows, decimals=6):
+  # process pool initializer, the template is sent to every worker once instead of with every task
+  _topology["pieces"] = pieces
+  _topology["rows"] = rows
+  _topology["decimals"] = decimals
+
+
+def mesh_bytes(vertices):
+  """
+  OBJ of the (num_vertices, 3) vertices with the topology of set_topology.
+  """
+  pieces, rows = _topology["pieces"], _topology["rows"]
+  if len(vertices) != sum(rows):
+    raise Exception(f"The frame has {len(vertices)} vertices but the topology has {sum(rows)}")
+  parts = [pieces[0]]
+  row = 0
+  for num_rows, piece in zip(rows, pieces[1:]):
+    parts.append(format_obj_lines_fixed(b"v ", vertices[row:row + num_rows], _topology["decimals"]))
+    parts.append(piece)
+    row += num_rows
+  return b"".join(parts)
+
+
+def read_frames(sentence_path, frames):
+  # a packed .npy sentence is memory-mapped, a sentence of the int16 store of vertex_store.py is decoded
+  if sentence_path.endswith(".npz"):
+    return VertexStore(os.path.dirname(sentence_path)).load(os.path.basename(sentence_path), frames)
+  sentence = np.load(sentence_path, mmap_mode="r")
+  return np.asarray(sentence.reshape(len(sentence) if sentence.ndim == 2 else 1, -1)[frames])
+
+
+def frame_path(output_dir, sentence_path, frame):
+  # frame_number of sentence-packing.py reads the frame back from the name
+  name = os.path.splitext(os.path.basename(sentence_path))[0]
+  return os.path.join(output_dir, name, f"{name}_{frame:05d}.obj")
+
+
+def write_frames(sentence_path, frames, output_dir):
+  """
+  Write the OBJs of frames of a sentence. Runs inside the worker processes.
+  """
+  with metrics.span("write_obj_frames", items=len(frames), sentence=os.path.basename(sentence_path)):
+    vertices = read_frames(sentence_path, frames).reshape(len(frames), -1, 3)
+    for frame, frame_vertices in zip(frames, vertices):
+      with open(frame_path(output_dir, sentence_path, frame), "wb") as file:
+        file.write(mesh_bytes(frame_vertices))
+  return len(frames)
+
+
+def parse_frames(spec, num_frames):
+  """
+  Frames of a sentence from a list of "12", "10-20" (inclusive) or "0:300:10" (a slice), all of them by
+  default. Negative frames count from the end.
+  """
+  if not spec:
+    return list(range(num_frames))
+  frames = set()
+  for token in spec:
+    if ":" in token:
+      frames.update(range(num_frames)[slice(*[int(part) if part else None for part in token.split(":")])])
+    elif re.fullmatch(r"\d+-\d+", token):
+      start, end = (int(part) for part in token.split("-"))
+      frames.update(range(start, min(end, num_frames - 1) + 1))
+    else:
+      frame = int(token)
+      frames.add(frame + num_frames if frame < 0 else frame)
+  out_of_range = [frame for frame in frames if not 0 <= frame < num_frames]
+  if out_of_range:
+    raise Exception(f"Frames {sorted(out_of_range)[:5]} are out of the {num_frames} frames of the sentence")
+  return sorted(frames)
+
+
+def sentence_frame_count(sentence_path):
+  if sentence_path.endswith(".npz"):
+    return len(VertexStore(os.path.dirname(sentence_path)).sentence(os.path.basename(sentence_path)).codes)
+  sentence = np.load(sentence_path, mmap_mode="r")
+  return len(sentence) if sentence.ndim == 2 else 1
+
+
+def npy_to_obj(sentence_paths, reference_path, output_dir, frames=None, workers=1, chunk_frames=32, keep_normals=False, decimals=6):
+  """
+  Write the frames of packed sentences (.npy, or .npz of the vertex_store.py store) as OBJs with the
+  faces and UVs of the reference OBJ, into output_dir/<sentence>/<sentence>_<frame>.obj.
+  frames is a parse_frames spec applied to every sentence. The topology is read once, every frame is
+  formatted with format_obj_lines_fixed, and with workers > 1 chunks of chunk_frames frames are written
+  on a process pool. Returns the number of OBJs written.
+  """
+  print("npy-to-obj start")
+  pieces, rows = load_topology(reference_path, keep_normals)
+  tasks = []
+  for sentence_path in sentence_paths:
+    sentence_frames = parse_frames(frames, sentence_frame_count(sentence_path))
+    os.makedirs(os.path.dirname(frame_path(output_dir, sentence_path, 0)), exist_ok=True)
+    for start in range(0, len(sentence_frames), chunk_frames):
+      tasks.append((sentence_path, sentence_frames[start:start + chunk_frames], output_dir))
+    print(f"Writing {len(sentence_frames)} frames of {sentence_path}")
+
+  written = 0
+  with metrics.span("npy_to_obj", workers=workers) as run_span:
+    if workers <= 1:
+      set_topology(pieces, rows, decimals)
+      for task in tasks:
+        written += write_frames(*task)
+    else:
+      with ProcessPoolExecutor(max_workers=workers, initializer=set_topology, initargs=(pieces, rows, decimals)) as executor:
+        for future in as_completed([executor.submit(write_frames, *task) for task in tasks]):
+          written += future.result()
+    run_span.items = written
+  print(f"Wrote {written} OBJs to {output_dir}")
+  print("npy-to-obj end")
+  return written
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Write frames of packed sentences as OBJs with the topology of a reference OBJ")
+  parser.add_argument("--sentences", type=str, nargs="+", help="Packed sentences, .npy or .npz of the compressed store", required=True)
+  parser.add_argument("--reference", type=str, help=f"OBJ the faces and UVs are taken from, like the {TOPOLOGY_FILE} of a vertex sequence", required=True)
+  parser.add_argument("--output_dir", type=str, help="Folder the OBJs are written to, one subfolder per sentence", default="obj_frames")
+  parser.add_argument("--frames", type=str, nargs="*", help="Frames to write: 12, 10-20 or 0:300:10, all frames by default", default=None)
+  parser.add_argument("--workers", type=int, help="Number of worker processes, 1 to run sequentially", default=os.cpu_count())
+  parser.add_argument("--chunk_frames", type=int, help="Frames per worker task", default=32)
+  parser.add_argument("--keep_normals", action="store_true", help="Keep the normals of the reference OBJ instead of dropping them")
+  parser.add_argument("--decimals", type=int, help="Decimals of the vertex coordinates", default=6)
+  parser.add_argument("--metrics", type=str, help="JSONL file the timing spans are appended to, PIPELINE_METRICS by default", default=None)
+  args = parser.parse_args()
+
+  metrics.configure(args.metrics)
+  written = npy_to_obj(args.sentences, args.reference, args.output_dir, frames=args.frames, workers=args.workers,
+                       chunk_frames=args.chunk_frames, keep_normals=args.keep_normals, decimals=args.decimals)
+  if not written:
+    print("No frames to write")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -1,19 +1,180 @@
 import os
+import sys
+import argparse
 import numpy as np
-import copy
-import re
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def extract_vert(filepath):
-  with open(filepath, "r") as file:
-      # Extract the vertex data from the file
-      vertex_data = [line.split()[1:4] for line in file if line.startswith("v ")]
-      vertex_array = np.array(vertex_data).astype(dtype="float32")
-      vert = np.reshape(vertex_array, (-1, vertex_array.shape[0] * vertex_array.shape[1]))
-      return vert
+from mesh_io import read_obj_vertices, parse_obj_vertices, prefetch_files, READ_AHEAD, READ_AHEAD_BYTES, VERTEX_SEQUENCE_FILE
+from normalization import normalize_vertices
+from manifest import Manifest, files_fingerprint
+from take_index import TakeIndex, DEFAULT_INDEX_PATH, folder_takes, list_folder
+from sentence_loader import split_sentence_name
+import metrics
+import vertex_store
+from vertex_stats import VertexStats, sentence_key, save_sentence_stats, discard_sentence_stats, merge_subject_stats, subject_stats_path
 
+NUM_VERTICES = 24049
+MANIFEST_NAME = "manifest.sqlite"
 
-def do_sentence_packing(BASE_DATA_PATH):
+def extract_vert(filepath, normalize=False):
+  # Bulk-parse the vertex block of the file straight into float32
+  return vertex_row(read_obj_vertices(filepath), normalize)
+
+
+def vertex_row(vertex_array, normalize=False):
+  if normalize:
+    # raw OBJ, apply the blender_normalize transform in memory
+    vertex_array = normalize_vertices(vertex_array)
+  vert = np.reshape(vertex_array, (1, vertex_array.shape[0] * vertex_array.shape[1]))
+  return vert
+
+
+def frame_number(obj):
+  return int(obj.split("_")[-1].split(".")[0])
+
+
+def sentence_shape(num_frames):
+  # np.squeeze used to drop the frame axis of single-frame sentences, keep that layout
+  if num_frames == 1:
+    return (NUM_VERTICES * 3,)
+  return (num_frames, NUM_VERTICES * 3)
+
+
+def sentence_name(file_path):
+  # <date_subject>_<scenario_id> of a sentence file or of its temporary file
+  return os.path.basename(file_path).split(".")[0]
+
+
+def pack_frames(file_path, row_start, obj_paths, normalize=False, read_ahead=READ_AHEAD, read_ahead_bytes=READ_AHEAD_BYTES, stats=True):
+  """
+  Extract consecutive frames and write them straight into their rows of the preallocated
+  sentence file, starting at row_start. Runs inside the worker processes.
+  With normalize the frames are raw OBJs that get normalized on the fly.
+  The next read_ahead OBJs are read on threads while a frame is parsed (see prefetch_files).
+  Returns the number of frames and, with stats, their VertexStats.
+  """
+  with metrics.span("pack_chunk", items=len(obj_paths), parent="sentence_packing", sentence=sentence_name(file_path), row_start=row_start, source="obj"):
+    sentence = np.lib.format.open_memmap(file_path, mode="r+")
+    data_verts = sentence.reshape(-1, NUM_VERTICES * 3)
+    for row, (target_obj_path, data) in enumerate(prefetch_files(obj_paths, read_ahead, read_ahead_bytes), row_start):
+      verts = vertex_row(parse_obj_vertices(data), normalize)
+      if verts.shape[1] == NUM_VERTICES * 3:
+        data_verts[row] = verts[0]
+      else:
+        raise Exception(f"An obj doesn't have the exact number of vertices: {target_obj_path} has {verts.shape[1] // 3}")
+    # the rows were just written, they are read back from the page cache
+    chunk_stats = chunk_vertex_stats(file_path, data_verts[row_start:row_start + len(obj_paths)], row_start) if stats else None
+    # flush and unmap so the written pages don't stay in this process
+    sentence.flush()
+    del data_verts, sentence
+  return len(obj_paths), chunk_stats
+
+
+def pack_vertex_rows(file_path, row_start, vertex_path, num_rows, normalize=False, stats=True):
+  """
+  Copy rows of a packed vertex sequence (written by export_vertex_sequence in Maya) into the
+  same rows of the preallocated sentence file. Runs inside the worker processes.
+  Returns the number of frames and, with stats, their VertexStats.
+  """
+  with metrics.span("pack_chunk", items=num_rows, parent="sentence_packing", sentence=sentence_name(file_path), row_start=row_start, source="vertices"):
+    frames = np.load(vertex_path, mmap_mode="r")
+    if frames.shape[1] != NUM_VERTICES * 3:
+      raise Exception(f"A vertex sequence doesn't have the exact number of vertices: {vertex_path} has {frames.shape[1] // 3}")
+    verts = frames[row_start:row_start + num_rows]
+    if normalize:
+      verts = normalize_vertices(verts.reshape(num_rows, -1, 3)).reshape(num_rows, -1)
+    sentence = np.lib.format.open_memmap(file_path, mode="r+")
+    sentence.reshape(-1, NUM_VERTICES * 3)[row_start:row_start + num_rows] = verts
+    sentence.flush()
+    del sentence
+  return num_rows, chunk_vertex_stats(file_path, verts, row_start) if stats else None
+
+
+def chunk_vertex_stats(file_path, frames, row_start):
+  # the neutral of a subject is the first frame of its first sentence, see vertex_stats.py
+  return VertexStats.from_frames(frames, sentence_key(sentence_name(file_path) + ".npy", row_start))
+
+
+def pack_tasks(sources, num_frames, chunk_frames, normalize, read_ahead=READ_AHEAD, read_ahead_bytes=READ_AHEAD_BYTES, stats=True):
+  """
+  Split a sentence into (function, row_start, args) tasks of chunk_frames frames, sources are
+  either the OBJ frames in order or a single packed vertex sequence file.
+  """
+  for start in range(0, num_frames, chunk_frames):
+    if sources[0].endswith(".npy"):
+      yield pack_vertex_rows, start, (sources[0], min(chunk_frames, num_frames - start), normalize, stats)
+    else:
+      yield pack_frames, start, (sources[start:start + chunk_frames], normalize, read_ahead, read_ahead_bytes, stats)
+
+
+def merge_chunk_stats(sentence_stats, key, chunk_stats):
+  # the chunks of a sentence come back in any order, merging doesn't depend on it
+  if chunk_stats is not None:
+    if key in sentence_stats:
+      sentence_stats[key].merge(chunk_stats)
+    else:
+      sentence_stats[key] = chunk_stats
+
+
+def create_sentence(OUTPUT_DIR, date_subject, scenario_id, num_frames):
+  """
+  Preallocate the .npy of a sentence as a memory-mapped file, frames are written into it by
+  pack_frames. The file is written under a temporary name until all of its frames are in.
+  """
+  file_path = os.path.join(OUTPUT_DIR, f"{date_subject}_{scenario_id}.npy")
+  tmp_path = file_path + ".tmp"
+  sentence = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=sentence_shape(num_frames))
+  del sentence
+  return tmp_path, file_path
+
+
+def finish_sentence(tmp_path, file_path, num_frames):
+  os.replace(tmp_path, file_path)
+  print(f"Saved data_verts of shape {sentence_shape(num_frames)} to {file_path}")
+
+
+def remove_sentence(tmp_path):
+  if os.path.exists(tmp_path):
+    os.remove(tmp_path)
+
+
+def record_sentence(index, date_subject, scenario_id, file_path):
+  index.set_artifact(date_subject, int(scenario_id), "sentence", file_path)
+  index.set_stage(date_subject, int(scenario_id), "pack")
+
+
+def do_sentence_packing(BASE_DATA_PATH, subjects=None, start_scenario=0, end_scenario=-1, workers=1, chunk_frames=64, source="normalized",
+                        force=False, content_hash=False, index_path=DEFAULT_INDEX_PATH, rescan=False, compress=None,
+                        compress_tolerance=1e-4, compress_components=128, read_ahead=READ_AHEAD, read_ahead_mb=READ_AHEAD_BYTES >> 20,
+                        stats=True):
+  """
+  Pack every scenario of the given subjects (all subjects by default) into one .npy sentence.
+  A scenario is either one OBJ per frame or a packed vertex sequence captured in Maya.
+  The frame count comes from the directory listing, so every sentence is preallocated as a
+  memory-mapped .npy and each frame is written straight into its row.
+  With workers > 1 the frames of every scenario are split into chunks of chunk_frames and
+  extracted on a process pool, every chunk writes its own rows so frame order is kept.
+  Every task reads up to read_ahead OBJs ahead of the one it parses, holding at most read_ahead_mb
+  of them, so the parsing doesn't wait on the storage, in sequential runs too.
+  source="raw" packs the raw/ tree and normalizes every frame in memory with the NumPy engine
+  of normalize-all-in-raw.py, so the normalized/ tree doesn't have to exist.
+  The subjects, their scenarios and the frames of every scenario come from the listings kept in the
+  take index, a folder is only listed again when its mtime changed or rescan is set.
+  Packed sentences are recorded in the manifest next to the dataset, a scenario whose frames,
+  parameters and output are unchanged since is skipped, unless force is set.
+  A failing scenario is reported and skipped, the others are still packed.
+  Every chunk of frames is a pack_chunk span of metrics.py, the whole run a sentence_packing span.
+  With stats every chunk also accumulates the per-vertex mean, variance, bounds and the neutral of
+  its frames (see vertex_stats.py), merged into the statistics of the sentence as the chunks come back
+  and into the statistics of every subject at the end, so they never need another read of the sentences.
+  compress="delta" or "pca" also encodes the sentences packed in this run into the int16 store of
+  vertex_store.py, a sentence that can't stay within compress_tolerance counts as failed.
+  Returns a dict of {(date_subject, scenario_id): error} for the failed scenarios.
+  """
   print("3-preformer: sentence-packing start")
+  started = time.perf_counter()
 
   # Create output directory if not exist
   OUTPUT_DIR = os.path.join(BASE_DATA_PATH, "vertices_npy_untrimmed")
@@ -21,41 +182,175 @@ def do_sentence_packing(BASE_DATA_PATH):
     os.makedirs(OUTPUT_DIR)
     print(f"Output path {OUTPUT_DIR} created")
 
-  BASE_PATH_RAW = os.path.join(BASE_DATA_PATH, "normalized")
+  BASE_PATH_RAW = os.path.join(BASE_DATA_PATH, source)
+  normalize = source == "raw"
+  read_ahead_bytes = int(read_ahead_mb * (1 << 20))
+  params = {"source": source, "num_vertices": NUM_VERTICES}
+  with Manifest(os.path.join(BASE_DATA_PATH, MANIFEST_NAME)) as manifest, TakeIndex(index_path) as index:
+    # Collect the scenarios to pack with their frames in order
+    sentences = []
+    fingerprints = {}
+    subjects_seen = []
+    for date_subject in subjects or list_folder(index, BASE_PATH_RAW, rescan, folders_only=True):
+      subjects_seen.append(date_subject)
+      for take, scenario_path in folder_takes(index, date_subject, os.path.join(BASE_PATH_RAW, date_subject), f"{source}_dir", rescan):
+        if take < start_scenario or (end_scenario != -1 and take > end_scenario):
+          continue
+        scenario_id = os.path.basename(scenario_path)
+        frame_files = list_folder(index, scenario_path, rescan)
+        if VERTEX_SEQUENCE_FILE in frame_files:
+          # packed capture from export_vertex_sequence instead of one OBJ per frame
+          sources = [os.path.join(scenario_path, VERTEX_SEQUENCE_FILE)]
+          num_frames = len(np.load(sources[0], mmap_mode="r"))
+        else:
+          sources = [os.path.join(scenario_path, obj) for obj in sorted(frame_files, key=frame_number)]
+          num_frames = len(sources)
+        if not num_frames:
+          print("Skipping empty scenario " + scenario_path)
+          continue
+        fingerprint = files_fingerprint(sources, content_hash)
+        output_path = os.path.join(OUTPUT_DIR, f"{date_subject}_{scenario_id}.npy")
+        if not force and manifest.is_current("pack", f"{date_subject}/{scenario_id}", fingerprint, params, output_path):
+          print("Skipping up to date scenario " + scenario_path)
+          continue
+        fingerprints[(date_subject, scenario_id)] = fingerprint
+        sentences.append(((date_subject, scenario_id), sources, num_frames))
 
-  # Sequential
-  # for date_subject in sorted(os.listdir(BASE_PATH_RAW)):
-  # Parallel
-  date_subject = '20240126_006Vasilisa'
-  for scenario_id in sorted(os.listdir(os.path.join(BASE_PATH_RAW, date_subject)), key=lambda x: int(x)):
-    # (26, 36), (37, 46), (47, 617), (618, 627), (628, 637)
-    if 628 <= int(scenario_id) <= 637:
-        pass
+    failures = {}
+    compress_failures = {}
+    sentence_stats = {}
+    if workers <= 1:
+      for (date_subject, scenario_id), sources, num_frames in sentences:
+        print("Processing " + os.path.join(BASE_PATH_RAW, date_subject, scenario_id))
+        tmp_path, file_path = create_sentence(OUTPUT_DIR, date_subject, scenario_id, num_frames)
+        try:
+          for function, start, task_args in pack_tasks(sources, num_frames, chunk_frames, normalize, read_ahead, read_ahead_bytes, stats):
+            _, chunk_stats = function(tmp_path, start, *task_args)
+            merge_chunk_stats(sentence_stats, (date_subject, scenario_id), chunk_stats)
+        except Exception as e:
+          failures[(date_subject, scenario_id)] = e
+          print(f"Failed {date_subject}/{scenario_id}: {e}")
+          remove_sentence(tmp_path)
+          continue
+        finish_sentence(tmp_path, file_path, num_frames)
+        if stats:
+          save_sentence_stats(OUTPUT_DIR, os.path.basename(file_path), sentence_stats.pop((date_subject, scenario_id)))
+        else:
+          discard_sentence_stats(OUTPUT_DIR, os.path.basename(file_path))
+        manifest.record("pack", f"{date_subject}/{scenario_id}", fingerprints[(date_subject, scenario_id)], params, file_path)
+        manifest.commit()
+        record_sentence(index, date_subject, scenario_id, file_path)
     else:
-      continue
-    print("Processing " + os.path.join(BASE_PATH_RAW, date_subject, scenario_id))
-    data_verts = []
-    
-    for obj in sorted(os.listdir(os.path.join(BASE_PATH_RAW, date_subject, scenario_id)), key=lambda x: int(x.split("_")[-1].split(".")[0])):
-      target_obj_path = os.path.join(BASE_PATH_RAW, date_subject, scenario_id, obj)
-      verts = extract_vert(target_obj_path)
-      print(target_obj_path + ", verts shape: " + str(verts.shape))
-      if verts.shape[1] == 24049 * 3:
-        data_verts.append(verts)
-      else:
-        raise Exception("An obj doesn't have the exact number of vertices")
-    data_verts = np.array(data_verts)
-    data_verts = np.squeeze(data_verts)
-    file_name = f"{date_subject}_{scenario_id}.npy"
-    file_path = os.path.join(OUTPUT_DIR, file_name)
-    np.save(file_path, data_verts)
-    print(f"Saved data_verts of shape {data_verts.shape} to {file_path}")
+      with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        outputs = {}
+        remaining = {}
+        for key, sources, num_frames in sentences:
+          print("Processing " + os.path.join(BASE_PATH_RAW, *key))
+          outputs[key] = (*create_sentence(OUTPUT_DIR, key[0], key[1], num_frames), num_frames)
+          remaining[key] = num_frames
+          for function, start, task_args in pack_tasks(sources, num_frames, chunk_frames, normalize, read_ahead, read_ahead_bytes, stats):
+            future = executor.submit(function, outputs[key][0], start, *task_args)
+            pending[future] = key
+
+        for future in as_completed(pending):
+          key = pending[future]
+          if key in failures:
+            continue
+          try:
+            num_rows, chunk_stats = future.result()
+            remaining[key] -= num_rows
+            merge_chunk_stats(sentence_stats, key, chunk_stats)
+          except Exception as e:
+            failures[key] = e
+            print(f"Failed {key[0]}/{key[1]}: {e}")
+            # no point in extracting the rest of a failed scenario
+            for other, other_key in pending.items():
+              if other_key == key:
+                other.cancel()
+            continue
+          if remaining[key] == 0:
+            finish_sentence(*outputs[key])
+            if stats:
+              save_sentence_stats(OUTPUT_DIR, os.path.basename(outputs[key][1]), sentence_stats.pop(key))
+            else:
+              discard_sentence_stats(OUTPUT_DIR, os.path.basename(outputs[key][1]))
+            manifest.record("pack", f"{key[0]}/{key[1]}", fingerprints[key], params, outputs[key][1])
+            manifest.commit()
+            record_sentence(index, key[0], key[1], outputs[key][1])
+
+      # workers are done with the files of the failed scenarios now
+      for key in failures:
+        remove_sentence(outputs[key][0])
+
+    if stats:
+      # a subject is merged again when one of its sentences was packed, or when it has no statistics yet
+      packed_subjects = {date_subject for (date_subject, scenario_id), _, _ in sentences if (date_subject, scenario_id) not in failures}
+      for date_subject in subjects_seen:
+        if date_subject not in packed_subjects and os.path.exists(subject_stats_path(OUTPUT_DIR, date_subject)):
+          continue
+        names = [name for name in os.listdir(OUTPUT_DIR) if name.endswith(".npy") and split_sentence_name(name)[0] == date_subject]
+        if names:
+          with metrics.span("vertex_stats", items=len(names), subject=date_subject):
+            subject_stats = merge_subject_stats(OUTPUT_DIR, date_subject, names)
+          print(f"Saved the statistics of {subject_stats.count} frames of {date_subject} to {subject_stats_path(OUTPUT_DIR, date_subject)}")
 
+    if compress:
+      packed = [f"{date_subject}_{scenario_id}.npy" for (date_subject, scenario_id), _, _ in sentences if (date_subject, scenario_id) not in failures]
+      headers, compress_failures = vertex_store.compress_sentences(OUTPUT_DIR, os.path.join(BASE_DATA_PATH, vertex_store.STORE_DIR), subjects,
+                                                                   packed, compress, compress_tolerance, compress_components)
+      for name, header in headers.items():
+        date_subject, scenario_id = split_sentence_name(name)
+        index.set_stage(date_subject, int(scenario_id), "compress", detail=json.dumps({"mode": header["mode"], "max_error": header["max_error"]}))
+      for name, e in compress_failures.items():
+        date_subject, scenario_id = split_sentence_name(name)
+        index.set_stage(date_subject, int(scenario_id), "compress", "failed", str(e))
+        failures[(date_subject, scenario_id)] = e
+
+    if failures:
+      print(f"{len(failures)} of {len(sentences)} scenarios failed:")
+      for (date_subject, scenario_id), e in failures.items():
+        print(f"  {date_subject}/{scenario_id}: {e}")
+        if f"{date_subject}_{scenario_id}.npy" not in compress_failures:
+          index.set_stage(date_subject, int(scenario_id), "pack", "failed", str(e))
+
+  metrics.record("sentence_packing", time.perf_counter() - started, items=sum(num_frames for _, _, num_frames in sentences),
+                 scenarios=len(sentences), failed=len(failures), workers=workers, source=source)
   print("3-preformer: sentence-packing end")
+  return failures
 
 def main():
-  BASE_DATA_PATH = '/data6/leoho/vasilisa'
-  do_sentence_packing(BASE_DATA_PATH)
+  parser = argparse.ArgumentParser(description="Pack normalized OBJ sequences into one .npy per sentence")
+  parser.add_argument("--base_data_path", type=str, help="Dataset root containing normalized/", default='/data6/leoho/vasilisa')
+  parser.add_argument("--subjects", type=str, nargs="*", help="Subjects to pack, all subjects by default", default=None)
+  parser.add_argument("--start_scenario", type=int, help="First scenario id to pack", default=0)
+  parser.add_argument("--end_scenario", type=int, help="Last scenario id to pack, -1 for no limit", default=-1)
+  parser.add_argument("--workers", type=int, help="Number of worker processes, more than 1 packs the chunks of the scenarios in parallel", default=1)
+  parser.add_argument("--chunk_frames", type=int, help="Frames per worker task", default=64)
+  parser.add_argument("--read_ahead", type=int, help="OBJs read ahead on threads by every task, 0 to read them one by one", default=READ_AHEAD)
+  parser.add_argument("--read_ahead_mb", type=float, help="Memory the OBJs read ahead by a task may hold", default=READ_AHEAD_BYTES >> 20)
+  parser.add_argument("--force", action="store_true", help="Pack every scenario, even the ones the manifest has as up to date")
+  parser.add_argument("--content_hash", action="store_true", help="Detect changed frames by content hash instead of size and mtime")
+  parser.add_argument("--take_index", type=str, help="Take index file shared by the pipeline scripts", default=DEFAULT_INDEX_PATH)
+  parser.add_argument("--rescan", action="store_true", help="List the dataset folders even when the take index has them as unchanged")
+  parser.add_argument("--source", type=str, choices=["normalized", "raw"], help="Pack normalized/ or normalize raw/ on the fly", default="normalized")
+  parser.add_argument("--metrics", type=str, help="JSONL file the timing spans are appended to, PIPELINE_METRICS by default", default=None)
+  parser.add_argument("--skip_stats", action="store_true", help="Don't accumulate the per-subject vertex statistics while packing")
+  parser.add_argument("--compress", type=str, choices=vertex_store.MODES, help="Also encode the packed sentences into the int16 store of vertex_store.py", default=None)
+  parser.add_argument("--compress_tolerance", type=float, help="Largest coordinate error of a compressed sentence, in normalized units", default=1e-4)
+  parser.add_argument("--compress_components", type=int, help="Components of the PCA basis of a subject", default=128)
+  args = parser.parse_args()
+
+  metrics.configure(args.metrics)
+
+  failures = do_sentence_packing(args.base_data_path, subjects=args.subjects, start_scenario=args.start_scenario,
+                                 end_scenario=args.end_scenario, workers=args.workers, chunk_frames=args.chunk_frames,
+                                 source=args.source, force=args.force, content_hash=args.content_hash,
+                                 index_path=args.take_index, rescan=args.rescan, compress=args.compress,
+                                 compress_tolerance=args.compress_tolerance, compress_components=args.compress_components,
+                                 read_ahead=args.read_ahead, read_ahead_mb=args.read_ahead_mb, stats=not args.skip_stats)
+  if failures:
+    sys.exit(1)
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
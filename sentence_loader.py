@@ -0,0 +1,228 @@
+"""
+Random access to the packed sentences of sentence-packing.py without loading them.
+
+Every {date_subject}_{scenario_id}.npy of a sentence folder is memory-mapped on first use, and a
+global frame index runs over all of them in file name order. Frames, sentences, fixed-length windows
+and batches of frames are served as views of the mapped files, nothing is copied until a caller
+gathers a batch into its own buffer.
+
+The shape and data offset of every file are kept in an index file in the sentence folder. A file is
+only opened again when its size or mtime changed, so opening a large dataset doesn't read every file
+header again.
+
+With trim_index the frames of every sentence are limited to its active range in the trim index of
+trim-sentences.py, still as views of the untrimmed files.
+
+  loader = SentenceLoader("/data6/leoho/vasilisa/vertices_npy_untrimmed")
+  frames = loader.window(loader.window_starts(32)[0], 32)        # (32, 72147) view
+  batch = loader.gather(loader.random_frames(256))               # (256, 72147) copy
+"""
+import os
+import json
+
+import numpy as np
+
+from trimming import read_trim_index
+
+UNTRIMMED_DIR = "vertices_npy_untrimmed"
+INDEX_FILE = "sentences_index.json"
+INDEX_VERSION = 1
+
+
+def split_sentence_name(name):
+    # {date_subject}_{scenario_id}.npy, the subject can have underscores itself
+    date_subject, _, scenario_id = os.path.splitext(name)[0].rpartition("_")
+    return date_subject, scenario_id
+
+
+def read_npy_layout(path):
+    """
+    Shape, dtype, Fortran order and data offset of a .npy file, read from its header only.
+    """
+    with open(path, "rb") as file:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        return {"shape": list(shape), "dtype": dtype.str, "fortran_order": fortran_order, "offset": file.tell()}
+
+
+class SentenceLoader:
+    """
+    Global frame index over the packed sentences of a folder, see the module docstring.
+    subjects limits the index to these subjects. use_index=False neither reads nor writes the index file.
+    trim_index is True for the trim index in the folder or the path of one, every sentence has to be
+    in it with its current size and mtime.
+    """
+
+    def __init__(self, path, subjects=None, use_index=True, trim_index=None):
+        self.path = path
+        layouts = self._layouts(use_index)
+        self.names = [name for name in sorted(layouts) if subjects is None or split_sentence_name(name)[0] in subjects]
+        self.layouts = [layouts[name] for name in self.names]
+        # single-frame sentences are packed without their frame axis
+        self.file_lengths = np.array([layout["shape"][0] if len(layout["shape"]) == 2 else 1 for layout in self.layouts], dtype=np.int64)
+        # first row of every sentence in its file, the rows before are trimmed away
+        self.starts = np.zeros(len(self.names), dtype=np.int64)
+        self.lengths = self.file_lengths.copy()
+        if trim_index:
+            ranges, _ = read_trim_index(path if trim_index is True else trim_index)
+            for sentence, (name, layout) in enumerate(zip(self.names, self.layouts)):
+                if name not in ranges or ranges[name]["fingerprint"] != layout["fingerprint"]:
+                    raise ValueError(f"The trim index has no current range of {name}, run trim-sentences.py first")
+                self.starts[sentence] = ranges[name]["start"]
+                self.lengths[sentence] = ranges[name]["end"] - ranges[name]["start"]
+        # offsets[k] is the global number of the first frame of sentence k, offsets[-1] the number of frames
+        self.offsets = np.zeros(len(self.names) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=self.offsets[1:])
+        self.frame_size = int(self.layouts[0]["shape"][-1]) if self.layouts else 0
+        self._maps = {}
+
+    def _layouts(self, use_index):
+        """
+        {file name: npy layout} of the sentence files, from the index file where it is still current.
+        """
+        index_path = os.path.join(self.path, INDEX_FILE)
+        cached = {}
+        if use_index and os.path.exists(index_path):
+            try:
+                with open(index_path, "r") as file:
+                    data = json.load(file)
+                if data.get("version") == INDEX_VERSION:
+                    cached = data["sentences"]
+            except (OSError, ValueError, KeyError):
+                cached = {}
+
+        layouts = {}
+        changed = False
+        for entry in os.scandir(self.path):
+            # sentences still being packed are .npy.tmp
+            if not entry.name.endswith(".npy") or not entry.is_file():
+                continue
+            fingerprint = f"{entry.stat().st_size}:{entry.stat().st_mtime_ns}"
+            layout = cached.get(entry.name)
+            if layout is None or layout["fingerprint"] != fingerprint:
+                layout = dict(read_npy_layout(entry.path), fingerprint=fingerprint)
+                changed = True
+            layouts[entry.name] = layout
+        changed |= len(layouts) != len(cached)
+
+        if use_index and changed:
+            try:
+                with open(index_path + ".tmp", "w") as file:
+                    json.dump({"version": INDEX_VERSION, "sentences": layouts}, file)
+                os.replace(index_path + ".tmp", index_path)
+            except OSError:
+                # a read-only dataset is read without the index
+                pass
+        return layouts
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def num_sentences(self):
+        return len(self.names)
+
+    def sentence_key(self, sentence):
+        return split_sentence_name(self.names[sentence])
+
+    def sentence(self, sentence):
+        """
+        The (frames, frame_size) memory-mapped frames of sentence number sentence.
+        """
+        array = self._maps.get(sentence)
+        if array is None:
+            layout = self.layouts[sentence]
+            array = np.memmap(os.path.join(self.path, self.names[sentence]), dtype=np.dtype(layout["dtype"]), mode="r",
+                              offset=layout["offset"], shape=tuple(layout["shape"]), order="F" if layout["fortran_order"] else "C")
+            start = int(self.starts[sentence])
+            array = array.reshape(int(self.file_lengths[sentence]), -1)[start:start + int(self.lengths[sentence])]
+            self._maps[sentence] = array
+        return array
+
+    def locate(self, frames):
+        """
+        (sentence numbers, rows) of global frame numbers, for a single frame or an array of them.
+        """
+        frames = np.asarray(frames, dtype=np.int64)
+        if frames.size and (frames.min() < 0 or frames.max() >= len(self)):
+            raise IndexError(f"frame numbers out of range 0-{len(self) - 1}")
+        sentences = np.searchsorted(self.offsets, frames, side="right") - 1
+        return sentences, frames - self.offsets[sentences]
+
+    def frame(self, frame):
+        sentence, row = self.locate(frame)
+        return self.sentence(int(sentence))[int(row)]
+
+    def __getitem__(self, frame):
+        return self.frame(frame)
+
+    def window(self, start, length):
+        """
+        View of length consecutive frames from global frame start, they have to be in one sentence.
+        """
+        sentence, row = self.locate(start)
+        sentence, row = int(sentence), int(row)
+        if row + length > self.lengths[sentence]:
+            raise IndexError(f"window of {length} frames from frame {start} runs past the end of {self.names[sentence]}")
+        return self.sentence(sentence)[row:row + length]
+
+    def window_starts(self, length, stride=1):
+        """
+        Global start frames of every window of length frames that fits in one sentence, every stride frames.
+        """
+        counts = np.maximum(self.lengths - length, -1) // stride + 1
+        if not counts.sum():
+            return np.empty(0, dtype=np.int64)
+        # start frame of the sentence plus stride times the window number within it
+        sentence_of_window = np.repeat(np.arange(len(self.names)), counts)
+        first_window = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=first_window[1:])
+        within = np.arange(counts.sum()) - first_window[sentence_of_window]
+        return self.offsets[sentence_of_window] + within * stride
+
+    def windows(self, starts, length):
+        """
+        Views of the windows of length frames at the given start frames.
+        """
+        return [self.window(start, length) for start in starts]
+
+    def random_frames(self, batch_size, rng=None):
+        rng = rng if rng is not None else np.random.default_rng()
+        return rng.integers(0, len(self), size=batch_size)
+
+    def batch(self, frames):
+        """
+        Views of the given global frames, one per frame.
+        """
+        sentences, rows = self.locate(frames)
+        return [self.sentence(int(sentence))[int(row)] for sentence, row in zip(sentences, rows)]
+
+    def gather(self, frames, out=None):
+        """
+        Copy the given global frames into out (a new (len(frames), frame_size) array by default),
+        reading the frames of every sentence with one fancy index.
+        """
+        frames = np.asarray(frames, dtype=np.int64)
+        sentences, rows = self.locate(frames)
+        if out is None:
+            dtype = np.dtype(self.layouts[0]["dtype"]) if self.layouts else np.float32
+            out = np.empty((len(frames), self.frame_size), dtype=dtype)
+        order = np.argsort(sentences, kind="stable")
+        boundaries = np.flatnonzero(np.diff(sentences[order])) + 1
+        for group in np.split(order, boundaries):
+            if len(group):
+                out[group] = self.sentence(int(sentences[group[0]]))[rows[group]]
+        return out
+
+    def close(self):
+        # the maps are released once no view of them is left
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
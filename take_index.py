@@ -0,0 +1,269 @@
+"""
+Dataset-wide take index shared by the pipeline scripts.
+
+One local sqlite file holds every take of every subject with its frame and control counts, the paths
+of the artifacts each stage produced and the status of every stage. Stages update it as they finish,
+so the next script can query it instead of listing folders and re-reading take.json / face anim files
+on the network storage. The listings of the dataset folders are kept too, with the mtime of the
+folder they were taken at, so a folder is only listed again once something was added, removed or
+renamed in it.
+
+The file defaults to ~/metahuman_takes.sqlite, set TAKE_INDEX to use another one.
+
+  python take_index.py [--subject NAME]    # print the takes and their stage status
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+from collections import namedtuple
+
+DEFAULT_INDEX_PATH = os.environ.get("TAKE_INDEX", os.path.join(os.path.expanduser("~"), "metahuman_takes.sqlite"))
+
+# stages UE_PerformanceToSequence.py runs for every take, in order
+UE_STAGES = ["performance", "anim_sequence", "level_sequence", "bake", "face_anim_export"]
+
+# a folder changed less than this many seconds ago isn't cached, an entry added within the same
+# mtime tick as the listing wouldn't change its mtime
+RECENT_SECONDS = 2.0
+
+# frames comes from take.json, key_frames is the number of keyed frames of the face anim export
+Take = namedtuple("Take", ["subject", "take", "name", "path", "frames", "key_frames", "controls", "updated"])
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS takes ("
+    "subject TEXT NOT NULL, take INTEGER NOT NULL, name TEXT, path TEXT, frames INTEGER, key_frames INTEGER, controls INTEGER, "
+    "updated REAL NOT NULL, PRIMARY KEY (subject, take))",
+    "CREATE TABLE IF NOT EXISTS artifacts ("
+    "subject TEXT NOT NULL, take INTEGER NOT NULL, kind TEXT NOT NULL, path TEXT NOT NULL, lookup TEXT NOT NULL, "
+    "updated REAL NOT NULL, PRIMARY KEY (subject, take, kind))",
+    "CREATE INDEX IF NOT EXISTS artifacts_by_lookup ON artifacts (lookup)",
+    "CREATE TABLE IF NOT EXISTS stages ("
+    "subject TEXT NOT NULL, take INTEGER NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL, detail TEXT, "
+    "updated REAL NOT NULL, PRIMARY KEY (subject, take, stage))",
+    "CREATE TABLE IF NOT EXISTS folders ("
+    "lookup TEXT NOT NULL PRIMARY KEY, path TEXT NOT NULL, mtime_ns INTEGER NOT NULL, entries TEXT NOT NULL, updated REAL NOT NULL)",
+]
+
+
+def lookup_path(path):
+    # artifacts are found back by their normalized file path
+    return os.path.normcase(os.path.abspath(path))
+
+
+class TakeIndex:
+    """
+    Takes, artifacts and per-stage status of the dataset, see the module docstring.
+    Every update is committed right away so concurrent scripts see each other's progress.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        for statement in _SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def update_take(self, subject, take, name=None, path=None, frames=None, key_frames=None, controls=None):
+        """
+        Add a take or update the given fields of an existing one.
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO takes (subject, take, updated) VALUES (?, ?, ?)", (subject, take, time.time()))
+            fields = {"name": name, "path": path, "frames": frames, "key_frames": key_frames, "controls": controls}
+            for field, value in fields.items():
+                if value is not None:
+                    self.connection.execute(
+                        f"UPDATE takes SET {field} = ?, updated = ? WHERE subject = ? AND take = ?",
+                        (value, time.time(), subject, take))
+
+    def take(self, subject, take):
+        row = self.connection.execute(
+            "SELECT * FROM takes WHERE subject = ? AND take = ?", (subject, take)).fetchone()
+        return Take(*row) if row else None
+
+    def takes(self, subject, start=None, end=None):
+        """
+        Takes of a subject ordered by take number, optionally limited to [start, end].
+        """
+        query = "SELECT * FROM takes WHERE subject = ?"
+        params = [subject]
+        if start is not None:
+            query += " AND take >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND take <= ?"
+            params.append(end)
+        return [Take(*row) for row in self.connection.execute(query + " ORDER BY take", params)]
+
+    def subjects(self):
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT subject FROM takes ORDER BY subject")]
+
+    def set_artifact(self, subject, take, kind, path):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                (subject, take, kind, path, lookup_path(path), time.time()))
+
+    def artifact(self, subject, take, kind):
+        row = self.connection.execute(
+            "SELECT path FROM artifacts WHERE subject = ? AND take = ? AND kind = ?", (subject, take, kind)).fetchone()
+        return row[0] if row else None
+
+    def artifacts(self, subject, kind):
+        """
+        {take: path} of one kind of artifact for every take of a subject.
+        """
+        return dict(self.connection.execute(
+            "SELECT take, path FROM artifacts WHERE subject = ? AND kind = ?", (subject, kind)))
+
+    def find_artifact(self, path, kind=None):
+        """
+        Look up the take that produced an artifact, returns its Take or None.
+        """
+        query = "SELECT subject, take FROM artifacts WHERE lookup = ?"
+        params = [lookup_path(path)]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        row = self.connection.execute(query, params).fetchone()
+        return self.take(*row) if row else None
+
+    def move_artifact(self, old_path, new_path):
+        """
+        Point the artifacts recorded at old_path to new_path after the file was moved.
+        """
+        with self.connection:
+            self.connection.execute(
+                "UPDATE artifacts SET path = ?, lookup = ?, updated = ? WHERE lookup = ?",
+                (new_path, lookup_path(new_path), time.time(), lookup_path(old_path)))
+
+    def set_stage(self, subject, take, stage, status="done", detail=None):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?)",
+                (subject, take, stage, status, detail, time.time()))
+
+    def stage_status(self, subject, take, stage):
+        row = self.connection.execute(
+            "SELECT status FROM stages WHERE subject = ? AND take = ? AND stage = ?", (subject, take, stage)).fetchone()
+        return row[0] if row else None
+
+    def stage_detail(self, subject, take, stage):
+        row = self.connection.execute(
+            "SELECT detail FROM stages WHERE subject = ? AND take = ? AND stage = ?", (subject, take, stage)).fetchone()
+        return row[0] if row else None
+
+    def stages(self, subject, take):
+        """
+        {stage: status} of a take.
+        """
+        return dict(self.connection.execute(
+            "SELECT stage, status FROM stages WHERE subject = ? AND take = ?", (subject, take)))
+
+    def resume_stage(self, subject, take, stages):
+        """
+        First of the ordered stages that isn't done for a take, None when they all are.
+        """
+        status = self.stages(subject, take)
+        return next((stage for stage in stages if status.get(stage) != "done"), None)
+
+    def set_listing(self, path, mtime_ns, entries):
+        """
+        Record the {name: is_folder} entries of a folder, listed when its mtime was mtime_ns.
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?)",
+                (lookup_path(path), path, mtime_ns, json.dumps(entries), time.time()))
+
+    def listing(self, path, mtime_ns):
+        """
+        {name: is_folder} entries recorded for a folder, None when it wasn't listed at mtime_ns.
+        """
+        row = self.connection.execute(
+            "SELECT entries FROM folders WHERE lookup = ? AND mtime_ns = ?", (lookup_path(path), mtime_ns)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def list_folder(index, folder, rescan=False, folders_only=False):
+    """
+    Sorted names of the entries of folder, only its subfolders with folders_only. The listing comes
+    from the index while the mtime of folder is the one it was recorded at, so an unchanged folder
+    costs a stat instead of a listing on the network storage. rescan lists it anyway, for storage
+    that doesn't update the mtime of its folders.
+    """
+    mtime_ns = os.stat(folder).st_mtime_ns
+    entries = None if rescan else index.listing(folder, mtime_ns)
+    if entries is None:
+        with os.scandir(folder) as scan:
+            entries = {entry.name: entry.is_dir() for entry in scan}
+        if time.time() - mtime_ns / 1e9 > RECENT_SECONDS:
+            index.set_listing(folder, mtime_ns, entries)
+    return sorted(name for name, is_folder in entries.items() if is_folder or not folders_only)
+
+
+def folder_takes(index, subject, folder, kind, rescan=False):
+    """
+    Numbered take folders of a subject under folder (raw/<subject>, normalized/<subject>, ...) as
+    [(take, path)] ordered by take, see list_folder for when the folder is listed again.
+    The folders the index doesn't know yet are registered as kind artifacts, the ones that aren't
+    numbered can't be a take of the index and are reported and skipped.
+    """
+    known = index.artifacts(subject, kind)
+    takes = []
+    for name in list_folder(index, folder, rescan, folders_only=True):
+        path = os.path.join(folder, name)
+        if not name.isdigit():
+            print(f"Skipping {path}, it isn't a numbered take folder")
+            continue
+        if known.get(int(name)) != path:
+            index.update_take(subject, int(name), name=name)
+            index.set_artifact(subject, int(name), kind, path)
+        takes.append((int(name), path))
+    return sorted(takes)
+
+
+def index_captures(index, subject, path, rescan=False):
+    """
+    Register the capture folders (<name>_<take>) of a raw data path as takes with the frame count of
+    their take.json. Only the folders the index doesn't know yet have their take.json read, see
+    list_folder for when the raw data path is listed again.
+    """
+    known = {take.path for take in index.takes(subject)}
+    for capture in list_folder(index, path, rescan, folders_only=True):
+        capture_path = os.path.join(path, capture)
+        if capture_path in known:
+            continue
+        with open(os.path.join(capture_path, "take.json"), "r") as file:
+            data = json.load(file)
+        index.update_take(subject, int(capture.split("_")[-1]), name=capture, path=capture_path, frames=data["frames"])
+        index.set_artifact(subject, int(capture.split("_")[-1]), "capture", capture_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the dataset take index")
+    parser.add_argument("--index", type=str, help="Take index file", default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--subject", type=str, help="Only show this subject", default=None)
+    args = parser.parse_args()
+
+    with TakeIndex(args.index) as index:
+        for subject in [args.subject] if args.subject else index.subjects():
+            for take in index.takes(subject):
+                stages = ", ".join(f"{stage}={status}" for stage, status in sorted(index.stages(subject, take.take).items()))
+                print(f"{subject} {take.take:5d} frames={take.frames} key_frames={take.key_frames} controls={take.controls} {stages}")
+
+
+if __name__ == "__main__":
+    main()
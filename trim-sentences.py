@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import argparse
+
+from sentence_loader import SentenceLoader, UNTRIMMED_DIR, split_sentence_name
+from trimming import METRICS, load_neutral, frame_displacement, active_range, read_trim_index, write_trim_index
+from take_index import TakeIndex, DEFAULT_INDEX_PATH
+import metrics
+
+
+def trim_sentences(BASE_DATA_PATH, subjects=None, neutral=None, metric="max", threshold=0.0, relative_threshold=0.05,
+                   min_active=3, padding=5, force=False, index_path=DEFAULT_INDEX_PATH):
+  """
+  Find the active range of every packed sentence in vertices_npy_untrimmed and write them to its trim
+  index, the sentences themselves are not touched (see trimming.py).
+  neutral is the neutral mesh (.npy or .obj) the displacement is measured from, {subject} in it is
+  replaced by the subject, the first frame of every sentence by default.
+  A sentence whose file and parameters are unchanged since the last run keeps its range, unless force is set.
+  Changed parameters trim every sentence again, so they can't be combined with subjects while the
+  trim index has ranges of other subjects.
+  Returns the ranges by sentence file name.
+  """
+  print("trim-sentences start")
+  sentence_dir = os.path.join(BASE_DATA_PATH, UNTRIMMED_DIR)
+  params = {"neutral": neutral, "metric": metric, "threshold": threshold, "relative_threshold": relative_threshold,
+            "min_active": min_active, "padding": padding}
+  loader = SentenceLoader(sentence_dir, subjects)
+  ranges, previous_params = read_trim_index(sentence_dir)
+  if previous_params != params:
+    # the trim index holds the ranges of every subject for one set of parameters
+    others = sorted({split_sentence_name(name)[0] for name in ranges} - set(subjects)) if subjects else []
+    if others:
+      raise Exception(f"The parameters differ from the ones the trim index was written with, trimming only {subjects} "
+                      f"would drop the ranges of {others}, run without --subjects")
+    ranges = {}
+  # sentences that were removed since are dropped from the index
+  ranges = {name: ranges[name] for name in ranges if os.path.exists(os.path.join(sentence_dir, name))}
+  neutrals = {}
+  kept = total = 0
+
+  with TakeIndex(index_path) as index:
+    for sentence, name in enumerate(loader.names):
+      date_subject, scenario_id = split_sentence_name(name)
+      fingerprint = loader.layouts[sentence]["fingerprint"]
+      if not force and name in ranges and ranges[name]["fingerprint"] == fingerprint:
+        kept += ranges[name]["end"] - ranges[name]["start"]
+        total += ranges[name]["frames"]
+        continue
+      if neutral and date_subject not in neutrals:
+        neutrals[date_subject] = load_neutral(neutral.replace("{subject}", date_subject))
+      frames = loader.sentence(sentence)
+      with metrics.span("trim_sentence", items=len(frames), subject=date_subject, scenario=scenario_id):
+        displacement = frame_displacement(frames, neutrals.get(date_subject), metric)
+        start, end = active_range(displacement, threshold, relative_threshold, min_active, padding)
+      ranges[name] = {"start": start, "end": end, "frames": len(frames), "fingerprint": fingerprint,
+                      "peak": round(float(displacement.max()), 6)}
+      kept += end - start
+      total += len(frames)
+      print(f"Trimmed {name}: frames {start}-{end} of {len(frames)}")
+      if scenario_id.isdigit():
+        index.set_stage(date_subject, int(scenario_id), "trim", detail=json.dumps({"start": start, "end": end}))
+
+  write_trim_index(sentence_dir, ranges, params)
+  if total:
+    print(f"Kept {kept} of {total} frames ({100.0 * (total - kept) / total:.1f}% rest pose trimmed)")
+  print("trim-sentences end")
+  return ranges
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Find the active frame range of every packed sentence")
+  parser.add_argument("--base_data_path", type=str, help="Dataset root containing vertices_npy_untrimmed/", default='/data6/leoho/vasilisa')
+  parser.add_argument("--subjects", type=str, nargs="*", help="Subjects to trim, all subjects by default", default=None)
+  parser.add_argument("--neutral", type=str, help="Neutral mesh (.npy or .obj) to measure from, {subject} is replaced by the subject, the first frame by default", default=None)
+  parser.add_argument("--metric", type=str, choices=METRICS, help="Displacement of a frame, the max or mean vertex distance", default="max")
+  parser.add_argument("--threshold", type=float, help="Displacement above which a frame is active, in normalized units", default=0.0)
+  parser.add_argument("--relative_threshold", type=float, help="Displacement above which a frame is active, as a part of the peak of the sentence", default=0.05)
+  parser.add_argument("--min_active", type=int, help="Consecutive active frames needed to start or end the active range", default=3)
+  parser.add_argument("--padding", type=int, help="Rest pose frames kept on both sides of the active range", default=5)
+  parser.add_argument("--force", action="store_true", help="Trim every sentence, even the ones the trim index has as up to date")
+  parser.add_argument("--take_index", type=str, help="Take index file shared by the pipeline scripts", default=DEFAULT_INDEX_PATH)
+  parser.add_argument("--metrics", type=str, help="JSONL file the timing spans are appended to, PIPELINE_METRICS by default", default=None)
+  args = parser.parse_args()
+
+  metrics.configure(args.metrics)
+  ranges = trim_sentences(args.base_data_path, subjects=args.subjects, neutral=args.neutral, metric=args.metric,
+                          threshold=args.threshold, relative_threshold=args.relative_threshold, min_active=args.min_active,
+                          padding=args.padding, force=args.force, index_path=args.take_index)
+  if not ranges:
+    print("No sentences to trim")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,104 @@
+"""
+Rest-pose trimming of packed sentences.
+
+Every frame of a sentence gets its displacement from a reference mesh, the first frame of the
+sentence or a neutral mesh of the subject: the largest (or mean) distance of its vertices to the
+reference. The active range of the sentence runs from the first to the last frame above the
+threshold. The sentences are not rewritten, the ranges go into a small trim index next to them
+and SentenceLoader(trim_index=...) serves the trimmed frames as views of the untrimmed files.
+"""
+import os
+import json
+
+import numpy as np
+
+from mesh_io import read_obj_vertices
+
+TRIM_INDEX_FILE = "trim_index.json"
+TRIM_INDEX_VERSION = 1
+METRICS = ("max", "mean")
+
+
+def load_neutral(path):
+    """
+    Neutral mesh as a (num_vertices * 3,) float32 array, from a .npy of one frame or an OBJ.
+    """
+    if path.endswith(".npy"):
+        return np.load(path).astype(np.float32).reshape(-1)
+    return read_obj_vertices(path).reshape(-1)
+
+
+def frame_displacement(frames, reference=None, metric="max", chunk_frames=32):
+    """
+    Displacement of every frame of a (num_frames, num_vertices * 3) array from reference, the
+    first frame by default: the max or mean distance of the vertices, as a float32 (num_frames,) array.
+    The frames are read chunk_frames at a time so a memory-mapped sentence is never loaded whole.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"metric has to be one of {METRICS}, not {metric}")
+    frames = frames.reshape(len(frames), -1)
+    reference = np.asarray(frames[0] if reference is None else reference, dtype=np.float32).reshape(1, -1, 3)
+    displacement = np.empty(len(frames), dtype=np.float32)
+    for start in range(0, len(frames), chunk_frames):
+        chunk = np.asarray(frames[start:start + chunk_frames], dtype=np.float32).reshape(-1, reference.shape[1], 3)
+        offsets = chunk - reference
+        np.square(offsets, out=offsets)
+        # adding the coordinate planes is much faster than a reduction over the last axis of 3
+        squared = offsets[:, :, 0] + offsets[:, :, 1]
+        squared += offsets[:, :, 2]
+        if metric == "max":
+            # the largest squared distance is the one of the largest distance
+            displacement[start:start + len(chunk)] = np.sqrt(squared.max(axis=1))
+        else:
+            displacement[start:start + len(chunk)] = np.sqrt(squared, out=squared).mean(axis=1)
+    return displacement
+
+
+def active_range(displacement, threshold=0.0, relative_threshold=0.0, min_active=1, padding=0):
+    """
+    [start, end) of the frames from the first to the last run of min_active frames whose displacement
+    is above the threshold, the larger of threshold and relative_threshold times the peak
+    displacement. padding frames of rest pose are kept on both sides. (0, 0) when no frame is active.
+    """
+    num_frames = len(displacement)
+    if not num_frames:
+        return 0, 0
+    limit = max(threshold, relative_threshold * float(displacement.max()))
+    active = displacement > limit
+    if min_active > 1:
+        # a frame starts a run when the min_active frames from it are all active
+        runs = np.convolve(active.astype(np.int32), np.ones(min_active, dtype=np.int32), mode="valid") >= min_active
+        run_starts = np.flatnonzero(runs)
+        if not len(run_starts):
+            return 0, 0
+        start, end = run_starts[0], run_starts[-1] + min_active
+    else:
+        active_frames = np.flatnonzero(active)
+        if not len(active_frames):
+            return 0, 0
+        start, end = active_frames[0], active_frames[-1] + 1
+    return int(max(0, start - padding)), int(min(num_frames, end + padding))
+
+
+def read_trim_index(path):
+    """
+    {sentence file name: {"start", "end", "frames", "fingerprint"}} and the parameters of a trim index,
+    path is the file or the sentence folder it is in.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, TRIM_INDEX_FILE)
+    if not os.path.exists(path):
+        return {}, None
+    with open(path, "r") as file:
+        data = json.load(file)
+    if data.get("version") != TRIM_INDEX_VERSION:
+        return {}, None
+    return data["sentences"], data["params"]
+
+
+def write_trim_index(path, ranges, params):
+    if os.path.isdir(path):
+        path = os.path.join(path, TRIM_INDEX_FILE)
+    with open(path + ".tmp", "w") as file:
+        json.dump({"version": TRIM_INDEX_VERSION, "params": params, "sentences": ranges}, file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,221 @@
+"""
+Per-vertex statistics of packed sentences, accumulated while do_sentence_packing writes the frames.
+
+VertexStats holds the frame count, mean, sum of squared deviations (M2), min and max of every vertex
+coordinate and the neutral, the first frame of the first sentence. Frames are added a chunk at a
+time and two VertexStats merge with the pairwise update of Chan et al., so the chunks packed by
+the worker processes, the sentences of a subject and the shards of a dataset packed on different
+machines all combine into the same statistics a single pass over every frame would give.
+
+  <sentences>/stats/<date_subject>_<scenario_id>.npz    the statistics of one sentence
+  <sentences>/stats/<date_subject>.npz                  the statistics of a subject, merged from its sentences
+
+The statistics of a sentence carry the fingerprint of its .npy, they are computed again when the
+sentence was packed again since.
+
+  python vertex_stats.py merge merged.npz shard_1/stats/20240101_S01.npz shard_2/stats/20240101_S01.npz
+  python vertex_stats.py show /data6/leoho/vasilisa/vertices_npy_untrimmed/stats/20240101_S01.npz
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from manifest import file_fingerprint
+from sentence_loader import split_sentence_name
+
+STATS_DIR = "stats"
+
+
+class VertexStats:
+    """
+    Mergeable statistics of (frames, frame_size) float32 frames. Means and M2 are float64, min and
+    max float32. The neutral is the first frame of the frames whose neutral_key sorts first,
+    neutral_key is the sentence_key of the frames of a sentence. fingerprint is the file_fingerprint
+    of the .npy of a sentence its statistics were computed from.
+    """
+
+    def __init__(self, frame_size):
+        self.count = 0
+        self.mean = np.zeros(frame_size, dtype=np.float64)
+        self.m2 = np.zeros(frame_size, dtype=np.float64)
+        self.min = np.full(frame_size, np.inf, dtype=np.float32)
+        self.max = np.full(frame_size, -np.inf, dtype=np.float32)
+        self.neutral = None
+        self.neutral_key = None
+        self.sentences = []
+        self.fingerprint = None
+
+    @classmethod
+    def from_frames(cls, frames, neutral_key=None):
+        frames = np.asarray(frames).reshape(len(frames), -1)
+        stats = cls(frames.shape[1])
+        stats.add(frames, neutral_key)
+        return stats
+
+    def add(self, frames, neutral_key=None):
+        """
+        Add a (frames, frame_size) chunk, neutral_key is the key of its first frame.
+        """
+        frames = np.asarray(frames).reshape(len(frames), -1)
+        if not len(frames):
+            return self
+        chunk = VertexStats(frames.shape[1])
+        chunk.count = len(frames)
+        chunk.mean = frames.mean(axis=0, dtype=np.float64)
+        deviations = frames - chunk.mean
+        chunk.m2 = np.einsum("ij,ij->j", deviations, deviations)
+        chunk.min = frames.min(axis=0)
+        chunk.max = frames.max(axis=0)
+        if neutral_key is not None:
+            chunk.neutral = np.array(frames[0], dtype=np.float32)
+            chunk.neutral_key = neutral_key
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Add the frames of other, in place. Returns self.
+        """
+        if other.count:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * (self.count * other.count / count)
+            self.mean += delta * (other.count / count)
+            self.count = count
+            np.minimum(self.min, other.min, out=self.min)
+            np.maximum(self.max, other.max, out=self.max)
+        if other.neutral_key is not None and (self.neutral_key is None or tuple(other.neutral_key) < tuple(self.neutral_key)):
+            self.neutral, self.neutral_key = other.neutral, other.neutral_key
+        self.sentences = sorted(set(self.sentences) | set(other.sentences))
+        return self
+
+    @property
+    def variance(self):
+        # population variance of every coordinate
+        return self.m2 / self.count if self.count else np.zeros_like(self.m2)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def save(self, path):
+        header = {"count": self.count, "neutral_key": self.neutral_key, "sentences": self.sentences, "fingerprint": self.fingerprint}
+        neutral = self.neutral if self.neutral is not None else np.empty(0, dtype=np.float32)
+        with open(path + ".tmp", "wb") as file:
+            np.savez(file, mean=self.mean, m2=self.m2, min=self.min, max=self.max, neutral=neutral,
+                     header=np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            stats = cls(len(data["mean"]))
+            stats.count = header["count"]
+            stats.mean, stats.m2, stats.min, stats.max = data["mean"], data["m2"], data["min"], data["max"]
+            stats.neutral = data["neutral"] if len(data["neutral"]) else None
+        stats.neutral_key = tuple(header["neutral_key"]) if header["neutral_key"] is not None else None
+        stats.sentences = header["sentences"]
+        stats.fingerprint = header.get("fingerprint")
+        return stats
+
+
+def sentence_key(name, row):
+    # sentences in take order, <date_subject>_5.npy before <date_subject>_10.npy
+    date_subject, scenario_id = split_sentence_name(name)
+    return (date_subject, int(scenario_id), row)
+
+
+def sentence_stats_path(sentence_dir, name):
+    return os.path.join(sentence_dir, STATS_DIR, os.path.splitext(name)[0] + ".npz")
+
+
+def subject_stats_path(sentence_dir, date_subject):
+    return os.path.join(sentence_dir, STATS_DIR, f"{date_subject}.npz")
+
+
+def sentence_stats(sentence_dir, name, chunk_frames=256):
+    """
+    Statistics of a packed sentence read from its .npy a chunk at a time, for the sentences packed
+    before the statistics were.
+    """
+    frames = np.load(os.path.join(sentence_dir, name), mmap_mode="r")
+    frames = frames.reshape(len(frames) if frames.ndim == 2 else 1, -1)
+    stats = VertexStats(frames.shape[1])
+    for start in range(0, len(frames), chunk_frames):
+        stats.add(frames[start:start + chunk_frames], sentence_key(name, start))
+    stats.sentences = [name]
+    return stats
+
+
+def save_sentence_stats(sentence_dir, name, stats):
+    os.makedirs(os.path.join(sentence_dir, STATS_DIR), exist_ok=True)
+    stats.sentences = [name]
+    stats.fingerprint = file_fingerprint(os.path.join(sentence_dir, name))
+    stats.save(sentence_stats_path(sentence_dir, name))
+
+
+def discard_sentence_stats(sentence_dir, name):
+    """
+    Remove the statistics of a sentence packed again without them, and the subject statistics they
+    were merged into, so the next run with statistics computes both again.
+    """
+    for path in (sentence_stats_path(sentence_dir, name), subject_stats_path(sentence_dir, split_sentence_name(name)[0])):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def merge_subject_stats(sentence_dir, date_subject, names):
+    """
+    Merge the statistics of the sentences names of a subject into its subject statistics. A sentence
+    without its statistics file, or whose .npy changed since, gets it computed from the .npy first.
+    Returns the VertexStats.
+    """
+    merged = None
+    for name in sorted(names):
+        path = sentence_stats_path(sentence_dir, name)
+        stats = VertexStats.load(path) if os.path.exists(path) else None
+        if stats is not None and stats.fingerprint != file_fingerprint(os.path.join(sentence_dir, name)):
+            print(f"{name} changed since its statistics were computed, computing them again")
+            stats = None
+        if stats is None:
+            stats = sentence_stats(sentence_dir, name)
+            save_sentence_stats(sentence_dir, name, stats)
+        merged = stats if merged is None else merged.merge(stats)
+    if merged is not None:
+        merged.save(subject_stats_path(sentence_dir, date_subject))
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-vertex statistics of packed sentences")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge", help="Merge statistics files, of the shards of a dataset")
+    merge_parser.add_argument("output", type=str, help="Merged statistics file")
+    merge_parser.add_argument("inputs", type=str, nargs="+", help="Statistics files to merge")
+    show_parser = subparsers.add_parser("show", help="Print a statistics file")
+    show_parser.add_argument("path", type=str, help="Statistics file")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        merged = VertexStats.load(args.inputs[0])
+        for path in args.inputs[1:]:
+            stats = VertexStats.load(path)
+            overlap = set(merged.sentences) & set(stats.sentences)
+            if overlap:
+                print(f"{path} has sentences that are merged already: {sorted(overlap)[:5]}")
+                sys.exit(1)
+            merged.merge(stats)
+        merged.save(args.output)
+        print(f"Merged {len(args.inputs)} files: {merged.count} frames of {len(merged.sentences)} sentences")
+    else:
+        stats = VertexStats.load(args.path)
+        print(f"{stats.count} frames of {len(stats.sentences)} sentences, {len(stats.mean) // 3} vertices")
+        print(f"mean {stats.mean.min():.4f} .. {stats.mean.max():.4f}, std up to {stats.std.max():.4f}")
+        print(f"bounds {stats.min.min():.4f} .. {stats.max.max():.4f}, neutral from {stats.neutral_key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Compressed store of packed sentences: every frame is stored as its delta from the neutral mesh of
+the subject, quantized to int16 with a float32 scale and offset per column.
+
+Two modes:
+  delta  every vertex coordinate of the delta is quantized, half the size of the float32 sentence
+         (a lot less with zlib, the deltas are quantized as coarsely as the tolerance allows)
+  pca    the deltas are projected on a PCA basis fit on frames of the subject and only the
+         coefficients are quantized, a sentence whose error is above the tolerance falls back to delta
+
+Every sentence records the largest absolute coordinate error of its decoded frames, encoding fails
+when the quantization alone can't stay within the tolerance.
+
+  <store>/<date_subject>_neutral.npy            (frame_size,) float32 neutral mesh
+  <store>/<date_subject>_basis.npy              (components, frame_size) float32 PCA basis, pca mode only
+  <store>/<date_subject>_<scenario_id>.npz      codes, scale, offset and the JSON header of a sentence
+
+  python vertex_store.py compress --base_data_path /data6/leoho/vasilisa --mode pca --tolerance 1e-4
+  python vertex_store.py verify --base_data_path /data6/leoho/vasilisa
+"""
+import os
+import sys
+import json
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from sentence_loader import SentenceLoader, UNTRIMMED_DIR, split_sentence_name
+from trimming import load_neutral
+import metrics
+
+STORE_DIR = "vertices_npz_q16"
+VERSION = 1
+MODES = ("delta", "pca")
+CODE_LIMIT = 32767
+
+# codes (frames, columns) int16, scale and offset (columns,) float32, header dict
+CompressedSentence = namedtuple("CompressedSentence", ["codes", "scale", "offset", "header"])
+
+
+def neutral_path(store_dir, date_subject):
+    return os.path.join(store_dir, f"{date_subject}_neutral.npy")
+
+
+def basis_path(store_dir, date_subject):
+    return os.path.join(store_dir, f"{date_subject}_basis.npy")
+
+
+def quantize(values, step=None, chunk_frames=256):
+    """
+    Quantize the columns of a (frames, columns) array to int16 codes, values ~ codes * scale + offset.
+    The scale of a column is the int16 step over its range, or step when that is coarser.
+    Returns (codes, scale, offset).
+    """
+    low = np.full(values.shape[1], np.inf, dtype=np.float64)
+    high = np.full(values.shape[1], -np.inf, dtype=np.float64)
+    for start in range(0, len(values), chunk_frames):
+        chunk = values[start:start + chunk_frames]
+        np.minimum(low, chunk.min(axis=0), out=low)
+        np.maximum(high, chunk.max(axis=0), out=high)
+    offset = ((low + high) / 2).astype(np.float32)
+    # a constant column gets any non zero scale, all its codes are 0
+    scale = ((high - low) / (2 * CODE_LIMIT)).astype(np.float32)
+    if step:
+        np.maximum(scale, step, out=scale)
+    scale[scale == 0] = 1.0
+    codes = np.empty(values.shape, dtype=np.int16)
+    for start in range(0, len(values), chunk_frames):
+        chunk = (values[start:start + chunk_frames] - offset) / scale
+        codes[start:start + len(chunk)] = np.clip(np.rint(chunk), -CODE_LIMIT, CODE_LIMIT)
+    return codes, scale, offset
+
+
+def decode(sentence, neutral, basis=None, rows=slice(None), out=None):
+    """
+    Decode the frames rows of a CompressedSentence into out, a new (frames, frame_size) float32
+    array by default.
+    """
+    codes = sentence.codes[rows]
+    if sentence.header["mode"] == "pca":
+        coefficients = codes.astype(np.float32)
+        coefficients *= sentence.scale
+        coefficients += sentence.offset
+        out = np.matmul(coefficients, basis, out=out)
+        out += neutral
+        return out
+    if out is None:
+        out = np.empty(codes.shape, dtype=np.float32)
+    np.multiply(codes, sentence.scale, out=out)
+    # offset and neutral are added in one go
+    out += sentence.offset + neutral
+    return out
+
+
+def max_error(frames, sentence, neutral, basis=None, chunk_frames=256):
+    """
+    Largest absolute coordinate difference between frames and the decoded sentence.
+    """
+    error = 0.0
+    for start in range(0, len(frames), chunk_frames):
+        rows = slice(start, start + chunk_frames)
+        decoded = decode(sentence, neutral, basis, rows)
+        decoded -= frames[rows]
+        error = max(error, float(np.abs(decoded).max()))
+    return error
+
+
+def encode(frames, neutral, mode="delta", basis=None, tolerance=None, chunk_frames=256):
+    """
+    Encode the (frames, frame_size) float32 frames of a sentence as a CompressedSentence. In pca
+    mode a sentence with an error above tolerance is encoded in delta mode instead. Raises
+    ValueError when the error of the delta mode is above tolerance too.
+    The deltas are quantized in steps of up to 1.8 times the tolerance, rounding stays below it and
+    the codes of small deltas stay small, which is what zlib compresses.
+    """
+    frames = frames.reshape(len(frames), -1)
+    if mode == "pca":
+        coefficients = np.empty((len(frames), len(basis)), dtype=np.float32)
+        for start in range(0, len(frames), chunk_frames):
+            coefficients[start:start + chunk_frames] = (frames[start:start + chunk_frames] - neutral) @ basis.T
+        sentence = CompressedSentence(*quantize(coefficients), {"mode": "pca", "components": len(basis)})
+        error = max_error(frames, sentence, neutral, basis, chunk_frames)
+        if tolerance is None or error <= tolerance:
+            sentence.header.update(version=VERSION, num_frames=len(frames), frame_size=frames.shape[1], max_error=error, tolerance=tolerance)
+            return sentence
+        mode = "delta"
+    if mode != "delta":
+        raise ValueError(f"mode has to be one of {MODES}, not {mode}")
+
+    deltas = np.empty(frames.shape, dtype=np.float32)
+    for start in range(0, len(frames), chunk_frames):
+        np.subtract(frames[start:start + chunk_frames], neutral, out=deltas[start:start + chunk_frames])
+    step = 1.8 * tolerance if tolerance else None
+    sentence = CompressedSentence(*quantize(deltas, step, chunk_frames), {"mode": "delta", "components": None})
+    del deltas
+    error = max_error(frames, sentence, neutral, None, chunk_frames)
+    if tolerance is not None and error > tolerance:
+        raise ValueError(f"the int16 deltas have an error of {error:.3g}, above the tolerance of {tolerance:.3g}")
+    sentence.header.update(version=VERSION, num_frames=len(frames), frame_size=frames.shape[1], max_error=error, tolerance=tolerance)
+    return sentence
+
+
+def fit_basis(frames, neutral, components):
+    """
+    PCA basis of (components, frame_size) of the deltas of a (samples, frame_size) array of frames
+    from the neutral, through the eigenvectors of the samples x samples Gram matrix.
+    """
+    deltas = np.asarray(frames, dtype=np.float32) - neutral
+    gram = deltas.astype(np.float64) @ deltas.T.astype(np.float64)
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    order = np.argsort(eigenvalues)[::-1][:components]
+    order = order[eigenvalues[order] > eigenvalues.max() * 1e-12] if eigenvalues.max() > 0 else order[:0]
+    basis = (eigenvectors[:, order].T @ deltas.astype(np.float64)) / np.sqrt(eigenvalues[order])[:, None]
+    return basis.astype(np.float32)
+
+
+def write_compressed(path, sentence, compress=False):
+    save = np.savez_compressed if compress else np.savez
+    header = dict(sentence.header, zlib=compress)
+    with open(path + ".tmp", "wb") as file:
+        save(file, codes=sentence.codes, scale=sentence.scale, offset=sentence.offset, header=np.array(json.dumps(header)))
+    os.replace(path + ".tmp", path)
+
+
+def read_compressed(path):
+    with np.load(path) as data:
+        return CompressedSentence(data["codes"], data["scale"], data["offset"], json.loads(str(data["header"])))
+
+
+class VertexStore:
+    """
+    Decoder of a store folder, the neutral and basis of every subject are read once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._neutrals = {}
+        self._bases = {}
+
+    def names(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".npz"))
+
+    def neutral(self, date_subject):
+        if date_subject not in self._neutrals:
+            self._neutrals[date_subject] = np.load(neutral_path(self.path, date_subject))
+        return self._neutrals[date_subject]
+
+    def basis(self, date_subject):
+        if date_subject not in self._bases:
+            self._bases[date_subject] = np.load(basis_path(self.path, date_subject))
+        return self._bases[date_subject]
+
+    def sentence(self, name):
+        return read_compressed(os.path.join(self.path, os.path.splitext(name)[0] + ".npz"))
+
+    def load(self, name, rows=slice(None), out=None):
+        """
+        Decoded (frames, frame_size) float32 frames of the sentence {date_subject}_{scenario_id}.
+        """
+        date_subject, _ = split_sentence_name(name)
+        sentence = self.sentence(name)
+        basis = self.basis(date_subject) if sentence.header["mode"] == "pca" else None
+        return decode(sentence, self.neutral(date_subject), basis, rows, out)
+
+
+def compress_sentences(sentence_dir, store_dir, subjects=None, names=None, mode="delta", tolerance=1e-4, components=128,
+                       samples=1024, neutral=None, compress=False, refit=False):
+    """
+    Encode the packed sentences of sentence_dir (only names if given) into store_dir.
+    The neutral of a subject is neutral ({subject} replaced by the subject) or the first frame of
+    its first sentence, saved in the store the first time and reused after. The PCA basis is fit on
+    up to samples frames of all the sentences of the subject the first time, or again with refit.
+    Returns ({name: header}, {name: error}) of the encoded and the failed sentences.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    loader = SentenceLoader(sentence_dir, subjects)
+    by_subject = {}
+    for number, name in enumerate(loader.names):
+        if names is None or name in names:
+            by_subject.setdefault(split_sentence_name(name)[0], []).append(number)
+
+    headers = {}
+    failures = {}
+    for date_subject, numbers in by_subject.items():
+        subject_neutral = neutral_path(store_dir, date_subject)
+        if not os.path.exists(subject_neutral):
+            if neutral:
+                reference = load_neutral(neutral.replace("{subject}", date_subject))
+            else:
+                first = min(number for number, name in enumerate(loader.names) if split_sentence_name(name)[0] == date_subject)
+                reference = np.asarray(loader.sentence(first)[0], dtype=np.float32)
+            np.save(subject_neutral, reference.astype(np.float32))
+        reference = np.load(subject_neutral)
+
+        basis = None
+        if mode == "pca":
+            subject_basis = basis_path(store_dir, date_subject)
+            if refit or not os.path.exists(subject_basis):
+                subject_numbers = [number for number, name in enumerate(loader.names) if split_sentence_name(name)[0] == date_subject]
+                subject_frames = np.concatenate([np.arange(loader.offsets[number], loader.offsets[number + 1]) for number in subject_numbers])
+                sample = np.sort(np.random.default_rng(0).choice(subject_frames, min(samples, len(subject_frames)), replace=False))
+                with metrics.span("fit_basis", items=len(sample), subject=date_subject, components=components):
+                    np.save(subject_basis, fit_basis(loader.gather(sample), reference, components))
+            basis = np.load(subject_basis)
+
+        for number in numbers:
+            name = loader.names[number]
+            frames = loader.sentence(number)
+            try:
+                with metrics.span("compress_sentence", items=len(frames), subject=date_subject, mode=mode):
+                    sentence = encode(frames, reference, mode, basis, tolerance)
+            except ValueError as error:
+                failures[name] = error
+                print(f"Failed to compress {name}: {error}")
+                continue
+            write_compressed(os.path.join(store_dir, os.path.splitext(name)[0] + ".npz"), sentence, compress)
+            headers[name] = sentence.header
+            print(f"Compressed {name}: {sentence.header['mode']}, max error {sentence.header['max_error']:.3g}")
+    return headers, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed store of the packed sentences")
+    parser.add_argument("command", type=str, choices=["compress", "verify"], help="Encode the sentences, or check the store against them")
+    parser.add_argument("--base_data_path", type=str, help="Dataset root containing vertices_npy_untrimmed/", default='/data6/leoho/vasilisa')
+    parser.add_argument("--subjects", type=str, nargs="*", help="Subjects to compress, all subjects by default", default=None)
+    parser.add_argument("--mode", type=str, choices=MODES, help="Quantize the deltas or the PCA coefficients of the deltas", default="delta")
+    parser.add_argument("--tolerance", type=float, help="Largest coordinate error of a decoded frame", default=1e-4)
+    parser.add_argument("--components", type=int, help="PCA basis size", default=128)
+    parser.add_argument("--samples", type=int, help="Frames of a subject the PCA basis is fit on", default=1024)
+    parser.add_argument("--neutral", type=str, help="Neutral mesh (.npy or .obj), {subject} is replaced by the subject, the first frame of the subject by default", default=None)
+    parser.add_argument("--zlib", action="store_true", help="Also zlib compress the codes")
+    parser.add_argument("--refit", action="store_true", help="Fit the PCA basis again")
+    args = parser.parse_args()
+
+    sentence_dir = os.path.join(args.base_data_path, UNTRIMMED_DIR)
+    store_dir = os.path.join(args.base_data_path, STORE_DIR)
+    if args.command == "compress":
+        _, failures = compress_sentences(sentence_dir, store_dir, args.subjects, mode=args.mode, tolerance=args.tolerance,
+                                         components=args.components, samples=args.samples, neutral=args.neutral,
+                                         compress=args.zlib, refit=args.refit)
+        if failures:
+            sys.exit(1)
+    else:
+        store = VertexStore(store_dir)
+        loader = SentenceLoader(sentence_dir, args.subjects)
+        failed = 0
+        for number, name in enumerate(loader.names):
+            if not os.path.exists(os.path.join(store_dir, os.path.splitext(name)[0] + ".npz")):
+                continue
+            error = float(np.abs(store.load(name) - loader.sentence(number)).max())
+            recorded = store.sentence(name).header["max_error"]
+            failed += error > recorded * (1 + 1e-6) + 1e-12
+            print(f"{name}: max error {error:.3g}, recorded {recorded:.3g}")
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()